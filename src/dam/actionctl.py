@@ -2,6 +2,7 @@ import os
 import sys
 from json import loads
 import shutil
+from copy import deepcopy
 from pprint import pprint
 
 from django.core.management import setup_environ
@@ -306,6 +307,34 @@ image_renditions = {
     },
 }
 
+# same renditions as image_renditions, generated by a single adapt_image action that
+# decodes the original once: fullscreen first, preview and thumbnail resized from it
+image_renditions_single_decode = deepcopy(image_renditions)
+for name in ('thumbnail_image', 'preview_image', 'fullscreen_image'):
+    del image_renditions_single_decode[name]
+image_renditions_single_decode['renditions_image'] = {
+        'script_name': 'adapt_image', 
+        'params':{
+            'actions':['resize'],
+            'resize_h': [800, 300, 100],
+            'resize_w': [800, 300, 100],
+            'source_variant_name': 'original',
+            'output_variant_name': ['fullscreen', 'preview', 'thumbnail'],
+            'output_extension' : ['.jpeg', '.jpeg', '.jpg'],
+            },
+         'in': ['fe', 'fx'],
+         'out':['fullscreen', 'preview', 'thumbnail'],   
+                                          'label': 'renditions',
+                                          'x': 512,
+                                          'y': 409,
+    }
+
+# same as image_renditions, with the thumbnail resized from the preview instead of
+# the original
+image_renditions_thumbnail_from_preview = deepcopy(image_renditions)
+image_renditions_thumbnail_from_preview['thumbnail_image']['params']['source_variant_name'] = 'preview'
+image_renditions_thumbnail_from_preview['thumbnail_image']['in'] = ['preview']
+
 doc_renditions = {
     'extract_original': {
         'script_name':  'extract_basic',
@@ -583,6 +612,10 @@ Usage: script_test.py <action> <arguments>
     registers the pipeline described in the global dict "actions" with the name up1,
     to react to the trigger "upload", for all types "image/*"
 
+  python actionctl.py register upload_image upload image image_renditions_single_decode
+    registers the image renditions generated with a single decode of the original
+    (or image_renditions_thumbnail_from_preview: thumbnails resized from the preview)
+
   python actionctl.py execpipes upload megan-fox*.jpg
     exec all tipes registered for trigger upload on the files megan-fox*.jpg 
 """
@@ -45,7 +45,7 @@ from dam.treeview.models import InvalidNode,  WrongWorkspace,  NotMovableNode,
 from dam.mprocessor.models import Pipeline 
 from dam.workspace.views import _add_items_to_ws, _search
 from dam.api.models import Secret,  Application
-from dam.metadata.models import MetadataValue,  MetadataProperty,  MetadataLanguage
+from dam.metadata.models import MetadataValue,  MetadataProperty,  MetadataLanguage, get_schema_cache
 from dam.preferences.views import get_lang_pref
 from dam.kb.models import Object as KBObject
 from dam.upload.views import _upload_variant, _upload_resource_via_raw_post_data, _upload_resource_via_post
@@ -1083,6 +1083,7 @@ class ItemResource(ModResource):
         
         ctype = ContentType.objects.get_for_model(item)
         
+        schemas = get_schema_cache()
         new_metadata = {}
         for data in metadata.keys():         
             logger.debug('data %s'%data) 
@@ -1091,7 +1092,7 @@ class ItemResource(ModResource):
             except:
                 raise ArgsValidationError({'metadata': ['metadata schema are not formatted properly' % data]})
             try:
-                property = MetadataProperty.objects.get(namespace__prefix = property_namespace,  field_name = property_field_name)
+                property = schemas.get_property(property_namespace, property_field_name)
             except MetadataProperty.DoesNotExist:
                 raise ArgsValidationError({'metadata': ['metadata schema %s unknown' % data]})
                 
@@ -1109,13 +1110,13 @@ class ItemResource(ModResource):
                 
 #                dict
 
-            elif property.type in XMPStructure.objects.all().values_list('name',  flat = True):
+            elif schemas.get_structure(property.type) is not None:
 #                list of dict
                 
                 if not isinstance(metadata[data],  list):
                     raise ArgsValidationError({'metadata': ['format of metadata %s is invalid; it must be a list of dictionaries' % data]})
                 
-                structure = XMPStructure.objects.get(name = property.type)
+                structure = schemas.get_structure(property.type)
                 structure_list = []
                 
                 for _structure in metadata[data]:
@@ -1126,11 +1127,11 @@ class ItemResource(ModResource):
                     for el in _structure.keys():
                         property_namespace,   property_field_name = el.split('_')
                         try:
-                            el_property = MetadataProperty.objects.get(namespace__prefix = property_namespace,  field_name = property_field_name)
+                            el_property = schemas.get_property(property_namespace, property_field_name)
                         except MetadataProperty.DoesNotExist:
                             raise ArgsValidationError({'metadata': ['metadata schema %s unknown' % el]})
                         logger.debug('structure %s'%structure)
-                        if el_property not in structure.properties.all():
+                        if el_property not in structure:
                             raise ArgsValidationError({'metadata': ['unexpected property %s' % el]})
                         
                         tmp_dict[str(el_property.pk)] = _structure[el]
@@ -1201,7 +1202,7 @@ class ItemResource(ModResource):
         def convert_property(metadata):
             
             property_id = metadata.keys()[0]
-            property = MetadataProperty.objects.get(pk = property_id)
+            property = get_schema_cache().get_property_by_pk(property_id)
             
             converted_metadata = {}
             property_key = '%s_%s'%(property.namespace.prefix , property.field_name)            
@@ -1219,7 +1220,7 @@ class ItemResource(ModResource):
                     for value in values:
                         inner_dict = {}
                         for key  in value.keys():
-                            inner_property = MetadataProperty.objects.get(pk = key)            
+                            inner_property = get_schema_cache().get_property_by_pk(key)
                             
                             inner_property_key = '%s_%s'%(inner_property.namespace.prefix , inner_property.field_name)            
                             inner_dict[inner_property_key] = value[key]
@@ -1269,6 +1270,7 @@ class ItemResource(ModResource):
         if language:
             tmp['metadata_language'] = language    
 
+        schemas = get_schema_cache()
         if metadata:
             tmp['metadata'] = {}    
         if str(metadata[0]) == '*':
@@ -1276,17 +1278,18 @@ class ItemResource(ModResource):
                 all_item_metadata = MetadataValue.objects.filter(item = item)
                 #logger.debug('all_item_metadata: %s' % all_item_metadata)
                 for metadata in all_item_metadata:
-                    if language != None and metadata.schema.type == 'lang': 
-                        mv = MetadataValue.objects.get(schema = metadata.schema, item = item, language = language)
-                        tmp['metadata'][metadata.schema.namespace.prefix + ':' + metadata.schema.field_name] = mv.value
+                    schema = schemas.get_property_by_pk(metadata.schema_id)
+                    if language != None and schema.type == 'lang': 
+                        mv = MetadataValue.objects.get(schema = schema, item = item, language = language)
+                        tmp['metadata'][schema.namespace.prefix + ':' + schema.field_name] = mv.value
                     else:
-                        mvalues = MetadataValue.objects.filter(schema = metadata.schema, item = item)
+                        mvalues = MetadataValue.objects.filter(schema = schema, item = item)
                         if len(mvalues) == 1:
-                            tmp['metadata'][metadata.schema.namespace.prefix + ':' + metadata.schema.field_name] = mvalues[0].value
+                            tmp['metadata'][schema.namespace.prefix + ':' + schema.field_name] = mvalues[0].value
                         elif len(mvalues) > 1:
-                            tmp['metadata'][metadata.schema.namespace.prefix + ':' + metadata.schema.field_name] = []
+                            tmp['metadata'][schema.namespace.prefix + ':' + schema.field_name] = []
                             for mv in mvalues:
-                                tmp['metadata'][metadata.schema.namespace.prefix + ':' + metadata.schema.field_name].append(mv.value)
+                                tmp['metadata'][schema.namespace.prefix + ':' + schema.field_name].append(mv.value)
  
         else: 
 
@@ -1294,7 +1297,7 @@ class ItemResource(ModResource):
                 property_namespace, property_field_name = m.split(':')
                 
                 try:
-                    property = MetadataProperty.objects.get(namespace__prefix__iexact = property_namespace,  field_name__iexact = property_field_name)
+                    property = schemas.get_property(property_namespace, property_field_name)
                     if language != None and property.type == 'lang':
                         mv = MetadataValue.objects.get(schema = property, item = item, language = language)
                     else:
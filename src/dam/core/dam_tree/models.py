@@ -17,6 +17,21 @@
 #########################################################################
 
 from django.db import models
+from django.db.models import F, Max
+import hashlib
+
+def path_hash(path):
+    """
+    Returns the hash of a node path, indexed to look nodes up by path
+    """
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return hashlib.sha1(path).hexdigest()
+
+def _join_path(parent_path, label):
+    if parent_path:
+        return parent_path + '/' + label
+    return label
 
 class NodeManager(models.Manager):
     
@@ -26,18 +41,18 @@ class NodeManager(models.Manager):
         """
         Finds the node identified by the given path 
         """
-        def _to_path(nodes):
-            return separator.join([n.label for n in nodes])
-            
-        labels = path.split(separator)
-        if labels:
-            nodes = Node.objects.filter(label = labels.pop(),  type = type)
-            for node in nodes:
-                node_path = _to_path(node.get_ancestors().exclude(depth = 0)) 
-                if node_path == path:
-                    return node
-        
-        return None
+        return self.get_from_paths([path], type, separator).get(path)
+
+    def get_from_paths(self, paths, type = 'collection', separator='/'):
+        """
+        Finds with a single query the nodes identified by the given paths,
+        returns a dictionary path: node (paths not found are missing)
+        """
+        wanted = dict([('/'.join(p.split(separator)), p) for p in paths])
+        if not wanted:
+            return {}
+        nodes = self.filter(type = type, path_hash__in = [path_hash(p) for p in wanted]).exclude(depth = 0)
+        return dict([(wanted[n.path], n) for n in nodes if n.path in wanted])
                 
     def get_root(self, type):        
         """
@@ -51,6 +66,12 @@ class NodeManager(models.Manager):
         """
         self.get_root(type).rebuild_tree(1)
 
+    def add_nodes(self, parent, nodes, **fields):
+        """
+        Adds a whole branch under parent (see AbstractNode.add_branch)
+        """
+        return parent.add_branch(nodes, **fields)
+
     def get_tree(self, type):
         """
         Returns the tree
@@ -76,6 +97,9 @@ class AbstractNode(models.Model):
     
     lft = models.PositiveIntegerField(editable=False,default=1)
     rgt  = models.PositiveIntegerField(editable=False,default=1)
+    # labels from the root (excluded) to the node, separated by '/'
+    path = models.TextField(editable=False, default='')
+    path_hash = models.CharField(max_length=40, editable=False, default='', db_index=True)
     creation_date = models.DateField(auto_now_add=True)
     objects = NodeManager()
     
@@ -84,26 +108,117 @@ class AbstractNode(models.Model):
     
     def save(self,*args,  **kwargs):
         """
-        Saves the node and checks if the tree needs to be rebuild
+        Saves the node, updating the nested set if the node is new
+        or its parent changed, and the paths of its branch if it was
+        moved or renamed
         """
-        rebuild_tree = False
+        old_path = None
         if self.id:
             db_node = self.__class__.objects.get(pk = self.pk)
-            if db_node.parent != self.parent:
-                rebuild_tree = True
+            # bounds of this instance may be stale, the db ones are right
+            self.lft, self.rgt = db_node.lft, db_node.rgt
+            old_path = self.path = db_node.path
+            if db_node.parent_id != self.parent_id:
+                self.depth = db_node.depth
+                self._move()
+                self._set_path()
+            elif db_node.label != self.label:
+                self._set_path()
         else:
-#            just creating the node
-            rebuild_tree = True
+            self._insert()
+            self._set_path()
         
         models.Model.save(self, *args, **kwargs)         
-        
-        if rebuild_tree:
-            try:
-                root = self.__class__.objects.filter(depth= 0, type = self.type)
-                root[0].rebuild_tree(1)
-            except Exception,  ex:
-                raise ex    
+        if old_path is not None and old_path != self.path:
+            self._update_branch_paths(old_path)
     
+    def _tree(self):
+        """
+        Returns the nodes sharing the nested set of the current node
+        """
+        return self.__class__.objects.filter(type = self.type)
+
+    def _parent_bounds(self):
+        """
+        Returns (rgt, depth) of the parent, as stored in db
+        """
+        return self.__class__.objects.filter(pk = self.parent_id).values_list('rgt', 'depth')[0]
+
+    def _set_path(self):
+        if self.parent_id is None or self.depth == 0:
+            self.path = ''
+        else:
+            parent_path = self.__class__.objects.filter(pk = self.parent_id).values_list('path', flat = True)[0]
+            self.path = _join_path(parent_path, self.label)
+        self.path_hash = path_hash(self.path)
+
+    def _update_branch_paths(self, old_path):
+        """
+        Replaces old_path with the current path of the node in the paths
+        of its descendants
+        """
+        for pk, path in self._tree().filter(lft__gt = self.lft, lft__lt = self.rgt).values_list('pk', 'path'):
+            path = self.path + path[len(old_path):]
+            self.__class__.objects.filter(pk = pk).update(path = path, path_hash = path_hash(path))
+
+    def _open_gap(self, tree, position, width):
+        """
+        Shifts right by width the bounds from position on
+        """
+        tree.filter(rgt__gte = position).update(rgt = F('rgt') + width)
+        tree.filter(lft__gte = position).update(lft = F('lft') + width)
+
+    def _close_gap(self, tree, position, width):
+        """
+        Shifts left by width the bounds after position
+        """
+        tree.filter(rgt__gt = position).update(rgt = F('rgt') - width)
+        tree.filter(lft__gt = position).update(lft = F('lft') - width)
+
+    def _insert(self):
+        """
+        Makes room for a new node as the last child of its parent
+        (or at the end of the tree, if it has no parent)
+        """
+        tree = self._tree()
+        if self.parent_id is None:
+            right = tree.aggregate(Max('rgt'))['rgt__max'] or 0
+            self.lft, self.rgt = right + 1, right + 2
+        else:
+            right, depth = self._parent_bounds()
+            self._open_gap(tree, right, 2)
+            self.lft, self.rgt = right, right + 1
+            self.depth = depth + 1
+
+    def _move(self):
+        """
+        Moves the branch of the node under its new parent, as its last child.
+        The branch is first parked after the end of the tree, then the gap
+        it leaves is closed and a new one is opened under the parent.
+        """
+        tree = self._tree()
+        left, right = self.lft, self.rgt
+        width = right - left + 1
+        top = tree.aggregate(Max('rgt'))['rgt__max']
+        if self.parent_id is None:
+            depth = 0
+        else:
+            parent_right, depth = self._parent_bounds()
+            if left <= parent_right <= right:
+                raise ValueError('a node cannot be moved under itself')
+            depth += 1
+
+        tree.filter(lft__gte = left, rgt__lte = right).update(lft = F('lft') + top, rgt = F('rgt') + top, depth = F('depth') + (depth - self.depth))
+        self._close_gap(tree.filter(lft__lte = top), right, width)
+        
+        if self.parent_id is None:
+            position = (tree.filter(rgt__lte = top).aggregate(Max('rgt'))['rgt__max'] or 0) + 1
+        else:
+            position = self._parent_bounds()[0]
+            self._open_gap(tree.filter(lft__lte = top), position, width)
+        tree.filter(lft__gt = top).update(lft = F('lft') + (position - left - top), rgt = F('rgt') + (position - left - top))
+        self.lft, self.rgt, self.depth = position, position + width - 1, depth
+
     def get_path(self):
         """
         Returns the path for the current node
@@ -118,17 +233,69 @@ class AbstractNode(models.Model):
     
     def rebuild_tree(self, left):
         """
-        Rebuilds tree
+        Rebuilds the nested set of the branch of the node from scratch,
+        starting from left; returns the first free position after it.
+        Paths are rebuilt too. Only the nodes that change are written
         """
-        right = left+1
-        for c in self.__class__.objects.filter(parent=self).order_by('depth'):
-            right = c.rebuild_tree(right)
+        children = {}
+        rows = {}
+        for pk, parent, label, lft, rgt, path in self._tree().values_list('pk', 'parent', 'label', 'lft', 'rgt', 'path').order_by('pk'):
+            children.setdefault(parent, []).append(pk)
+            rows[pk] = (label, lft, rgt, path)
         
-        self.lft = left
-        self.rgt = right
+        new_rows = {}
+        def _visit(pk, left, path):
+            right = left + 1
+            for c in children.get(pk, ()):
+                right = _visit(c, right, _join_path(path, rows[c][0]))
+            new_rows[pk] = (rows[pk][0], left, right, path)
+            return right + 1
+        right = _visit(self.pk, left, self.depth and self.path or '')
         
-        super(self.__class__, self).save()
-        return right+1
+        for pk, (label, lft, rgt, path) in new_rows.iteritems():
+            if rows[pk] != (label, lft, rgt, path):
+                self.__class__.objects.filter(pk = pk).update(lft = lft, rgt = rgt, path = path, path_hash = path_hash(path))
+        self.lft, self.rgt = new_rows[self.pk][1:3]
+        return right
+
+    def add_branch(self, nodes, **fields):
+        """
+        Adds a whole branch as the last children of the node, with a couple
+        of queries for each level of the branch.
+        nodes is a list of (label, children), where children is a list of the
+        same kind; fields are set on all the new nodes.
+        Returns the number of nodes added
+        """
+        levels = []         # for each depth, list of (label, lft, rgt, path, lft of the parent)
+        def _visit(nodes, depth, parent_left, parent_path, left):
+            if nodes and len(levels) <= depth:
+                levels.append([])
+            for label, children in nodes:
+                path = _join_path(parent_path, label)
+                right = _visit(children, depth + 1, left, path, left + 1)
+                levels[depth].append((label, left, right, path, parent_left))
+                left = right + 1
+            return left
+
+        tree = self._tree()
+        self.lft, self.rgt, self.depth, self.path = tree.filter(pk = self.pk).values_list('lft', 'rgt', 'depth', 'path')[0]
+        start = self.rgt
+        end = _visit(nodes, 0, self.lft, self.path, start)
+        width = end - start
+        if not width:
+            return 0
+        self._open_gap(tree, start, width)
+        self.rgt += width
+
+        parents = {self.lft: self.pk}
+        for depth, level in enumerate(levels):
+            depth += self.depth + 1
+            self.__class__.objects.bulk_create([self.__class__(label = label, lft = lft, rgt = rgt, depth = depth, path = path, path_hash = path_hash(path),
+                                                               parent_id = parents[parent_left], **fields)
+                                                for label, lft, rgt, path, parent_left in level])
+            if depth - self.depth < len(levels):
+                parents = dict(tree.filter(depth = depth, lft__gte = start, lft__lt = end).values_list('lft', 'pk'))
+        return width / 2
         
     def get_ancestors(self):
         """
@@ -154,11 +321,12 @@ class AbstractNode(models.Model):
     
     def delete(self,  *args,  **kwargs):
         """
-        Deletes node
+        Deletes the node and its branch, closing the gap they leave
         """
+        tree = self._tree()
+        left, right = tree.filter(pk = self.pk).values_list('lft', 'rgt')[0]
         super(AbstractNode, self).delete(*args,  **kwargs)
-        root = self.__class__.objects.filter(depth= 0, type = self.type)
-        root[0].rebuild_tree(1)
+        self._close_gap(tree, right, right - left + 1)
 
     def __str__(self):
         return unicode(self.label)
@@ -18,6 +18,25 @@
 Ext.onReady(function(){ 
     Ext.QuickTips.init();
     
+    // polls the status of an archive built in background, and opens it when ready;
+    // gives up after max_archive_polls requests (an hour)
+    var max_archive_polls = 1800;
+    var wait_archive = function(status_url, polls) {
+        polls = polls || 0;
+        Ext.Ajax.request({
+            url: status_url,
+            success: function(response){
+                var obj = Ext.decode(response.responseText);
+                if (obj.status == 'ready')
+                    window.open(obj.url);
+                else if (obj.status == 'running' && polls < max_archive_polls)
+                    wait_archive.defer(2000, this, [status_url, polls + 1]);
+                else
+                    Ext.Msg.alert(gettext('Download'), gettext('Archive creation failed'));
+            }
+        });
+    };
+    
     
     var members_configuration = function() {
 
@@ -1008,7 +1027,10 @@ Ext.onReady(function(){
                                         params: post,
                                         success: function(response){
                                             var obj = Ext.decode(response.responseText);
-                                            window.open(obj.url);
+                                            if (obj.url)
+                                                window.open(obj.url);
+                                            else if (obj.status_url)
+                                                wait_archive(obj.status_url);
                                             
                                         }
                                         
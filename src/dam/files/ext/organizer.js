@@ -35,6 +35,8 @@ var ws_homepage_pref_store = new Ext.data.JsonStore({
 ws_homepage_pref_store.load();
 
 var task;
+var status_since = null; // last progress notification seen by get_status
+var status_request_pending = false;
 function set_status_bar_busy(){
 	var sb = Ext.getCmp('dam_statusbar');
 	if(sb)
@@ -1519,7 +1521,7 @@ Ext.onReady(function(){
 //				update_script_monitor = script_monitor_win.update_progress();
 				
             
-            if (items.length > 0 || update_script_monitor){
+            if ((items.length > 0 || update_script_monitor) && !status_request_pending){
             	var params = {};
             	
             	if (items.length > 0)
@@ -1527,14 +1529,28 @@ Ext.onReady(function(){
             		
             	if (update_script_monitor)
             		params.update_script_monitor = true;
+            	
+            	if (status_since != null)
+            		params.since = status_since;
 				
+            	status_request_pending = true;
             	Ext.Ajax.request({
                 url: '/get_status/',
                 params: params,
+                timeout: 60000, // get_status waits for progress notifications
+                
+                failure: function(){
+                	status_request_pending = false;
+                	status_since = null;
+                },
                 
                 success: function(data){    
 //                    set_status_bar_busy();
+                    status_request_pending = false;
                     data = Ext.decode(data.responseText);
+                    status_since = data.since;
+                    if (data.live)
+                    	task.run.defer(100);
                     if (data.scripts){
                     	var monitor = Ext.getCmp('script_monitor_list')
                     	if (monitor){
@@ -1611,7 +1627,8 @@ Ext.onReady(function(){
                         }
                     }
 
-					update_task_status(data);
+					if (data.status_bar)
+						update_task_status(data);
 
                 }
             });
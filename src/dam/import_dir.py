@@ -23,6 +23,7 @@ import sys
 from django.contrib.auth.models import User
 from dam.workspace.models import DAMWorkspace as Workspace
 from dam.upload.views import import_dir
+from dam.mprocessor.models import Process
 from optparse import OptionParser
 import time
 import logging
@@ -94,9 +95,15 @@ def check_user(username, password, workspace_id):
         raise InsufficientPermissions
     return user, ws
 
-def _import_dir(user, ws, dir_path, recursive, force_generation, link, remove_orphans):
+def print_import_progress(files_read, items_imported):
+    print 'Files read: %s, items imported: %s' % (files_read, items_imported), "\r",
+    sys.stdout.flush()
 
-    items_deleted ,processes = import_dir(dir_path, user, ws, make_copy = True, recursive = recursive, force_generation = force_generation, link = link, remove_orphans=remove_orphans)
+def _import_dir(user, ws, dir_path, recursive, force_generation, link, remove_orphans, workers):
+
+    items_deleted ,processes = import_dir(dir_path, user, ws, make_copy = True, recursive = recursive, force_generation = force_generation, link = link, remove_orphans=remove_orphans, 
+                                          workers = workers, progress = print_import_progress)
+    print ''
     return items_deleted, processes
     
 
@@ -109,7 +116,7 @@ def print_progress(items_deleted, processes):
 
     total_items = 0
     for process in processes:        
-        total_items += process.processtarget_set.all().count()
+        total_items += process.targets
     
     print '\nProcessing %s item(s)... \nNote that closing the shell will not interrupt the processing.\n'%total_items
     total_progress = 0
@@ -118,6 +125,8 @@ def print_progress(items_deleted, processes):
     #print '\nProcessing %s item(s)...\n'%items.count()
     while total_progress <=100:
         total_progress = 0
+        # reload the progress counters written by the mprocessor
+        processes = list(Process.objects.filter(pk__in = [process.pk for process in processes]))
         
         for process in processes:   
             items_completed, items_failed, total_items, progress = process.get_progress()
@@ -148,6 +157,7 @@ if __name__ == "__main__":
     parser.add_option("-l", help="create links inside NotreDAM storage, instead of copying the files", default= False, dest='link', action = 'store_true')
     parser.add_option("-U", help="update modified files. The original rendition will be replaced and new renditions will be generated", default= False, dest='force_generation', action = 'store_true')
     parser.add_option("-R", help="remove orphan items, ie items whose relative file has been deleted", default= False, dest='remove_orphans', action = 'store_true')
+    parser.add_option("-j", "--jobs", help="number of files copied in parallel (default 4)", default = 4, type = 'int', dest='workers')
 
     (opts, args) = parser.parse_args()
    
@@ -174,7 +184,7 @@ if __name__ == "__main__":
     password = getpass.getpass()
     try:
         user, ws = check_user(opts.username, password, opts.workspace_id)
-        items_deleted, processes = _import_dir(user, ws, dir_path, opts.recursive, opts.force_generation, opts.link, opts.remove_orphans)
+        items_deleted, processes = _import_dir(user, ws, dir_path, opts.recursive, opts.force_generation, opts.link, opts.remove_orphans, opts.workers)
         print_progress(items_deleted, processes)
 
     except LoginFailed:
@@ -1,19 +1,27 @@
 import os, sys, hashlib
 
-def md5(fileName, excludeLine="", includeLine=""):
+BUFSIZE = 1024*1024
+
+def md5(fileName, excludeLine="", includeLine="", bufsize=BUFSIZE):
     """Compute md5 hash of the specified file"""
     m = hashlib.md5()
     try:
         fd = open(fileName,"rb")
     except IOError:
-        print "Unable to open the file in readmode:", filename
+        print "Unable to open the file in readmode:", fileName
         return
-    content = fd.readlines()
-    fd.close()
-    for eachLine in content:
-        if excludeLine and eachLine.startswith(excludeLine):
-            continue
-        m.update(eachLine)
+    try:
+        if excludeLine:
+            for eachLine in fd:
+                if eachLine.startswith(excludeLine):
+                    continue
+                m.update(eachLine)
+        else:
+            buf = fd.read(bufsize)
+            while buf:
+                m.update(buf)
+                buf = fd.read(bufsize)
+    finally:
+        fd.close()
     m.update(includeLine)
     return m.hexdigest()
-
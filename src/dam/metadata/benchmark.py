@@ -0,0 +1,92 @@
+"""
+Benchmark of the bulk metadata writes.
+
+Creates a test database with synthetic items and, for each selection size,
+times MetadataValue.objects.save_metadata_value and save_descriptor_values on
+the whole selection, counting their queries: first writes, writes of the same
+values (nothing to change) and edits of a single property.
+
+Typical usage:
+
+python benchmark.py -s 100,1000,2000
+"""
+from django.core.management import setup_environ
+from dam import settings
+setup_environ(settings)
+
+import sys
+import time
+from optparse import OptionParser
+
+from django.conf import settings as django_settings
+from django.db import connection, reset_queries
+from django.contrib.auth.models import User
+
+from dam.core.dam_repository.models import Type
+from dam.core.dam_metadata.models import XMPNamespace
+from dam.repository.models import Item
+from dam.workspace.models import DAMWorkspace, WorkspaceItem
+from dam.metadata.models import MetadataProperty, MetadataDescriptor, MetadataValue, schemas_changed
+
+
+def make_schemas(media_type):
+    "Creates the properties and the descriptor written by the benchmark"
+    ns = XMPNamespace.objects.create(name='benchmark', uri='http://benchmark/', prefix='bench')
+    properties = {}
+    for field_name, type, is_array in [('title', 'lang', 'alt'), ('subject', 'txt', 'bag'), ('source', 'txt', 'not_array')]:
+        p = MetadataProperty.objects.create(namespace=ns, field_name=field_name, caption=field_name, description=field_name,
+                                            type=type, is_array=is_array)
+        p.media_type.add(media_type)
+        properties[field_name] = p
+    descriptor = MetadataDescriptor.objects.create(name='benchmark', description='benchmark')
+    descriptor.properties.add(properties['subject'], properties['source'])
+    schemas_changed()
+    return properties, descriptor
+
+def make_items(ws, media_type, size):
+    "Creates size items in ws"
+    start = Item.objects.count()
+    Item.objects.bulk_create([Item(type=media_type, _id='bench%d' % n) for n in xrange(start, start + size)])
+    items = list(Item.objects.order_by('-pk')[:size])
+    WorkspaceItem.objects.bulk_create([WorkspaceItem(item=item, workspace=ws) for item in items])
+    return items
+
+def measure(label, operation):
+    reset_queries()
+    start = time.time()
+    operation()
+    elapsed = time.time() - start
+    print >>sys.stderr, '    %-22s %8.2f s %8d queries' % (label, elapsed, len(connection.queries))
+
+def run(ws, media_type, properties, descriptor, size):
+    items = make_items(ws, media_type, size)
+    print >>sys.stderr, '%d items' % size
+    title, subject, source = properties['title'].pk, properties['subject'].pk, properties['source'].pk
+    metadata = {title: [['a title', 'en-US'], ['un titolo', 'it-IT']], subject: ['one', 'two', 'three'], source: 'a source'}
+    save = lambda: MetadataValue.objects.save_metadata_value(items, metadata, 'original', ws)
+    measure('metadata, first write', save)
+    measure('metadata, unchanged', save)
+    metadata[subject] = ['one', 'three', 'four']
+    measure('metadata, one changed', save)
+    measure('descriptor', lambda: MetadataValue.objects.save_descriptor_values(descriptor, items, 'five, six', ws))
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', dest='sizes', default='100,1000,2000', help='comma separated selection sizes')
+    options, args = parser.parse_args()
+
+    django_settings.DEBUG = True       # queries are counted
+    old_name = django_settings.DATABASES['default']['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create(username='benchmark')
+        ws = DAMWorkspace.objects.create(name='benchmark', description='', creator=user)
+        media_type = Type.objects.create(name='benchmark', subname='benchmark', ext='.bnc')
+        properties, descriptor = make_schemas(media_type)
+        for size in [int(s) for s in options.sizes.split(',')]:
+            run(ws, media_type, properties, descriptor, size)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main()
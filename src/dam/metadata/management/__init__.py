@@ -0,0 +1,39 @@
+#########################################################################
+#
+# NotreDAM, Copyright (C) 2009, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it
+# Web: www.notre-dam.org
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#########################################################################
+
+from django.db.models.signals import post_syncdb
+
+from dam.metadata import models as metadata_app
+
+
+def build_indexes(sender, created_models, verbosity=1, **kwargs):
+    """
+    Builds the search index and the journal of the modified metadata from the
+    existing metadata when syncdb creates their tables, e.g. when upgrading an
+    installation
+    """
+    if metadata_app.MetadataToken in created_models:
+        count = metadata_app.MetadataToken.objects.rebuild()
+        if verbosity:
+            print 'Indexed the metadata of %d items' % count
+    if metadata_app.MetadataChange in created_models:
+        count = metadata_app.MetadataChange.objects.rebuild()
+        if verbosity:
+            print 'Logged the modified metadata of %d objects' % count
+
+post_syncdb.connect(build_indexes, sender=metadata_app)
@@ -0,0 +1,50 @@
+#########################################################################
+#
+# NotreDAM, Copyright (C) 2009, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it
+# Web: www.notre-dam.org
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#########################################################################
+
+from optparse import make_option
+from django.core.management.base import NoArgsCommand, CommandError
+from django.contrib.auth.models import User
+
+from dam.metadata.models import MetadataChange
+from dam.mprocessor.models import Pipeline, Process
+
+
+class Command(NoArgsCommand):
+    help = 'Run the sync_xmp pipelines on the items whose metadata changed since they were last embedded'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--variant', dest='variant', default='original',
+                    help='variant the XMP is embedded in'),
+        make_option('--user', dest='user', default='admin',
+                    help='user launching the processes'),
+    )
+
+    def handle_noargs(self, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('unknown user %s' % options['user'])
+        variant = options['variant']
+        count = 0
+        for pipe in Pipeline.objects.filter(triggers__name='sync_xmp').select_related('workspace'):
+            items = list(MetadataChange.objects.get_changed_items(pipe.workspace, variant))
+            if not items:
+                continue
+            process = Process.objects.create(pipeline=pipe, workspace=pipe.workspace, launched_by=user)
+            count += process.add_targets([(pk, {'*': {'source_variant_name': variant}}) for pk in items])
+            process.run()
+        print 'embedding the metadata of %d items' % count
@@ -0,0 +1,36 @@
+#########################################################################
+#
+# NotreDAM, Copyright (C) 2009, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it
+# Web: www.notre-dam.org
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#########################################################################
+
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from dam.metadata.models import MetadataChange
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the journal of the modified metadata read by the XMP embedding'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+                    help='number of objects logged per query'),
+    )
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = MetadataChange.objects.rebuild(options['chunk_size'])
+        print 'logged %d objects' % count
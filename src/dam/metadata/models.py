@@ -16,18 +16,24 @@
 #
 #########################################################################
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.utils.translation import ugettext
 
 
-from dam.core.dam_metadata.models import AbstractMetadataLanguage, XMPProperty, XMPStructure, XMPPropertyChoice
+from dam.core.dam_metadata.models import AbstractMetadataLanguage, XMPNamespace, XMPProperty, XMPStructure, XMPPropertyChoice
 import logging
 logger = logging.getLogger('dam')
 
 import re
+import time
+import datetime
+
+_word_re = re.compile(r'\w+', re.U)
+TOKEN_LENGTH = 64
 
 def convert_rational(s):
     """
@@ -69,6 +75,14 @@ def format_filesize(size):
     else:
         return str(b) + ' bytes'
 
+def _to_text(value):
+    "Returns value as it is read back from a text column"
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if not isinstance(value, unicode):
+        return unicode(value)
+    return value
+
 def set_modified_flag(mtdata, comp):
 
    """
@@ -80,11 +94,194 @@ def set_modified_flag(mtdata, comp):
    if mtdata.modified == False:
        mtdata.modified = True
        mtdata.save()
+       MetadataChange.objects.log_changes(mtdata.content_type_id, [mtdata.object_id])
    if isinstance(comp, Component):
        if comp.modified_metadata == False:
            comp.modified_metadata = True
            comp.save()
 
+class SchemaCache:
+    """
+    In-memory registry of the metadata schemas: properties (by pk and by name),
+    namespaces, choices, media types, structures, descriptors and descriptor
+    groups. Each part is loaded with a single query the first time it is needed;
+    the objects returned are shared and must not be modified.
+    Use get_schema_cache to get the one of the process, which is reloaded when
+    the schemas change (see schemas_changed).
+    """
+    def __init__(self, version=0):
+        self.version = version
+        self._choices = None
+        self._properties = None
+        self._namespaces = None
+        self._media_types = None
+        self._structures = None
+        self._descriptors = None
+        self._groups = None
+
+    def _load_properties(self):
+        if self._properties is None:
+            by_pk, by_name = {}, {}
+            for p in MetadataProperty.objects.select_related('namespace').order_by('pk'):
+                by_pk[p.pk] = p
+                by_name.setdefault((p.namespace.prefix, p.field_name), p)
+                by_name.setdefault(((p.namespace.prefix or '').lower(), p.field_name.lower()), p)
+            self._properties = (by_pk, by_name)
+        return self._properties
+
+    def get_property(self, prefix, field_name):
+        """
+        Returns the MetadataProperty prefix:field_name (matched exactly or, failing
+        that, case insensitively); raises MetadataProperty.DoesNotExist
+        """
+        by_name = self._load_properties()[1]
+        p = by_name.get((prefix, field_name)) or by_name.get(((prefix or '').lower(), field_name.lower()))
+        if p is None:
+            # created after the registry was loaded, or missing
+            p = MetadataProperty.objects.get(namespace__prefix__iexact=prefix, field_name__iexact=field_name)
+        return p
+
+    def get_property_by_pk(self, pk):
+        "Returns the MetadataProperty pk; raises MetadataProperty.DoesNotExist"
+        p = self._load_properties()[0].get(int(pk))
+        if p is None:
+            p = MetadataProperty.objects.get(pk=pk)
+        return p
+
+    def get_namespace(self, prefix):
+        "Returns the XMPNamespace with the given prefix; raises XMPNamespace.DoesNotExist"
+        if self._namespaces is None:
+            self._namespaces = dict([(ns.prefix, ns) for ns in XMPNamespace.objects.all()])
+        ns = self._namespaces.get(prefix)
+        if ns is None:
+            ns = XMPNamespace.objects.get(prefix=prefix)
+        return ns
+
+    def get_choices(self, schema_id):
+        "Returns the list of (value, description) of the choices of a property"
+        if self._choices is None:
+            choices = {}
+            for prop_id, value, description in XMPPropertyChoice.objects.values_list('choice_property', 'value', 'description').order_by('pk'):
+                choices.setdefault(prop_id, []).append((value, description))
+            self._choices = choices
+        return self._choices.get(schema_id, [])
+
+    def get_choice_description(self, schema_id, value):
+        "Returns the description of a choice of a property, None if it has not any"
+        for choice_value, description in self.get_choices(schema_id):
+            if choice_value == value:
+                return description
+        return None
+
+    def get_media_types(self, schema_id):
+        "Returns the set of the names of the media types of a property"
+        if self._media_types is None:
+            media_types = {}
+            for prop_id, name in MetadataProperty.objects.values_list('pk', 'media_type__name'):
+                media_types.setdefault(prop_id, set()).add(name)
+            self._media_types = media_types
+        return self._media_types.get(schema_id, set())
+
+    def get_structure(self, name):
+        "Returns the list of the properties of the structure name, None if there is no such structure"
+        if self._structures is None:
+            by_pk = self._load_properties()[0]
+            structures = {}
+            for structure_name, prop_id in XMPStructure.objects.values_list('name', 'properties').order_by('pk'):
+                structure = structures.setdefault(structure_name, [])
+                if prop_id in by_pk:
+                    structure.append(by_pk[prop_id])
+            self._structures = structures
+        return self._structures.get(name)
+
+    def _load_descriptors(self):
+        if self._descriptors is None:
+            by_pk = self._load_properties()[0]
+            descriptors = dict([(d.pk, (d, [])) for d in MetadataDescriptor.objects.all()])
+            for descriptor_id, prop_id in MetadataDescriptor.properties.through.objects.values_list('metadatadescriptor', 'metadataproperty').order_by('pk'):
+                if descriptor_id in descriptors and prop_id in by_pk:
+                    descriptors[descriptor_id][1].append(by_pk[prop_id])
+            self._descriptors = descriptors
+        return self._descriptors
+
+    def get_descriptor(self, pk):
+        "Returns the MetadataDescriptor pk; raises MetadataDescriptor.DoesNotExist"
+        d = self._load_descriptors().get(int(pk))
+        if d is None:
+            return MetadataDescriptor.objects.get(pk=pk)
+        return d[0]
+
+    def get_descriptor_properties(self, descriptor_id):
+        "Returns the list of the properties of a descriptor"
+        d = self._load_descriptors().get(int(descriptor_id))
+        if d is None:
+            return list(MetadataProperty.objects.filter(metadatadescriptor=descriptor_id).select_related('namespace'))
+        return d[1]
+
+    def _load_groups(self):
+        if self._groups is None:
+            descriptors = self._load_descriptors()
+            groups = [(g, []) for g in MetadataDescriptorGroup.objects.all().order_by('pk')]
+            by_pk = dict([(g.pk, d) for g, d in groups])
+            through = MetadataDescriptorGroup.descriptors.through.objects.order_by('metadatadescriptor__name', 'pk')
+            for group_id, descriptor_id in through.values_list('metadatadescriptorgroup', 'metadatadescriptor'):
+                if group_id in by_pk and descriptor_id in descriptors:
+                    by_pk[group_id].append(descriptors[descriptor_id][0])
+            self._groups = groups
+        return self._groups
+
+    def get_descriptor_groups(self, **flags):
+        """
+        Returns the list of the descriptor groups whose attributes have the
+        given values, e.g. get_descriptor_groups(basic_summary=True)
+        """
+        return [g for g, d in self._load_groups() if all([getattr(g, k) == v for k, v in flags.items()])]
+
+    def get_group_descriptors(self, group_id):
+        "Returns the list of the descriptors of a group, ordered by name"
+        for g, descriptors in self._load_groups():
+            if g.pk == group_id:
+                return descriptors
+        return list(MetadataDescriptor.objects.filter(metadatadescriptorgroup=group_id).order_by('name'))
+
+SCHEMA_CHECK_INTERVAL = 2      # seconds the schema cache of a process is used without checking its version
+_schema_cache = None
+_schema_cache_checked = 0
+
+def get_schema_version():
+    "Returns the current version of the metadata schemas"
+    versions = MetadataSchemaVersion.objects.values_list('version', flat=True)[:1]
+    if versions:
+        return versions[0]
+    return 0
+
+def schemas_changed():
+    """
+    Called after any change of metadata properties, namespaces, choices,
+    structures, descriptors or descriptor groups (see the signal handlers at the
+    end of this module): bumps the version of the schemas, so that every
+    process reloads its SchemaCache
+    """
+    global _schema_cache
+    if not MetadataSchemaVersion.objects.update(version=models.F('version') + 1):
+        MetadataSchemaVersion.objects.create(version=1)
+    _schema_cache = None
+
+def get_schema_cache():
+    """
+    Returns the SchemaCache of the process. The version of the schemas is
+    checked at most every SCHEMA_CHECK_INTERVAL seconds
+    """
+    global _schema_cache, _schema_cache_checked
+    cache = _schema_cache
+    now = time.time()
+    if cache is None or now - _schema_cache_checked > SCHEMA_CHECK_INTERVAL:
+        version = get_schema_version()
+        if cache is None or cache.version != version:
+            cache = _schema_cache = SchemaCache(version)
+        _schema_cache_checked = now
+    return cache
+
 class MetadataLanguage(AbstractMetadataLanguage): pass
     
 class MetadataProperty(XMPProperty):
@@ -108,11 +305,12 @@ class MetadataProperty(XMPProperty):
     class Meta:
         verbose_name_plural = "Metadata properties"
     
-    def metadata_definition(self):
+    def metadata_definition(self, cache=None):
         
         """
         Returns a dictionary containing definition info of a given metadataschema 
         (es. {type: string, array: true, editable: False, ...}
+        Choices are read from cache (a SchemaCache), if given
         """
         
         metadataschema = self
@@ -127,14 +325,18 @@ class MetadataProperty(XMPProperty):
         if metadataschema.is_choice == 'close_choice' or metadataschema.is_choice == 'open_choice':
             choices = []
     
-            for x in metadataschema.property_choices.all():
+            if cache:
+                property_choices = cache.get_choices(metadataschema.pk)
+            else:
+                property_choices = metadataschema.property_choices.values_list('value', 'description')
+            for value, description in property_choices:
                 if metadataschema.is_array != 'not_array':
-                    choices.append(x.value)
+                    choices.append(value)
                 else:
-                    if x.description:
-                        choices.append([x.value, x.description])
+                    if description:
+                        choices.append([value, description])
                     else:
-                        choices.append([x.value, x.value])
+                        choices.append([value, value])
                     
             definition['choices'] = choices
     
@@ -173,9 +375,6 @@ class MetadataManager(models.Manager):
         from django.db import connection
         from dam.repository.models import Item, Component
         
-        to_be_deleted = False
-        multiple_values = False
-    
         values = {}
     
         object_list = []
@@ -204,31 +403,80 @@ class MetadataManager(models.Manager):
         if required_media_types - schema_media_types:
             return None, False, True
         
-        if metadataschema.is_array != 'not_array' or metadataschema.is_choice == 'open_choice':
-            if metadataschema.type == 'lang':
-                values[item_list[0]] = {}
-            else:
-                values[item_list[0]] = []
-        else:
-            values[item_list[0]] = ''
-    
         c = connection.cursor()
         c.execute("select schema_id, value, count(*), language, xpath from metadata_metadatavalue where schema_id=%d AND content_type_id=%d AND object_id IN (%s) GROUP BY schema_id, value, xpath, language;" % (metadataschema.id, ctype.id, str(",".join(object_list))))
 
 #        logger.debug ("select schema_id, value, count(*), language, xpath from metadata_metadatavalue where schema_id=%d AND content_type_id=%d AND object_id IN (%s) GROUP BY schema_id, value, xpath, language;" % (metadataschema.id, ctype.id, str(",".join(object_list))))
 
-        results = [r for r in c.fetchall()]
-        
+        results = [r[1:] for r in c.fetchall()]
+        value, multiple_values, to_be_deleted = self._build_value(metadataschema, results, len(item_list))
+        values[item_list[0]] = value
+        return values, multiple_values, to_be_deleted
+
+    def get_bulk_metadata_values(self, item_list, schemas, items_types, components_types, components_list, cache=None):
+        """
+        Like get_metadata_values, for several metadataschemas: the values of all of them
+        are read with a single grouped query, choices and structure properties come
+        from cache (a SchemaCache, the one of the process if not given).
+        Returns a dictionary {metadataschema pk: (values, multiple_values, to_be_deleted)}
+        """
+        from dam.repository.models import Item, Component
+
+        if cache is None:
+            cache = get_schema_cache()
+        ctype_item = ContentType.objects.get_for_model(Item)
+        ctype_comp = ContentType.objects.get_for_model(Component)
+        components_list = list(components_list)
+
+        rows = {}                          # (schema pk, content type pk) -> list of (value, count, language, xpath)
+        if schemas and item_list:
+            q = models.Q(content_type = ctype_item, object_id__in = item_list)
+            if components_list:
+                q = q | models.Q(content_type = ctype_comp, object_id__in = components_list)
+            values = self.filter(q, schema__in = [s.pk for s in schemas]).values('schema', 'content_type', 'value', 'language', 'xpath')
+            for r in values.annotate(count = Count('pk')).order_by():
+                rows.setdefault((r['schema'], r['content_type']), []).append((r['value'], r['count'], r['language'], r['xpath']))
+
+        ret = {}
+        for metadataschema in schemas:
+            if metadataschema.is_variant:
+                required_media_types, ctype = components_types, ctype_comp
+            else:
+                required_media_types, ctype = items_types, ctype_item
+            if required_media_types - cache.get_media_types(metadataschema.pk):
+                ret[metadataschema.pk] = (None, False, True)
+                continue
+            value, multiple_values, to_be_deleted = self._build_value(metadataschema, rows.get((metadataschema.pk, ctype.pk), []), len(item_list), cache)
+            ret[metadataschema.pk] = ({item_list[0]: value}, multiple_values, to_be_deleted)
+        return ret
+
+    def _build_value(self, metadataschema, results, num_objects, cache=None):
+        """
+        Build the value of metadataschema from the rows (value, count, language, xpath) 
+        read for num_objects objects. Returns (value, multiple_values, to_be_deleted)
+        """
+        if cache is None:
+            cache = get_schema_cache()
+        to_be_deleted = False
+        multiple_values = False
+
+        if metadataschema.is_array != 'not_array' or metadataschema.is_choice == 'open_choice':
+            if metadataschema.type == 'lang':
+                ret = {}
+            else:
+                ret = []
+        else:
+            ret = ''
     
         xpath_re = re.compile(r'(?P<prefix>\w+):(?P<property>\w+)(?P<array_index>\[\d+\]){,1}')
         xpath_values = []
     
         for r in results:
-            value = r[1]
-            count = r[2]
-            language = r[3]
-            xpath = r[4]
-            if r[2] < len(item_list): 
+            value = r[0]
+            count = r[1]
+            language = r[2]
+            xpath = r[3]
+            if count < num_objects: 
                 multiple_values = True
             if metadataschema.type == 'filesize':
                 value = format_filesize(float(value))
@@ -237,10 +485,9 @@ class MetadataManager(models.Manager):
             elif metadataschema.type == 'date_and_time':
                 value = convert_datetime(value)
             if metadataschema.is_choice != 'not_choice':
-                p_choice = metadataschema.property_choices.filter(value=str(value))
-                if p_choice.count() > 0:
-                    if p_choice[0].description:
-                        value = p_choice[0].description
+                description = cache.get_choice_description(metadataschema.pk, unicode(value))
+                if description:
+                    value = description
     
             xpath_splitted = xpath_re.findall(xpath)
     
@@ -258,27 +505,188 @@ class MetadataManager(models.Manager):
                     xpath_values.append({})
     
                 try:
-                    found_property = MetadataProperty.objects.get(namespace__prefix=metadata_ns, field_name__iexact=metadata_property)
-                except Exception, ex:
+                    found_property = cache.get_property(metadata_ns, metadata_property)
+                except MetadataProperty.DoesNotExist:
                     to_be_deleted = True
                     break
                 xpath_values[metadata_index-1][found_property.id] = value
     
-            elif isinstance(values[item_list[0]], list):
-                schema_value = value
-                values[item_list[0]].append(schema_value)
-            elif isinstance(values[item_list[0]], dict):
-                values[item_list[0]][language] = value
+            elif isinstance(ret, list):
+                ret.append(value)
+            elif isinstance(ret, dict):
+                ret[language] = value
             else:
-                values[item_list[0]] = value
+                ret = value
     
         if xpath_values:
-            values[item_list[0]] = xpath_values
+            ret = xpath_values
     
         if (len(results) == 0 or multiple_values) and not metadataschema.editable:
             to_be_deleted = True
         
-        return values, multiple_values, to_be_deleted
+        return ret, multiple_values, to_be_deleted
+
+    def get_objects_values(self, schemas, items, components):
+        """
+        Get the values of several metadataschemas for several objects with a single query.
+
+        <items> is a dictionary {item pk: item media type name}, <components> a dictionary
+        {item pk: (component pk, component media type name)} with the component holding
+        the variant metadata of each item (usually the original one).
+
+        Returns a dictionary {(schema pk, item pk): value}, where value is the one
+        Item.get_metadata_values would return for the item (None if the item has no value).
+        """
+        from dam.repository.models import Item, Component
+
+        ctype_item = ContentType.objects.get_for_model(Item)
+        ctype_comp = ContentType.objects.get_for_model(Component)
+        comp_to_item = dict([(c[0], item_pk) for item_pk, c in components.items()])
+
+        rows = {}                          # (schema pk, item pk) -> set of (value, language, xpath)
+        if schemas and items:
+            q = models.Q(content_type = ctype_item, object_id__in = items.keys())
+            if comp_to_item:
+                q = q | models.Q(content_type = ctype_comp, object_id__in = comp_to_item.keys())
+            for schema_id, ctype_id, object_id, value, language, xpath in self.filter(q, schema__in = schemas).values_list('schema_id', 'content_type_id', 'object_id', 'value', 'language', 'xpath'):
+                if ctype_id == ctype_comp.id:
+                    item_pk = comp_to_item.get(object_id)
+                else:
+                    item_pk = object_id
+                rows.setdefault((schema_id, item_pk), set()).add((value, 1, language, xpath))
+
+        ret = {}
+        cache = get_schema_cache()
+        for schema in schemas:
+            schema_media_types = cache.get_media_types(schema.pk)
+            for item_pk, item_type in items.items():
+                if schema.is_variant:
+                    if item_pk not in components:
+                        continue
+                    media_type = components[item_pk][1]
+                else:
+                    media_type = item_type
+                if media_type not in schema_media_types:
+                    continue
+                value, multiple, delete = self._build_value(schema, list(rows.get((schema.pk, item_pk), [])), 1, cache)
+                if not delete and value:
+                    ret[(schema.pk, item_pk)] = value
+        return ret
+
+    def replace_values(self, new_values, chunk_size=500):
+        """
+        Replaces the metadata values of many objects, writing only what differs
+        from the values already saved.
+        new_values maps (content type pk, object pk, schema pk) to the list of
+        (value, language, xpath) the object must have for the schema; with a key
+        (content type pk, object pk, schema pk, xpath) only the values with that
+        xpath are replaced. The values of a key that changes are flagged as
+        modified, as are the components they belong to, and the object is
+        recorded in the MetadataChange journal.
+        Rows are read and written with a few queries every chunk_size objects,
+        in a single transaction. Returns the number of keys changed.
+        """
+        if transaction.is_managed():
+            # the caller is managing a transaction of its own
+            return self._replace_values(new_values, chunk_size)
+        return transaction.commit_on_success(self._replace_values)(new_values, chunk_size)
+
+    def _replace_values(self, new_values, chunk_size):
+        from dam.repository.models import Component
+
+        ctype_comp = ContentType.objects.get_for_model(Component).pk
+        targets = {}                       # content type -> {(object, schema): (xpath or None, rows)}
+        for key, rows in new_values.iteritems():
+            unique_rows = []
+            for value, language, xpath in rows:
+                row = (_to_text(value), language or None, xpath or '')
+                if row not in unique_rows:
+                    unique_rows.append(row)
+            xpath = None
+            if len(key) > 3:
+                xpath = key[3]
+            targets.setdefault(key[0], {})[(key[1], key[2])] = (xpath, unique_rows)
+
+        changed = 0
+        deleted, inserted, flagged, components = [], [], [], set()
+        changed_objects = {}               # content type -> set of objects
+        for ctype, ctype_targets in targets.iteritems():
+            objects = sorted(set([obj for obj, schema in ctype_targets]))
+            schemas = set([schema for obj, schema in ctype_targets])
+            for start in xrange(0, len(objects), chunk_size):
+                chunk = objects[start:start + chunk_size]
+                current = {}
+                saved = self.filter(content_type=ctype, object_id__in=chunk, schema__in=schemas)
+                for pk, obj, schema, value, language, xpath, modified in saved.values_list('pk', 'object_id', 'schema', 'value', 'language', 'xpath', 'modified'):
+                    current.setdefault((obj, schema), []).append((pk, (value, language or None, xpath), modified))
+
+                for obj in chunk:
+                    for schema in schemas:
+                        if (obj, schema) not in ctype_targets:
+                            continue
+                        only_xpath, rows = ctype_targets[(obj, schema)]
+                        missing = list(rows)
+                        to_delete, kept = [], []
+                        for pk, row, modified in current.get((obj, schema), []):
+                            if only_xpath is not None and row[2] != only_xpath:
+                                continue
+                            if row in missing:
+                                missing.remove(row)
+                                if not modified:
+                                    kept.append(pk)
+                            else:
+                                to_delete.append(pk)
+                        if not to_delete and not missing:
+                            continue
+                        changed += 1
+                        changed_objects.setdefault(ctype, set()).add(obj)
+                        deleted.extend(to_delete)
+                        flagged.extend(kept)
+                        inserted.extend([MetadataValue(content_type_id=ctype, object_id=obj, schema_id=schema, value=value,
+                                                       language=language, xpath=xpath, modified=True) for value, language, xpath in missing])
+                        if ctype == ctype_comp:
+                            components.add(obj)
+
+        for start in xrange(0, len(deleted), chunk_size):
+            self.filter(pk__in=deleted[start:start + chunk_size]).delete()
+        for start in xrange(0, len(inserted), 100):
+            self.bulk_create(inserted[start:start + 100])
+        for start in xrange(0, len(flagged), chunk_size):
+            self.filter(pk__in=flagged[start:start + chunk_size]).update(modified=True)
+        components = list(components)
+        for start in xrange(0, len(components), chunk_size):
+            Component.objects.filter(pk__in=components[start:start + chunk_size], modified_metadata=False).update(modified_metadata=True)
+        for ctype, objects in changed_objects.iteritems():
+            MetadataChange.objects.log_changes(ctype, objects, chunk_size)
+        return changed
+
+    def _get_components(self, items, variant_name, workspace):
+        "Returns a dictionary {item pk: component} with the variant_name components of items"
+        from dam.repository.models import Component
+        components = Component.objects.filter(item__in=[item.pk for item in items], variant__name=variant_name, workspace=workspace)
+        return dict([(c.item_id, c) for c in components])
+
+    def _get_target(self, item, schema, components):
+        "Returns the (content type pk, object pk) holding the values of schema for item"
+        from dam.repository.models import Item, Component
+        if schema.is_variant:
+            if item.pk not in components:
+                raise Component.DoesNotExist('no component for item %s' % item.pk)
+            return ContentType.objects.get_for_model(Component).pk, components[item.pk].pk
+        return ContentType.objects.get_for_model(Item).pk, item.pk
+
+    def _touch_items(self, items):
+        "Updates the last modification time of items in every workspace"
+        from dam.workspace.models import WorkspaceItem
+        WorkspaceItem.objects.filter(item__in=[item.pk for item in items]).update(last_update=datetime.datetime.now())
+
+    def _get_editable_properties(self, descriptor, items):
+        "Returns a dictionary {item pk: editable properties of descriptor for the media type of the item}"
+        from dam.repository.models import Item
+        cache = get_schema_cache()
+        types = dict(Item.objects.filter(pk__in=[item.pk for item in items]).values_list('pk', 'type__name'))
+        properties = [p for p in cache.get_descriptor_properties(descriptor.pk) if p.editable]
+        return dict([(item.pk, [p for p in properties if types.get(item.pk) in cache.get_media_types(p.pk)]) for item in items])
 
     def save_descriptor_structure_values(self, descriptor, schema_id, items, values, workspace, variant_name='original'):
         
@@ -288,37 +696,49 @@ class MetadataManager(models.Manager):
         it saves the values as the first item of the array)
         """
         
-        from dam.repository.models import Item, Component
-        
-        ctype_item = ContentType.objects.get_for_model(Item)
-        ctype_obj = ContentType.objects.get_for_model(Component)
-        logger.debug('descriptor %s'%descriptor)
-        logger.debug('descriptor.properties %s'%descriptor.properties)
+        cache = get_schema_cache()
+        subproperty = cache.get_property_by_pk(schema_id)
+        properties = self._get_editable_properties(descriptor, items)
+        components = self._get_components(items, variant_name, workspace)
+        new_values = {}
         for item in items:
-        
-            properties = descriptor.properties.filter(media_type__name=item.type.name)
-            logger.debug('properties %s'%properties)
-            logger.debug('item.type %s'%item.type)
-            item.update_last_modified()
-            for p in properties:
-                logger.debug('p.editable %s'%p.editable)
-                if not p.editable:
-                    continue
-        
-                if p.is_variant:
-                    obj = Component.objects.get(item=item, variant__name=variant_name, workspace=workspace)
-                    ctype = ctype_obj
-                else:
-                    obj = item
-                    ctype = ctype_item
-        
-                subproperty = MetadataProperty.objects.get(pk=int(schema_id))                               
+            for p in properties[item.pk]:
+                ctype, obj = self._get_target(item, p, components)
                 xpath = '%s:%s[1]/%s:%s' % (p.namespace.prefix, p.field_name, subproperty.namespace.prefix, subproperty.field_name)
-                new_metadata = MetadataValue.objects.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, xpath=xpath)
-                new_metadata[0].value = values
-                new_metadata[0].save()
-                logger.debug('new_metadata[0] %s'%new_metadata[0])
-                set_modified_flag(new_metadata[0],obj)
+                new_values[(ctype, obj, p.pk, xpath)] = [(values, None, xpath)]
+        self.replace_values(new_values)
+        self._touch_items(items)
+        MetadataToken.objects.index_items([item.pk for item in items])
+
+    def _descriptor_rows(self, p, values, default_language):
+        "Returns the list of (value, language, xpath) of property p for the values of a descriptor"
+        cache = get_schema_cache()
+        rows = []
+        if isinstance(values, list):
+            if p.type == 'lang':
+                if p.is_array == 'not_array':
+                    values = values[:1]
+                rows = [(value[0], value[1], '') for value in values]
+            else:
+                if p.is_array == 'not_array':
+                    values = values[:1]
+                for index in range(len(values)):
+                    value = values[index]
+                    if isinstance(value, dict):
+                        for k, v in value.iteritems():
+                            subproperty = cache.get_property_by_pk(k)
+                            xpath = '%s:%s[%d]/%s:%s' % (p.namespace.prefix, p.field_name, index+1, subproperty.namespace.prefix, subproperty.field_name)
+                            rows.append((v, None, xpath))
+                    else:
+                        rows.append((value, None, ''))
+        else:
+            if p.type == 'lang':
+                rows = [(values, default_language, '')]
+            elif p.is_array != 'not_array':
+                rows = [(v.strip(), None, '') for v in values.split(',')]
+            else:
+                rows = [(values, None, '')]
+        return rows
 
     def save_descriptor_values(self, descriptor, items, values, workspace, variant_name='original', default_language='en-US'):
         
@@ -326,81 +746,21 @@ class MetadataManager(models.Manager):
         Save descriptor values for the given item
         """	
 
-        from dam.repository.models import Item, Component
-
-        ctype_item = ContentType.objects.get_for_model(Item)
-        ctype_obj = ContentType.objects.get_for_model(Component)
         logger.debug('items %s'%items)
         logger.debug('descriptor %s'%descriptor)
+        properties = self._get_editable_properties(descriptor, items)
+        components = self._get_components(items, variant_name, workspace)
+        rows = {}
+        new_values = {}
         for item in items:        
-            logger.debug('item.type %s'%item.type)
-            properties = descriptor.properties.filter(media_type__name=item.type.name)
-            logger.debug('properties %s'%properties)
-            item.update_last_modified()
-            for p in properties:
-                logger.debug(p)
-                logger.debug('p.editable %s'%p.editable)
-                if not p.editable:
-                    continue
-        
-                if p.is_variant:
-                    obj = Component.objects.get(item=item, variant__name=variant_name, workspace=workspace)
-                    ctype = ctype_obj
-                else:
-                    obj = item
-                    ctype = ctype_item
-        
-                obj.metadata.filter(schema__id=int(p.id)).delete()
-        
-                if isinstance(values, list):
-                    if p.type == 'lang':
-                        if p.is_array != 'not_array':
-                            for value in values:
-                                new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=value[0], language=value[1])
-                                set_modified_flag(new_metadata[0],obj)
-                        else:
-                            value = values[0]
-                            new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=value[0], language=value[1])                      
-                            set_modified_flag(new_metadata[0],obj)
-                    else:
-                        if p.is_array != 'not_array':                   
-                            for index in range(len(values)):
-                                value = values[index]
-                                if isinstance(value, dict):
-                                    for k, v in value.iteritems():
-                                        subproperty = MetadataProperty.objects.get(pk=int(k))                               
-                                        xpath = '%s:%s[%d]/%s:%s' % (p.namespace.prefix, p.field_name, index+1, subproperty.namespace.prefix, subproperty.field_name)
-                                        new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=v, xpath=xpath)                               
-                                        set_modified_flag(new_metadata[0],obj)
-                                else:
-                                    new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=value)
-                                    set_modified_flag(new_metadata[0],obj)
-                        else:
-                            value = values[0]
-                            index = 0
-                            if isinstance(value, dict):
-                                for k, v in value.iteritems():
-                                    subproperty = MetadataProperty.objects.get(pk=int(k))                               
-                                    xpath = '%s:%s[%d]/%s:%s' % (p.namespace.prefix, p.field_name, index+1, subproperty.namespace.prefix, subproperty.field_name)
-                                    new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=v, xpath=xpath)                               
-                                    set_modified_flag(new_metadata[0],obj)
-                            else:
-                                new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=value)
-                                set_modified_flag(new_metadata[0],obj)
-                else:
-                    if p.type == 'lang':
-                        new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=values, language=default_language)
-                        set_modified_flag(new_metadata[0],obj)
-                    else:
-                        if p.is_array != 'not_array':
-                            value = values.split(',')
-                            for v in value:
-                                new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=v.strip())
-                                set_modified_flag(new_metadata[0],obj)
-                        else:
-                            value = values
-                            new_metadata = self.get_or_create(schema=p, object_id=obj.pk, content_type=ctype, value=value)
-                            set_modified_flag(new_metadata[0],obj)
+            for p in properties[item.pk]:
+                if p.pk not in rows:
+                    rows[p.pk] = self._descriptor_rows(p, values, default_language)
+                ctype, obj = self._get_target(item, p, components)
+                new_values[(ctype, obj, p.pk)] = rows[p.pk]
+        self.replace_values(new_values)
+        self._touch_items(items)
+        MetadataToken.objects.index_items([item.pk for item in items])
 
     def save_metadata_value(self, items, metadata, variant_name, workspace, default_language='en-US'):
         
@@ -408,50 +768,45 @@ class MetadataManager(models.Manager):
         Save XMP Values for the items in item_list
         """
         
-        from dam.repository.models import Item, Component
-        
-        ctype_item = ContentType.objects.get_for_model(Item)
-        ctype_obj = ContentType.objects.get_for_model(Component)
-    
-        for item in items:
-            for m in metadata:
-                metadataschema = MetadataProperty.objects.get(pk=int(m))
-    
-                if metadataschema.is_variant:
-                    obj = Component.objects.get(item=item, variant__name=variant_name, workspace=workspace)
-                    ctype = ctype_obj
+        cache = get_schema_cache()
+        rows = {}                          # metadataschema pk -> list of (value, language, xpath)
+        schemas = []
+        for m in metadata:
+            metadataschema = cache.get_property_by_pk(m)
+            schemas.append(metadataschema)
+            rows[metadataschema.pk] = []
+            if isinstance(metadata[m], list):
+                if metadataschema.type == 'lang':
+                    for value in metadata[m]:
+                        rows[metadataschema.pk].append((value[0], value[1], ''))
                 else:
-                    obj = item
-                    ctype = ctype_item
-    
-                obj.metadata.filter(schema__id=int(m)).delete()
-    
-                if isinstance(metadata[m], list):
-                    if metadataschema.type == 'lang':
-                        for value in metadata[m]:
-                            new_metadata = self.get_or_create(schema=metadataschema, object_id=obj.pk, content_type=ctype, value=value[0], language=value[1])
-                            set_modified_flag(new_metadata[0],obj)
-                    else:
-                        for index in range(len(metadata[m])):
-                            value = metadata[m][index]
-                            if isinstance(value, dict):
-                                for k, v in value.iteritems():
-                                    subproperty = MetadataProperty.objects.get(pk=int(k))
-                                    xpath = '%s:%s[%d]/%s:%s' % (metadataschema.namespace.prefix, metadataschema.field_name, index+1, subproperty.namespace.prefix, subproperty.field_name)
-                                    if subproperty.type == 'lang':
-                                        new_metadata = self.get_or_create(schema=metadataschema, object_id=obj.pk, content_type=ctype, value=v, xpath=xpath, language=default_language)                                        
-                                        set_modified_flag(new_metadata[0],obj)
-                                    else:
-                                        new_metadata = self.get_or_create(schema=metadataschema, object_id=obj.pk, content_type=ctype, value=v, xpath=xpath)
-                                        set_modified_flag(new_metadata[0],obj)
-                            else:
-                                new_metadata = self.get_or_create(schema=metadataschema, object_id=obj.pk, content_type=ctype, value=value)
-                                set_modified_flag(new_metadata[0],obj)
-                else:
-                    value = metadata[m]
-                    new_metadata = self.get_or_create(schema=metadataschema, object_id=obj.pk, content_type=ctype, value=value)
-                    set_modified_flag(new_metadata[0],obj)
-                item.update_last_modified()
+                    for index in range(len(metadata[m])):
+                        value = metadata[m][index]
+                        if isinstance(value, dict):
+                            for k, v in value.iteritems():
+                                subproperty = cache.get_property_by_pk(k)
+                                xpath = '%s:%s[%d]/%s:%s' % (metadataschema.namespace.prefix, metadataschema.field_name, index+1, subproperty.namespace.prefix, subproperty.field_name)
+                                if subproperty.type == 'lang':
+                                    rows[metadataschema.pk].append((v, default_language, xpath))
+                                else:
+                                    rows[metadataschema.pk].append((v, None, xpath))
+                        else:
+                            rows[metadataschema.pk].append((value, None, ''))
+            else:
+                rows[metadataschema.pk].append((metadata[m], None, ''))
+
+        components = {}
+        if [s for s in schemas if s.is_variant]:
+            components = self._get_components(items, variant_name, workspace)
+        new_values = {}
+        for item in items:
+            for metadataschema in schemas:
+                ctype, obj = self._get_target(item, metadataschema, components)
+                new_values[(ctype, obj, metadataschema.pk)] = rows[metadataschema.pk]
+        self.replace_values(new_values)
+        if schemas:
+            self._touch_items(items)
+        MetadataToken.objects.index_items([item.pk for item in items])
 
 class MetadataValue(models.Model):
     """
@@ -474,6 +829,258 @@ class MetadataValue(models.Model):
         #super(MetadataValue, self).save(*args, **kwargs)
         
 
+def tokenize(text):
+    """
+    Split a metadata value (or a search string) into lowercase words,
+    the same way for indexing and for searching
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return [w[:TOKEN_LENGTH] for w in _word_re.findall(text.lower())]
+
+class MetadataTokenManager(models.Manager):
+
+    def index_items(self, item_ids, chunk_size=500):
+        """
+        Rebuild the tokens of the item-level metadata values of the given items
+        """
+        from dam.repository.models import Item
+
+        ctype = ContentType.objects.get_for_model(Item)
+        item_ids = list(set([int(pk) for pk in item_ids]))
+        for start in xrange(0, len(item_ids), chunk_size):
+            chunk = item_ids[start:start + chunk_size]
+            self.filter(object_id__in=chunk).delete()
+            values = MetadataValue.objects.filter(content_type=ctype, object_id__in=chunk).values_list('pk', 'object_id', 'value')
+            tokens = []
+            for value_id, object_id, value in values.iterator():
+                for position, word in enumerate(tokenize(value)):
+                    tokens.append(MetadataToken(word=word, position=position, metadata_value_id=value_id, object_id=object_id))
+                if len(tokens) >= chunk_size:
+                    self.bulk_create(tokens)
+                    tokens = []
+            if tokens:
+                self.bulk_create(tokens)
+
+    def index_value(self, value):
+        """
+        Rebuild the tokens of a single metadata value, if it is an item-level one
+        """
+        from dam.repository.models import Item
+
+        if value.content_type_id != ContentType.objects.get_for_model(Item).pk:
+            return
+        self.filter(metadata_value=value).delete()
+        self.bulk_create([MetadataToken(word=word, position=position, metadata_value_id=value.pk, object_id=value.object_id)
+                          for position, word in enumerate(tokenize(value.value))])
+
+    def rebuild(self, chunk_size=500):
+        """
+        Drop the whole index and rebuild it from the metadata of all items
+        """
+        from dam.repository.models import Item
+
+        self.all().delete()
+        item_ids = list(Item.objects.values_list('pk', flat=True))
+        self.index_items(item_ids, chunk_size)
+        return len(item_ids)
+
+    def search_word(self, word):
+        """
+        Return a queryset with the ids of the items having the given word
+        in their metadata, suitable for pk__in lookups
+        """
+        return self.filter(word=word).values_list('object_id', flat=True)
+
+    def search_phrase(self, words):
+        """
+        Return the ids of the items having the given words, in sequence,
+        in the same metadata value
+        """
+        if not words:
+            return []
+        if len(words) == 1:
+            return self.search_word(words[0])
+
+        # start from the rarest word and only look at the values it occurs in
+        counts = dict([(w, self.filter(word=w).count()) for w in set(words)])
+        first = min(range(len(words)), key=lambda i: counts[words[i]])
+        if counts[words[first]] == 0:
+            return []
+
+        candidates = {}
+        for value_id, position, object_id in self.filter(word=words[first]).values_list('metadata_value', 'position', 'object_id'):
+            candidates[(value_id, position - first)] = object_id
+
+        for i, word in enumerate(words):
+            if i == first or not candidates:
+                continue
+            value_ids = set([value_id for value_id, start in candidates])
+            found = set([(value_id, position - i) for value_id, position in self.filter(word=word, metadata_value__in=value_ids).values_list('metadata_value', 'position')])
+            candidates = dict([(k, v) for k, v in candidates.iteritems() if k in found])
+
+        return list(set(candidates.values()))
+
+class MetadataToken(models.Model):
+    """
+    Inverted index of the words found in the item-level metadata values,
+    used by the text search
+    """
+    word = models.CharField(max_length=TOKEN_LENGTH, db_index=True)
+    position = models.PositiveIntegerField()
+    metadata_value = models.ForeignKey(MetadataValue)
+    object_id = models.PositiveIntegerField(db_index=True)
+    objects = MetadataTokenManager()
+
+    def __str__(self):
+        return "%s (%s)" % (self.word, self.object_id)
+
+def _index_saved_value(sender, instance, **kwargs):
+    """
+    Indexes the metadata values saved one at a time (e.g. item.metadata.create).
+    Bulk writers call MetadataToken.objects.index_items instead; the tokens of a
+    deleted value are deleted with it
+    """
+    MetadataToken.objects.index_value(instance)
+
+models.signals.post_save.connect(_index_saved_value, sender=MetadataValue)
+
+class MetadataChangeManager(models.Manager):
+
+    def _embedded_components(self, item_ids):
+        """
+        Returns the pks of the components of the given items the XMP is embedded in:
+        those of the variants that are not generated automatically
+        """
+        from dam.repository.models import Component
+        return Component.objects.filter(item__in=item_ids, variant__auto_generated=False).values_list('pk', flat=True)
+
+    def log_changes(self, ctype, object_ids, chunk_size=500):
+        """
+        Records in the journal that the metadata of the given objects
+        (of content type pk ctype) were modified. The changes of an item are
+        also recorded for its components, see reset
+        """
+        from dam.repository.models import Item, Component
+
+        ctype_item = ContentType.objects.get_for_model(Item).pk
+        ctype_comp = ContentType.objects.get_for_model(Component).pk
+        object_ids = sorted(set(object_ids))
+        for start in xrange(0, len(object_ids), chunk_size):
+            chunk = object_ids[start:start + chunk_size]
+            logged = set(self.filter(content_type=ctype, object_id__in=chunk).values_list('object_id', flat=True))
+            self.bulk_create([MetadataChange(content_type_id=ctype, object_id=obj) for obj in chunk if obj not in logged])
+            if ctype == ctype_item:
+                self.log_changes(ctype_comp, list(self._embedded_components(chunk)), chunk_size)
+
+    def rebuild(self, chunk_size=500):
+        """
+        Drop the whole journal and rebuild it from the modified flags of the
+        metadata values; returns the number of objects logged
+        """
+        self.all().delete()
+        objects = {}
+        for ctype, obj in MetadataValue.objects.filter(modified=True).values_list('content_type', 'object_id').distinct():
+            objects.setdefault(ctype, []).append(obj)
+        for ctype, object_ids in objects.iteritems():
+            self.log_changes(ctype, object_ids, chunk_size)
+        return sum([len(object_ids) for object_ids in objects.values()])
+
+    def get_changed_items(self, workspace=None, variant_name=None):
+        """
+        Returns a queryset with the pks of the items having a component whose
+        metadata, or the metadata of the item, were modified since they were
+        last embedded in it; optionally only the components of workspace and
+        of the variant variant_name (see the embed_changed_xmp command)
+        """
+        from dam.repository.models import Component
+        components = self.filter(content_type=ContentType.objects.get_for_model(Component)).values('object_id')
+        components = Component.objects.filter(pk__in=components, variant__auto_generated=False)
+        if workspace is not None:
+            components = components.filter(workspace=workspace)
+        if variant_name is not None:
+            components = components.filter(variant__name=variant_name)
+        return components.values_list('item', flat=True).distinct()
+
+    def get_changes(self, component):
+        """
+        Returns the modified metadata of component and of its item, as expected
+        by the XMPEmbedder: {namespace uri: {'prefix': prefix, 'fields': {field_name:
+        {'type', 'is_array', 'value': [], 'qualifier': [], 'xpath': []}}}}.
+        Objects not in the journal are skipped; the values of the others are read
+        with a single query, their schemas come from the SchemaCache
+        """
+        from dam.repository.models import Item, Component
+
+        ctype_item = ContentType.objects.get_for_model(Item).pk
+        ctype_comp = ContentType.objects.get_for_model(Component).pk
+        logged = self.filter(models.Q(content_type=ctype_item, object_id=component.item_id) |
+                             models.Q(content_type=ctype_comp, object_id=component.pk)).values_list('content_type', flat=True)
+        changes = {}
+        if not logged:
+            return changes
+        q = models.Q()
+        for ctype in set(logged):
+            if ctype == ctype_item:
+                q |= models.Q(content_type=ctype_item, object_id=component.item_id)
+            else:
+                q |= models.Q(content_type=ctype_comp, object_id=component.pk)
+        values = MetadataValue.objects.filter(q, modified=True).values_list('content_type', 'schema', 'value', 'language', 'xpath')
+        # item values first, as they are overridden by those of the component
+        values = sorted(values.order_by('pk'), key=lambda v: v[0] != ctype_item)
+
+        cache = get_schema_cache()
+        for ctype, schema_id, value, language, xpath in values:
+            schema = cache.get_property_by_pk(schema_id)
+            ns = changes.setdefault(schema.namespace.uri, {'prefix': schema.namespace.prefix, 'fields': {}})
+            field = ns['fields'].setdefault(schema.field_name, {'type': schema.type, 'is_array': schema.is_array,
+                                                                'value': [], 'qualifier': [], 'xpath': []})
+            field['value'].append(value)
+            if schema.type == 'lang':
+                field['qualifier'].append(language)
+            elif cache.get_structure(schema.type) is not None:
+                field['xpath'].append(xpath)
+        return changes
+
+    def reset(self, component):
+        """
+        Clears, once they have been embedded, the modified flags of the metadata
+        of component and of the component itself, and its entry in the journal.
+        The metadata of the item stay modified until they have been embedded in
+        all the components of the item that were logged with them
+        """
+        from dam.repository.models import Item, Component
+
+        ctype = ContentType.objects.get_for_model(Component).pk
+        ctype_item = ContentType.objects.get_for_model(Item).pk
+        MetadataValue.objects.filter(content_type=ctype, object_id=component.pk, modified=True).update(modified=False)
+        Component.objects.filter(pk=component.pk).update(modified_metadata=False)
+        self.filter(content_type=ctype, object_id=component.pk).delete()
+        component.modified_metadata = False
+        if not self.filter(content_type=ctype, object_id__in=self._embedded_components([component.item_id])).exists():
+            MetadataValue.objects.filter(content_type=ctype_item, object_id=component.item_id, modified=True).update(modified=False)
+            self.filter(content_type=ctype_item, object_id=component.item_id).delete()
+
+class MetadataChange(models.Model):
+    """
+    Journal of the objects (items and components) with metadata values
+    modified since they were last embedded in the files, so that the XMP
+    embedding does not have to look at the metadata of every object
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField(db_index=True)
+    objects = MetadataChangeManager()
+
+    def __str__(self):
+        return "%s (%s)" % (self.content_type_id, self.object_id)
+
+class MetadataSchemaVersion(models.Model):
+    """
+    Single row counting the changes of the metadata schemas,
+    used to invalidate the SchemaCache of every process
+    """
+    version = models.PositiveIntegerField(default=0)
+
 class MetadataDescriptorGroup(models.Model):
     """
     Group of Metadata Descriptor
@@ -513,3 +1120,19 @@ class RightsValue(models.Model):
     
     def __str__(self):
         return "%s" % (self.value)
+
+def _schema_saved(sender, **kwargs):
+    "Invalidates the SchemaCache of every process when a schema is changed"
+    schemas_changed()
+
+def _schema_relation_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        schemas_changed()
+
+# the schemas can be changed by the admin views, the django admin or fixtures
+for _model in (XMPNamespace, XMPProperty, MetadataProperty, XMPStructure, XMPPropertyChoice, MetadataDescriptor, MetadataDescriptorGroup):
+    models.signals.post_save.connect(_schema_saved, sender=_model)
+    models.signals.post_delete.connect(_schema_saved, sender=_model)
+for _through in (XMPProperty.media_type.through, XMPStructure.properties.through, MetadataDescriptor.properties.through,
+                 MetadataDescriptorGroup.descriptors.through):
+    models.signals.m2m_changed.connect(_schema_relation_changed, sender=_through)
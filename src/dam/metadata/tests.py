@@ -0,0 +1,95 @@
+"""
+Tests of the bulk writes of metadata values:
+
+python manage.py test metadata
+"""
+from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+
+from dam.repository.models import Item, Component
+from dam.metadata.models import MetadataValue, MetadataChange
+
+TITLE, SUBJECT = 1, 2                      # dc:title and dc:subject, see core/dam_metadata initial data
+
+
+class ReplaceValuesTest(TestCase):
+    fixtures = ['repository/fixtures/test_data.json',
+                'workspace/fixtures/test_data.json']
+
+    def setUp(self):
+        self.ctype_item = ContentType.objects.get_for_model(Item).pk
+        self.ctype_comp = ContentType.objects.get_for_model(Component).pk
+        MetadataValue.objects.all().delete()
+        MetadataChange.objects.all().delete()
+
+    def values(self, ctype, obj, schema):
+        return sorted(MetadataValue.objects.filter(content_type=ctype, object_id=obj, schema=schema).values_list(
+                      'value', 'language', 'xpath', 'modified'))
+
+    def journal(self):
+        return sorted(MetadataChange.objects.values_list('content_type', 'object_id'))
+
+    def add_value(self, ctype, obj, schema, value, language=None, xpath=''):
+        return MetadataValue.objects.create(content_type_id=ctype, object_id=obj, schema_id=schema,
+                                            value=value, language=language, xpath=xpath)
+
+    def test_insert(self):
+        changed = MetadataValue.objects.replace_values({
+            (self.ctype_item, 1, TITLE): [('a title', 'en-US', ''), ('a title', 'en-US', '')],
+            (self.ctype_item, 2, SUBJECT): [('one', None, ''), ('two', None, '')],
+        })
+        self.assertEqual(changed, 2)
+        self.assertEqual(self.values(self.ctype_item, 1, TITLE), [(u'a title', u'en-US', u'', True)])
+        self.assertEqual(self.values(self.ctype_item, 2, SUBJECT), [(u'one', None, u'', True), (u'two', None, u'', True)])
+        # the changes of an item are logged for the components the XMP is embedded in, not for the renditions
+        self.assertEqual(self.journal(), sorted([(self.ctype_item, 1), (self.ctype_item, 2),
+                                                 (self.ctype_comp, 1), (self.ctype_comp, 14)]))
+
+    def test_unchanged(self):
+        value = self.add_value(self.ctype_item, 1, TITLE, 'a title', 'en-US')
+        changed = MetadataValue.objects.replace_values({(self.ctype_item, 1, TITLE): [('a title', 'en-US', '')]})
+        self.assertEqual(changed, 0)
+        self.assertEqual(self.values(self.ctype_item, 1, TITLE), [(u'a title', u'en-US', u'', False)])
+        self.assertTrue(MetadataValue.objects.filter(pk=value.pk).exists())
+        self.assertEqual(self.journal(), [])
+
+    def test_diff(self):
+        kept = self.add_value(self.ctype_item, 1, SUBJECT, 'one')
+        removed = self.add_value(self.ctype_item, 1, SUBJECT, 'two')
+        changed = MetadataValue.objects.replace_values({(self.ctype_item, 1, SUBJECT): [('one', None, ''), ('three', None, '')]})
+        self.assertEqual(changed, 1)
+        self.assertEqual(self.values(self.ctype_item, 1, SUBJECT), [(u'one', None, u'', True), (u'three', None, u'', True)])
+        self.assertTrue(MetadataValue.objects.filter(pk=kept.pk, modified=True).exists())
+        self.assertFalse(MetadataValue.objects.filter(pk=removed.pk).exists())
+
+    def test_delete(self):
+        self.add_value(self.ctype_item, 1, SUBJECT, 'one')
+        changed = MetadataValue.objects.replace_values({(self.ctype_item, 1, SUBJECT): []})
+        self.assertEqual(changed, 1)
+        self.assertEqual(self.values(self.ctype_item, 1, SUBJECT), [])
+        self.assertTrue((self.ctype_item, 1) in self.journal())
+
+    def test_xpath(self):
+        self.add_value(self.ctype_item, 1, TITLE, 'a title', 'en-US', 'dc:title[1]')
+        self.add_value(self.ctype_item, 1, TITLE, 'un titolo', 'it-IT', 'dc:title[2]')
+        changed = MetadataValue.objects.replace_values({
+            (self.ctype_item, 1, TITLE, 'dc:title[2]'): [('altro titolo', 'it-IT', 'dc:title[2]')]
+        })
+        self.assertEqual(changed, 1)
+        self.assertEqual(self.values(self.ctype_item, 1, TITLE), [(u'a title', u'en-US', u'dc:title[1]', False),
+                                                                (u'altro titolo', u'it-IT', u'dc:title[2]', True)])
+
+    def test_component(self):
+        Component.objects.filter(pk=11).update(modified_metadata=False)
+        changed = MetadataValue.objects.replace_values({(self.ctype_comp, 11, TITLE): [('a title', 'en-US', '')]})
+        self.assertEqual(changed, 1)
+        self.assertTrue(Component.objects.get(pk=11).modified_metadata)
+        self.assertEqual(self.journal(), [(self.ctype_comp, 11)])
+
+    def test_changed_items(self):
+        MetadataValue.objects.replace_values({(self.ctype_item, 1, TITLE): [('a title', 'en-US', '')]})
+        self.assertEqual(list(MetadataChange.objects.get_changed_items()), [1])
+        self.assertEqual(list(MetadataChange.objects.get_changed_items(variant_name='original')), [1])
+        self.assertEqual(list(MetadataChange.objects.get_changed_items(variant_name='thumbnail')), [])
+        MetadataChange.objects.reset(Component.objects.get(pk=1))
+        self.assertEqual(list(MetadataChange.objects.get_changed_items()), [])
@@ -29,7 +29,7 @@ from dam.repository.models import Item, Component
 from dam.preferences.models import DAMComponent, DAMComponentSetting
 from dam.preferences.views import get_metadata_default_language
 from dam.workspace.models import DAMWorkspace as Workspace
-from dam.metadata.models import MetadataLanguage, MetadataValue, MetadataProperty, MetadataDescriptorGroup, MetadataDescriptor, RightsValue
+from dam.metadata.models import MetadataLanguage, MetadataValue, MetadataProperty, MetadataDescriptorGroup, MetadataDescriptor, RightsValue, get_schema_cache
 from dam.mprocessor.models import Pipeline, Process
 from dam.variants.models import Variant
 from dam.core.dam_workspace import decorators
@@ -379,18 +379,10 @@ def get_components_types(item_list, variant, workspace):
     Returns the media types of the components of the items in item_list
     """
 
-    components_types = set()
+    item_list = [i for i in item_list if i.strip()]
+    types = Component.objects.filter(item__pk__in=item_list, variant__name=variant, workspace=workspace).values_list('media_type__name', flat=True)
 
-    for i in item_list:
-                
-        if len(i.strip()) == 0:
-            break
-
-        comp=Component.objects.get(item__pk=i, variant__name=variant, workspace=workspace)
-
-        components_types.add(comp.media_type.name)
-
-    return components_types
+    return set(types)
 
 def get_components_list(item_list, variant, workspace):
 
@@ -412,8 +404,15 @@ def _advanced_metadata_view(item_list, workspace, default_language, metadata_obj
     components_types = get_components_types(item_list, metadata_object, workspace)
     components_list = get_components_list(item_list, metadata_object, workspace)
 
+    cache = get_schema_cache()
+    metadataschemas = MetadataProperty.objects.exclude(namespace__prefix='notreDAM').exclude(xmpstructure__in=XMPStructure.objects.all()).select_related('namespace').order_by('field_name')
+    namespace_schemas = {}
+    for metadataschema in metadataschemas:
+        namespace_schemas.setdefault(metadataschema.namespace_id, []).append(metadataschema)
+    values = MetadataValue.objects.get_bulk_metadata_values(item_list, list(metadataschemas), items_types, components_types, components_list, cache)
+
     for namespace in XMPNamespace.objects.all():
-        metadataschema_list = MetadataProperty.objects.filter(namespace=namespace).exclude(namespace__prefix='notreDAM').exclude(xmpstructure__in=XMPStructure.objects.all()).order_by('field_name')
+        metadataschema_list = namespace_schemas.get(namespace.pk, [])
         for metadataschema in metadataschema_list:
   
 #            schema_media_types = set(metadataschema.media_type.all().values_list('name', flat=True))
@@ -421,9 +420,9 @@ def _advanced_metadata_view(item_list, workspace, default_language, metadata_obj
 #            if schema_media_types & media_types != media_types:
 #                continue
 
-            form_list.append(metadataschema.metadata_definition())
+            form_list.append(metadataschema.metadata_definition(cache))
 
-            schema_value, multiple_values, to_be_deleted = MetadataValue.objects.get_metadata_values(item_list, metadataschema, items_types, components_types, components_list)
+            schema_value, multiple_values, to_be_deleted = values[metadataschema.pk]
 
             if to_be_deleted:
                 form_list.pop()
@@ -437,17 +436,16 @@ def _advanced_metadata_view(item_list, workspace, default_language, metadata_obj
                 form_list[-1]['value'] = schema_value[item_list[0]].get(default_language, '')
     return form_list
 
-def _generate_metadata_structure_item(group, metadatadescriptor, item_list, items_types, components_types, components_list, default_language):
+def _generate_metadata_structure_item(group, metadatadescriptor, properties, values, cache, item_list, default_language):
 
     metadata_list = []
 
-    metadata_info = _generate_metadata_item(group, metadatadescriptor, item_list, items_types, components_types, components_list, default_language)
+    metadata_info = _generate_metadata_item(group, metadatadescriptor, properties, values, cache, item_list, default_language)
 
     if metadata_info:
 
-        structure = XMPStructure.objects.get(name=metadata_info['type'])
-        for schema in structure.properties.all():
-            schema_info = schema.metadataproperty.metadata_definition()
+        for schema in cache.get_structure(metadata_info['type']) or []:
+            schema_info = schema.metadata_definition(cache)
             schema_info['id'] = '%d_%d_%d' % (group.id, metadatadescriptor.id, schema.id)
             schema_info['groupname'] = group.name
             schema_info['value'] = ''
@@ -465,15 +463,19 @@ def _generate_metadata_structure_item(group, metadatadescriptor, item_list, item
                 
     return metadata_list
 
-def _generate_metadata_item(group, metadatadescriptor, item_list, items_types, components_types, components_list, default_language):
+def _generate_metadata_item(group, metadatadescriptor, properties, values, cache, item_list, default_language):
+    """
+    properties are those of metadatadescriptor, values those returned by
+    MetadataValue.objects.get_bulk_metadata_values for them
+    """
 
     metadata_info = None
 
-    for m in metadatadescriptor.properties.all():
+    for m in properties:
 
-        metadata_info = m.metadata_definition()
+        metadata_info = m.metadata_definition(cache)
 
-        schema_value, multiple_values, to_be_deleted = MetadataValue.objects.get_metadata_values(item_list, m, items_types, components_types, components_list)
+        schema_value, multiple_values, to_be_deleted = values[m.pk]
 
         if not to_be_deleted:
             metadata_info['to_be_deleted'] = False
@@ -508,12 +510,12 @@ def _generate_metadata_item(group, metadatadescriptor, item_list, items_types, c
 
         tooltip = ""
     
-        for m in metadatadescriptor.properties.all():
+        for m in properties:
             tooltip += "%s:%s - " % (m.namespace.prefix, m.field_name)
     
         metadata_info['tooltip'] = tooltip[:-2]
     
-        for m in metadatadescriptor.properties.all():
+        for m in properties:
             if m.editable:
                 metadata_info['editable'] = True
                 break
@@ -529,30 +531,39 @@ def _simple_metadata_view(item_list, workspace, default_language, metadata_objec
     components_types = get_components_types(item_list, metadata_object, workspace)
     components_list = get_components_list(item_list, metadata_object, workspace)
 
-    my_groups = MetadataDescriptorGroup.objects.filter(workspace=workspace)
-    my_groups = my_groups.exclude(basic_summary=True).exclude(specific_basic=True).exclude(specific_full=True).exclude(upload=True)
+    cache = get_schema_cache()
+    special = {'basic_summary': False, 'specific_basic': False, 'specific_full': False, 'upload': False}
+    my_groups = cache.get_descriptor_groups(workspace_id=getattr(workspace, 'pk', None), **special)
 
-    if my_groups.count() == 0:
-        my_groups = MetadataDescriptorGroup.objects.filter(workspace__isnull=True)
-        my_groups = my_groups.exclude(basic_summary=True).exclude(specific_basic=True).exclude(specific_full=True).exclude(upload=True)
+    if len(my_groups) == 0:
+        my_groups = cache.get_descriptor_groups(workspace_id=None, **special)
+    
+    # the values of the properties of all the descriptors are read at once
+    properties = {}
+    for group in my_groups:
+        for metadatadescriptor in cache.get_group_descriptors(group.pk):
+            for p in cache.get_descriptor_properties(metadatadescriptor.pk):
+                properties[p.pk] = p
+    values = MetadataValue.objects.get_bulk_metadata_values(item_list, properties.values(), items_types, components_types, components_list, cache)
     
     for group in my_groups:
     
-        metadatadescriptor_list = group.descriptors.all().order_by('name')
+        metadatadescriptor_list = cache.get_group_descriptors(group.pk)
 
         if group.name == 'Rights':
             rights = None
             rights_mv = False
+            components = Component.objects.filter(item__pk__in=item_list, variant__name=metadata_object, workspace=workspace).prefetch_related('comp_rights')
+            components = dict([(str(c.item_id), c) for c in components])
             for i in item_list:
-                item = Item.objects.get(pk=i)
-                comp = Component.objects.get(item=item, variant__name=metadata_object, workspace=workspace)
+                comp = components[str(i)]
                 if rights:
                     my_rights = comp.comp_rights.all()
-                    if my_rights.count():
+                    if my_rights:
                         if my_rights[0] != rights:
                             rights_mv = True
                 else:
-                    if comp.comp_rights.all().count() > 0:
+                    if comp.comp_rights.all():
                         rights = comp.comp_rights.all()[0]
             if rights:
                 rights = rights.value
@@ -563,20 +574,20 @@ def _simple_metadata_view(item_list, workspace, default_language, metadata_objec
 
         for metadatadescriptor in metadatadescriptor_list:
   
-            metadataschemas = metadatadescriptor.properties.all()
-            if metadataschemas.count():
+            metadataschemas = cache.get_descriptor_properties(metadatadescriptor.pk)
+            if metadataschemas:
                 metadataschema = metadataschemas[0]
 
-                if metadataschema.type in XMPStructure.objects.all().values_list('name', flat=True):
+                if cache.get_structure(metadataschema.type) is not None:
                     
-                    metadata_info = _generate_metadata_structure_item(group, metadatadescriptor, item_list, items_types, components_types, components_list, default_language)
+                    metadata_info = _generate_metadata_structure_item(group, metadatadescriptor, metadataschemas, values, cache, item_list, default_language)
                     
                     if metadata_info:
                         form_list.extend(metadata_info)                    
                     
                 else:
                 
-                    metadata_info = _generate_metadata_item(group, metadatadescriptor, item_list, items_types, components_types, components_list, default_language)
+                    metadata_info = _generate_metadata_item(group, metadatadescriptor, metadataschemas, values, cache, item_list, default_language)
                     
                     if metadata_info:
                         form_list.append(metadata_info)                    
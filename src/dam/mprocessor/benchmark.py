@@ -0,0 +1,165 @@
+"""
+Micro-benchmark of the Batch scheduling loop.
+
+Drives a fake pipeline over a large number of in-memory targets. No database
+access is made and no mediadart server is contacted: targets are plain objects
+and every action is a fake script that answers on the next reactor iteration.
+What is measured is the CPU cost of the mprocessor itself (action selection,
+schedules and bookkeeping).
+
+With -s only the schedules are measured, without reactor: one Schedule is
+created for each target, then all of them are run to the end; the memory
+taken by the schedules and the actions per second are printed.
+
+Typical usage:
+
+python benchmark.py -n 100000 -b 1000 -o 50
+python benchmark.py -s -n 1000000
+"""
+from django.core.management import setup_environ
+from dam import settings
+setup_environ(settings)
+
+import sys
+import time
+import resource
+from json import dumps
+from optparse import OptionParser
+from twisted.internet import reactor, defer
+
+from dam.mprocessor import processor
+from dam.mprocessor.make_plugins import simple_pipe
+from dam.mprocessor.pipeline import DAG
+from dam.mprocessor.schedule import Schedule
+
+
+class fake_config:
+    dictionary = {
+        'MPROCESSOR': {
+            'plugins': 'dam.mprocessor.plogins',
+            'max_outstanding': '50',
+            'batch_size': '1000',
+            'update_interval': '100',
+            'update_period': '1000',
+            'prefetch': '0',
+        },
+    }
+    def get(self, section, option):
+        return self.dictionary[section][option]
+
+    def getint(self, section, option):
+        return int(self.dictionary[section][option])
+
+
+class FakePipeline:
+    def __init__(self, pipeline):
+        self.params = dumps(pipeline)
+
+
+class FakeProcess:
+    pk = 0
+    workspace = None
+    workspace_id = 0
+    def __init__(self, pipeline):
+        self.pipeline = FakePipeline(pipeline)
+        self.targets = 0
+        self.targets_completed = self.targets_failed = self.targets_pending = 0
+        self.start_date = self.end_date = None
+
+    def get_priority(self):
+        return 0
+
+    def save(self):
+        pass
+
+
+class FakeTarget:
+    def __init__(self, pk, actions_todo):
+        self.pk = pk
+        self.target_id = str(pk)
+        self.params = '{}'
+        self.actions_passed = self.actions_failed = self.actions_cancelled = 0
+        self.actions_todo = actions_todo
+        self.result = ''
+
+
+def fake_run(workspace, item_id, **params):
+    d = defer.Deferred()
+    reactor.callLater(0, d.callback, 'ok')
+    return d
+
+
+class BenchBatch(processor.Batch):
+    "A Batch reading its targets from memory and running fake scripts"
+    def __init__(self, process, num_targets):
+        processor.Batch.__init__(self, process, durations=processor.Durations(persistent=False))
+        self.fake_targets = [FakeTarget(n + 1, len(self.pipeline)) for n in xrange(num_targets)]
+
+    def _get_scripts(self, pipeline):
+        return dict([(k, (fake_run, v.get('params', {}))) for k, v in pipeline.items()])
+
+    def _count_targets(self):
+        return len(self.fake_targets)
+
+    def _load_targets(self, last_pk, limit):
+        return self.fake_targets[last_pk:last_pk + limit]    # pk == index + 1
+
+    def _save_targets(self, updates):
+        pass
+
+
+def run_schedules(num_targets):
+    "Creates a schedule for each target and runs all the actions of all of them"
+    dag = DAG(simple_pipe)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    schedules = [Schedule(dag, n) for n in xrange(num_targets)]
+    created = time.time()
+    memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+    num_actions = 0
+    for schedule in schedules:
+        action = schedule.action_to_run()
+        while action:
+            schedule.done(action)
+            num_actions += 1
+            action = schedule.action_to_run()
+    elapsed = time.time() - created
+    print >>sys.stderr, '%d schedules created in %.2fs, %d bytes/target' % (num_targets, created - start,
+                memory / num_targets)
+    print >>sys.stderr, '%d actions in %.2fs: %.0f actions/s' % (num_actions, elapsed, num_actions / elapsed)
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='targets', type='int', default=100000, help='number of targets')
+    parser.add_option('-b', dest='batch_size', default='1000', help='targets loaded per batch')
+    parser.add_option('-o', dest='max_outstanding', default='50', help='maximum number of outstanding actions')
+    parser.add_option('-s', dest='schedules', action='store_true', default=False, help='measure only the schedules')
+    options, args = parser.parse_args()
+
+    if options.schedules:
+        run_schedules(options.targets)
+        return
+
+    fake_config.dictionary['MPROCESSOR']['batch_size'] = options.batch_size
+    fake_config.dictionary['MPROCESSOR']['max_outstanding'] = options.max_outstanding
+    processor.Configurator = fake_config
+
+    batch = BenchBatch(FakeProcess(simple_pipe), options.targets)
+    num_actions = options.targets * len(simple_pipe)
+    stats = {}
+
+    def start():
+        stats['start'] = time.time()
+        batch.run().addBoth(end)
+
+    def end(result):
+        elapsed = time.time() - stats['start']
+        print >>sys.stderr, '%d targets, %d actions in %.2fs: %.0f actions/s' % (options.targets,
+                    num_actions, elapsed, num_actions / elapsed)
+        reactor.stop()
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
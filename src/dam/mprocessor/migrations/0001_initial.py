@@ -0,0 +1,211 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'TriggerEvent'
+        db.create_table('mprocessor_triggerevent', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=40)),
+        ))
+        db.send_create_signal('mprocessor', ['TriggerEvent'])
+
+        # Adding model 'Pipeline'
+        db.create_table('mprocessor_pipeline', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=50)),
+            ('description', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('params', self.gf('django.db.models.fields.TextField')()),
+            ('workspace', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['workspace.DAMWorkspace'])),
+        ))
+        db.send_create_signal('mprocessor', ['Pipeline'])
+
+        # Adding M2M table for field triggers on 'Pipeline'
+        db.create_table('mprocessor_pipeline_triggers', (
+            ('id', models.AutoField(verbose_name='ID', primary_key=True, auto_created=True)),
+            ('pipeline', models.ForeignKey(orm['mprocessor.pipeline'], null=False)),
+            ('triggerevent', models.ForeignKey(orm['mprocessor.triggerevent'], null=False))
+        ))
+        db.create_unique('mprocessor_pipeline_triggers', ['pipeline_id', 'triggerevent_id'])
+
+        # Adding M2M table for field media_type on 'Pipeline'
+        db.create_table('mprocessor_pipeline_media_type', (
+            ('id', models.AutoField(verbose_name='ID', primary_key=True, auto_created=True)),
+            ('pipeline', models.ForeignKey(orm['mprocessor.pipeline'], null=False)),
+            ('type', models.ForeignKey(orm['dam_repository.type'], null=False))
+        ))
+        db.create_unique('mprocessor_pipeline_media_type', ['pipeline_id', 'type_id'])
+
+        # Adding model 'Process'
+        db.create_table('mprocessor_process', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('pipeline', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['mprocessor.Pipeline'])),
+            ('workspace', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['workspace.DAMWorkspace'])),
+            ('targets', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('start_date', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('end_date', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('launched_by', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'])),
+            ('last_show_date', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('mprocessor', ['Process'])
+
+        # Adding model 'ProcessTarget'
+        db.create_table('mprocessor_processtarget', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('process', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['mprocessor.Process'])),
+            ('target_id', self.gf('django.db.models.fields.CharField')(max_length=64)),
+            ('params', self.gf('django.db.models.fields.TextField')(null=True, blank=True)),
+            ('actions_passed', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('actions_cancelled', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('actions_failed', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('actions_todo', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('result', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal('mprocessor', ['ProcessTarget'])
+
+
+    def backwards(self, orm):
+        
+        # Deleting model 'TriggerEvent'
+        db.delete_table('mprocessor_triggerevent')
+
+        # Deleting model 'Pipeline'
+        db.delete_table('mprocessor_pipeline')
+
+        # Removing M2M table for field triggers on 'Pipeline'
+        db.delete_table('mprocessor_pipeline_triggers')
+
+        # Removing M2M table for field media_type on 'Pipeline'
+        db.delete_table('mprocessor_pipeline_media_type')
+
+        # Deleting model 'Process'
+        db.delete_table('mprocessor_process')
+
+        # Deleting model 'ProcessTarget'
+        db.delete_table('mprocessor_processtarget')
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'dam_repository.type': {
+            'Meta': {'object_name': 'Type'},
+            'ext': ('django.db.models.fields.CharField', [], {'max_length': '5'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '30'}),
+            'subname': ('django.db.models.fields.CharField', [], {'max_length': '30'})
+        },
+        'dam_workspace.workspace': {
+            'Meta': {'unique_together': "(('name', 'creator'),)", 'object_name': 'Workspace'},
+            'creation_date': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'creator': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '512'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_update': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'members': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'workspaces'", 'symmetrical': 'False', 'to': "orm['auth.User']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '128'})
+        },
+        'mprocessor.pipeline': {
+            'Meta': {'object_name': 'Pipeline'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'media_type': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['dam_repository.Type']", 'symmetrical': 'False'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'params': ('django.db.models.fields.TextField', [], {}),
+            'triggers': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['mprocessor.TriggerEvent']", 'symmetrical': 'False'}),
+            'workspace': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['workspace.DAMWorkspace']"})
+        },
+        'mprocessor.process': {
+            'Meta': {'object_name': 'Process'},
+            'end_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_show_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'launched_by': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'pipeline': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['mprocessor.Pipeline']"}),
+            'start_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'targets': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'workspace': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['workspace.DAMWorkspace']"})
+        },
+        'mprocessor.processtarget': {
+            'Meta': {'object_name': 'ProcessTarget'},
+            'actions_cancelled': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'actions_failed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'actions_passed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'actions_todo': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'params': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'process': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['mprocessor.Process']"}),
+            'result': ('django.db.models.fields.TextField', [], {}),
+            'target_id': ('django.db.models.fields.CharField', [], {'max_length': '64'})
+        },
+        'mprocessor.triggerevent': {
+            'Meta': {'object_name': 'TriggerEvent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '40'})
+        },
+        'repository.item': {
+            'Meta': {'object_name': 'Item', 'db_table': "'item'"},
+            '_id': ('django.db.models.fields.CharField', [], {'max_length': '40', 'db_column': "'md_id'"}),
+            'creation_time': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'owned_items'", 'null': 'True', 'to': "orm['auth.User']"}),
+            'source_file_path': ('django.db.models.fields.TextField', [], {}),
+            'type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['dam_repository.Type']"}),
+            'update_time': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'uploader': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'uploaded_items'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'workspace.damworkspace': {
+            'Meta': {'object_name': 'DAMWorkspace', '_ormbases': ['dam_workspace.Workspace']},
+            'items': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'workspaces'", 'symmetrical': 'False', 'through': "orm['workspace.WorkspaceItem']", 'to': "orm['repository.Item']"}),
+            'workspace_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['dam_workspace.Workspace']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'workspace.workspaceitem': {
+            'Meta': {'unique_together': "(('item', 'workspace'),)", 'object_name': 'WorkspaceItem'},
+            'deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['repository.Item']"}),
+            'last_update': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'workspace': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['workspace.DAMWorkspace']"})
+        }
+    }
+
+    complete_apps = ['mprocessor']
@@ -1,5 +1,6 @@
 from json import dumps
 from django.db import models
+from django.db.models import F, Count, Sum
 from mediadart.storage import new_id
 from django.contrib.auth.models import User
 from mediadart.mqueue.mqclient_async import Proxy
@@ -26,6 +27,7 @@ class Pipeline(models.Model):
     media_type  = models.ManyToManyField(Type)  # mime types of objects that can be in params
     params = models.TextField()
     workspace = models.ForeignKey('workspace.DAMWorkspace')
+    priority = models.IntegerField(default=0)   # higher priority processes are run first
     
     def num_actions(self):
         if not hasattr(self, 'length'):
@@ -39,6 +41,13 @@ class Pipeline(models.Model):
         return (not types)  or (media_type in types)
 
     
+class ProcessManager(models.Manager):
+
+    def in_progress_stats(self):
+        """Returns (number of unfinished processes, number of their pending targets)"""
+        stats = self.filter(end_date__isnull = True).aggregate(processes=Count('pk'), pending=Sum('targets_pending'))
+        return stats['processes'], stats['pending'] or 0
+
 class Process(models.Model):    
     pipeline = models.ForeignKey(Pipeline)
 #    session = models.CharField(max_length=128,null = True, blank = True, unique = True)
@@ -48,11 +57,22 @@ class Process(models.Model):
     end_date = models.DateTimeField(null = True, blank = True)    # Set on completion
     launched_by = models.ForeignKey(User)
     last_show_date = models.DateTimeField(null = True, blank = True)
+    priority = models.IntegerField(null = True, blank = True)     # None: use the pipeline priority
+    # progress counters, kept up to date by the mprocessor (see count_targets)
+    targets_completed = models.IntegerField(default=0)  # targets with no action left to do
+    targets_failed = models.IntegerField(default=0)     # targets with at least a failed action
+    targets_pending = models.IntegerField(default=0)    # targets with actions still to do
+    objects = ProcessManager()
+
+    def get_priority(self):
+        if self.priority is None:
+            return self.pipeline.priority
+        return self.priority
     
     def get_progress(self):
-        items_completed =  self.get_num_target_completed()
-        items_failed =  self.get_num_target_failed()
-        total_items = self.processtarget_set.all().count()
+        items_completed = self.targets_completed
+        items_failed = self.targets_failed
+        total_items = self.targets
         if total_items == 0:
             progress = 0
         else:
@@ -82,11 +102,51 @@ class Process(models.Model):
         width=324 and height=256, and will invoke the action adapt_preview with parameters
         width=100 and height=256.
         """
-        for x in params.values():
-            if type(x) != type({}):
-                raise ValueError('params must be a dictionary of dictionaries')
+        _check_params(params)
         s = dumps(params)
         ProcessTarget.objects.create(process = self, target_id = target_id, params=s, actions_todo=self.pipeline.num_actions())
+        self._add_pending(1)
+
+    def add_targets(self, targets, chunk_size=500):
+        """add_targets: bulk version of add_params
+
+        @param targets: an iterable of (target_id, params), see add_params.
+        @param chunk_size: number of ProcessTarget records inserted by each query.
+
+        Returns the number of targets added.
+        """
+        num_actions = self.pipeline.num_actions()
+        count = 0
+        chunk = []
+        for target_id, params in targets:
+            _check_params(params)
+            chunk.append(ProcessTarget(process = self, target_id = target_id, params=dumps(params), actions_todo=num_actions))
+            if len(chunk) >= chunk_size:
+                ProcessTarget.objects.bulk_create(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            ProcessTarget.objects.bulk_create(chunk)
+            count += len(chunk)
+        self._add_pending(count)
+        return count
+
+    def _add_pending(self, count):
+        if count:
+            Process.objects.filter(pk=self.pk).update(targets=F('targets') + count, targets_pending=F('targets_pending') + count)
+            self.targets += count
+            self.targets_pending += count
+
+    def count_targets(self):
+        """Recomputes from ProcessTarget the number of targets and the progress counters.
+           The process is not saved.
+        """
+        targets = ProcessTarget.objects.filter(process = self)
+        self.targets = targets.count()
+        self.targets_completed = self.get_num_target_completed()
+        self.targets_failed = self.get_num_target_failed()
+        self.targets_pending = self.targets - self.targets_completed
+        return self.targets
 
     def get_num_target_completed(self):
         return ProcessTarget.objects.filter(process = self, actions_todo__lte=0).count()
@@ -100,6 +160,11 @@ class Process(models.Model):
     def run(self):
         Proxy('MProcessor').run()        
 
+def _check_params(params):
+    for x in params.values():
+        if type(x) != type({}):
+            raise ValueError('params must be a dictionary of dictionaries')
+
 def new_processor(pipeline_name, user, workspace):
     "utility function to create a process associated to a given pipeline"
     pipeline = Pipeline.objects.get(name=pipeline_name, workspace = workspace)
@@ -117,3 +182,15 @@ class ProcessTarget(models.Model):
     result = models.TextField()                     # anything sensible
     
 
+
+
+class ActionDuration(models.Model):
+    """Mean wall-clock duration of the actions run by the mprocessor, by script and
+       media type of the target (see processor.Durations)"""
+    script_name = models.CharField(max_length=50)
+    media_type = models.CharField(max_length=50, blank=True)     # name of the Type, '' if unknown
+    mean = models.FloatField(default=0)                          # seconds
+    samples = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('script_name', 'media_type'),)
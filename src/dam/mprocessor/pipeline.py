@@ -2,6 +2,8 @@ import random
 import os
 #from mediadart import log
 
+MIN_WEIGHT = 0.001             # weight of the actions with no (or zero) estimated duration
+
 class DAGError(Exception):
     pass
 
@@ -21,12 +23,62 @@ class Node:
         return "<Node %s>" % self.name
 
 
+class Plan:
+    """
+        The DAG of a pipeline compiled into index arrays, shared by the schedules
+        of all the targets (see schedule.Schedule).
+
+        Actions are numbered in topological order; a set of actions is a bitmask
+        where bit i stands for action i.
+            actions:      names of the actions, in topological order
+            index:        action name -> number
+            successors:   tuple of the numbers of the actions depending directly on each action
+            predecessors: mask of the actions each action depends directly on
+            descendants:  mask of the actions depending, directly or not, on each action
+            roots:        mask of the actions without predecessors
+            all:          mask of all the actions
+    """
+    def __init__(self, actions, childs):
+        "actions is a topological sorting, childs maps each action name to the names of its childs"
+        self.actions = tuple(actions)
+        self.index = dict([(name, i) for i, name in enumerate(self.actions)])
+        n = len(self.actions)
+        self.successors = tuple([tuple(sorted(set([self.index[c] for c in childs[name]]))) for name in self.actions])
+        predecessors = [0] * n
+        for i in xrange(n):
+            for j in self.successors[i]:
+                predecessors[j] |= 1 << i
+        self.predecessors = tuple(predecessors)
+        descendants = [0] * n
+        for i in xrange(n - 1, -1, -1):
+            for j in self.successors[i]:
+                descendants[i] |= (1 << j) | descendants[j]
+        self.descendants = tuple(descendants)
+        self.roots = sum([1 << i for i in xrange(n) if not predecessors[i]])
+        self.all = (1 << n) - 1
+
+    def names(self, mask):
+        "Returns the names of the actions in mask, in topological order"
+        ret = []
+        i = 0
+        while mask:
+            if mask & 1:
+                ret.append(self.actions[i])
+            mask >>= 1
+            i += 1
+        return ret
+
+
 class DAG:
+    PLAN_VARIANTS = 8          # shuffled plans compiled at most (see get_plan)
+
     def __init__(self, pipeline):
         self.root = Node('__start__')
         self.pipeline = pipeline
         self._build_dag()
         self._check_cycles()
+        self.plan = self.compile(False)
+        self.shuffled_plans = []
 
     def _build_dag(self):
         outputs = {}  # dizionario 'output': nodo produttore
@@ -118,6 +170,34 @@ class DAG:
         self._visit(self.root, shuffled, tag, cb, sorted)
         return sorted[1:]
 
+    def compile(self, shuffled=False, weights=None):
+        """returns a new Plan of the DAG. If weights is given, a dictionary with the
+           (positive) estimated duration of each action, actions are numbered by
+           decreasing length of the longest path from them to the end of the DAG,
+           so that the actions on the critical path are run first
+        """
+        childs = dict([(name, [c.name for c in data['__node__'].childs]) for name, data in self.pipeline.items()])
+        actions = self.sort(shuffled)
+        if weights:
+            # an action has a longer path than any of its childs: still a topological sorting
+            remaining = {}
+            for name in reversed(actions):
+                remaining[name] = max(weights.get(name) or 0, MIN_WEIGHT) + max([0] + [remaining[c] for c in childs[name]])
+            actions.sort(key=lambda name: -remaining[name])
+        return Plan(actions, childs)
+
+    def get_plan(self, shuffled=False):
+        """returns the compiled Plan of the DAG. If shuffled is True, returns one of
+           up to PLAN_VARIANTS plans, each compiled from a (possibly) different
+           topological sorting
+        """
+        if not shuffled:
+            return self.plan
+        if len(self.shuffled_plans) < self.PLAN_VARIANTS:
+            self.shuffled_plans.append(self.compile(True))
+            return self.shuffled_plans[-1]
+        return random.choice(self.shuffled_plans)
+
     def visit(self, name, user_callback, user_data):
         """ visit all the nodes applying callback to user_data """
         tag = self._new_tag()
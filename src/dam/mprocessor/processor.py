@@ -27,102 +27,364 @@
 # Randomize schedules, associating a schedule to each item. This can help improve
 # servers load. Not useful is schedules are natively totally ordered.
 # 
+# 0.6
+# Run several processes concurrently under a global outstanding requests budget,
+# shared fairly among workspaces and weighted by process priority.
+# 
+# 0.7
+# Keep completed/failed/pending counters on Process, written together with the
+# targets progress, so that monitors do not need to count ProcessTarget rows.
+# Publish each progress write to the GUI (see progress.py).
+# 
+# 0.8
+# Compile the DAG once into a Plan shared by all schedules: a schedule only holds
+# a few bitmasks of the actions of the plan (see pipeline.Plan).
+# 
+# 0.9
+# Record the duration of the actions (see Durations) and run first, for each target,
+# the actions on its longest remaining path. Ready targets are queued by the server
+# class of their next action, and the least busy class is served first, so that
+# HighLoad, MediumLoad and LowLoad servers are kept busy together.
+# 
+# 0.10
+# Limit the outstanding requests of each server class and of each script
+# (server_limits and script_limits in the configuration), besides max_outstanding.
+# 
 #####################################################################################
 
 
 import os
+import sys
+import time
+import types
 import datetime
 import re
-from twisted.internet import reactor, defer
+from collections import deque
+from twisted.internet import reactor, defer, threads
 from mediadart.utils import default_start_mqueue
 
 
+from django.db import transaction
 from django.db.models import Q
 from json import loads
 from mediadart.mqueue.mqserver import MQServer
 from mediadart.config import Configurator
 from mediadart import log
-from dam.mprocessor.models import Process, ProcessTarget
+from dam.mprocessor.models import Process, ProcessTarget, ActionDuration
 from dam.mprocessor.pipeline import DAG
 from dam.mprocessor.schedule import Schedule
+from dam.mprocessor import progress
+
+UPDATE_CHUNK = 500       # max targets written by a single query, see Batch._save_targets
 
 class BatchError(Exception):
     pass
 
+_action_base = re.compile('^[a-z_]+')
+
+def get_limits(cfg, option):
+    """Returns the dictionary {name: limit} read from option of the MPROCESSOR section,
+       a list of name:limit separated by commas; empty if option is not set
+    """
+    try:
+        value = cfg.get('MPROCESSOR', option)
+    except Exception:
+        return {}
+    limits = {}
+    for entry in value.split(','):
+        if entry.strip():
+            name, limit = entry.split(':')
+            limits[name.strip()] = int(limit)
+    return limits
+
+def new_budget(cfg):
+    "Returns a Budget with the limits of the configuration"
+    return Budget(cfg.getint('MPROCESSOR', 'max_outstanding'), get_limits(cfg, 'server_limits'),
+                  get_limits(cfg, 'script_limits'))
+
+class Budget:
+    """
+        Global congestion control shared by all the batches running in the
+        MProcessor.
+
+        The total number of outstanding requests is kept under max_outstanding.
+        The budget is first split evenly among the workspaces that have a running
+        batch, then, inside each workspace, among its batches in proportion to
+        their priority. Every batch is always granted at least one slot, so a small
+        interactive job never waits behind a bulk import.
+
+        The outstanding requests to each server class and of each script are also
+        kept under the limits in server_limits and script_limits, if any: a batch
+        only runs the actions whose class and script have spare capacity.
+    """
+    def __init__(self, max_outstanding, server_limits=None, script_limits=None):
+        self.max_outstanding = max_outstanding
+        self.server_limits = server_limits or {}
+        self.script_limits = script_limits or {}
+        self.outstanding = 0               # outstanding requests of all batches
+        self.batches = []
+        self.shares = {}                   # batch -> max number of outstanding requests
+        self.stalled = set()               # batches waiting for a free slot
+        self.server_load = {}              # server class -> outstanding requests
+        self.script_load = {}              # script name -> outstanding requests
+
+    def add(self, batch):
+        self.batches.append(batch)
+        self._compute_shares()
+
+    def remove(self, batch):
+        if batch in self.batches:
+            self.batches.remove(batch)
+        self.stalled.discard(batch)
+        self.shares.pop(batch, None)
+        self._compute_shares()
+        self._wake_stalled()
+
+    def _compute_shares(self):
+        workspaces = {}
+        for b in self.batches:
+            workspaces.setdefault(b.process.workspace_id, []).append(b)
+        if not workspaces:
+            return
+        ws_share = float(self.max_outstanding) / len(workspaces)
+        for batches in workspaces.values():
+            weights = [b.weight for b in batches]
+            total = float(sum(weights))
+            for b, w in zip(batches, weights):
+                self.shares[b] = max(1, int(ws_share * w / total))
+        log.debug('budget shares: %s' % ', '.join(['%s:%s' % (b.process.pk, s) for b, s in self.shares.items()]))
+
+    def available(self, batch):
+        "True if batch can issue a new request"
+        return (self.outstanding < self.max_outstanding and
+                batch.outstanding < self.shares.get(batch, self.max_outstanding))
+
+    def load(self, server_class):
+        "Number of outstanding requests to the servers of server_class"
+        return self.server_load.get(server_class, 0)
+
+    def has_capacity(self, server_class, script_name):
+        "True if a request of script_name to server_class is within their limits"
+        limit = self.server_limits.get(server_class)
+        if limit is not None and self.server_load.get(server_class, 0) >= limit:
+            return False
+        limit = self.script_limits.get(script_name)
+        if limit is not None and self.script_load.get(script_name, 0) >= limit:
+            return False
+        return True
+
+    def acquire(self, batch, server_class=None, script_name=None):
+        self.outstanding += 1
+        batch.outstanding += 1
+        self.server_load[server_class] = self.server_load.get(server_class, 0) + 1
+        self.script_load[script_name] = self.script_load.get(script_name, 0) + 1
+
+    def release(self, batch, server_class=None, script_name=None):
+        self.outstanding -= 1
+        batch.outstanding -= 1
+        self.server_load[server_class] -= 1
+        self.script_load[script_name] -= 1
+        self._wake_stalled()
+
+    def stall(self, batch):
+        "batch has work to do but no slot: it will be rescheduled on next release"
+        self.stalled.add(batch)
+
+    def _wake_stalled(self):
+        stalled, self.stalled = self.stalled, set()
+        for b in stalled:
+            reactor.callLater(0, b._iterate)
+
+
+class Durations:
+    """
+        Mean wall-clock durations of the actions, by script and media type of the
+        target, shared by all the batches running in the MProcessor. They are the
+        weights of the plans of the DAG (see DAG.compile).
+
+        Means are exponential moving averages of the samples, read from and written
+        to ActionDuration if persistent. A script never run on a media type is
+        assumed to last its mean on the other media types, or DEFAULT seconds.
+    """
+    ALPHA = 0.2                            # weight of a new sample
+    DEFAULT = 1.0
+
+    def __init__(self, persistent=True):
+        self.persistent = persistent
+        self.means = None                  # (script_name, media_type) -> (mean, samples)
+        self.dirty = set()                 # keys of the means not yet written to db
+
+    def _load(self):
+        if self.means is None:
+            self.means = {}
+            if self.persistent:
+                for script_name, media_type, mean, samples in ActionDuration.objects.values_list('script_name', 'media_type', 'mean', 'samples'):
+                    self.means[(script_name, media_type)] = (mean, samples)
+        return self.means
+
+    def get(self, script_name, media_type):
+        "Returns the estimated duration in seconds of script_name on a target of media_type"
+        means = self._load()
+        key = (script_name, media_type or '')
+        if key in means:
+            return means[key][0]
+        others = [mean for (s, t), (mean, samples) in means.items() if s == script_name]
+        if others:
+            return sum(others) / len(others)
+        return self.DEFAULT
+
+    def record(self, script_name, media_type, seconds):
+        means = self._load()
+        key = (script_name, media_type or '')
+        mean, samples = means.get(key, (seconds, 0))
+        means[key] = (mean + self.ALPHA * (seconds - mean), samples + 1)
+        self.dirty.add(key)
+
+    def save(self):
+        "Writes to db the means changed since the last save"
+        dirty, self.dirty = self.dirty, set()
+        if not self.persistent:
+            return
+        for script_name, media_type in dirty:
+            mean, samples = self.means[(script_name, media_type)]
+            if not ActionDuration.objects.filter(script_name=script_name, media_type=media_type).update(mean=mean, samples=samples):
+                ActionDuration.objects.create(script_name=script_name, media_type=media_type, mean=mean, samples=samples)
+
+
 #
 # This class can be only a singleton (option only_one_server=True) to ensure that
-# only one process is active in mediadart at the same time.
+# only one instance is active in mediadart at the same time.
+# Up to concurrency_level processes are run concurrently, sharing the
+# max_outstanding requests budget.
 #
 class MProcessor(MQServer):
-    def wake_process(self, restarting):
-        running_processes = Process.objects.filter(Q(end_date=None) & ~Q(start_date=None))
-        log.info("Running processes: %d" % len(running_processes))
-        if running_processes:
-            if restarting:
-                log.info("Restarting process %s" % (running_processes[0].pk))
-                return running_processes[0]    # rerun a running process, some actions
-                                               # will be repeated
-            else:
-                log.info("Process %s already running, doing nothing" % (running_processes[0].pk))
-                return None                    # a process is already running, do nothing
-        else:
-            waiting_processes = Process.objects.filter(start_date=None)
-            log.info("Number of waiting processes: %d" % len(waiting_processes))
-            if waiting_processes:
-                log.info("running the waiting process %s" % (waiting_processes[0].pk))
-                return waiting_processes[0]
-            else:
-                log.info("No waiting process: doing nothing")
-                return None
+    def __init__(self, *args, **kwargs):
+        MQServer.__init__(self, *args, **kwargs)
+        cfg = Configurator()
+        self.concurrency_level = cfg.getint('MPROCESSOR', 'concurrency_level')
+        self.budget = new_budget(cfg)
+        self.durations = Durations()
+        self.running = {}                  # process.pk -> Batch
+        port = progress.get_port()
+        if port:
+            progress.publisher.listen(port)
+
+    def wake_processes(self, restarting):
+        """Returns the list of processes to be started.
+
+           When restarting, the processes that were running when the server stopped
+           are run again (some actions will be repeated). Free slots are then
+           filled with waiting processes, highest priority first, preferring the
+           workspaces with fewer running processes.
+        """
+        ret = []
+        if restarting:
+            for process in Process.objects.filter(Q(end_date=None) & ~Q(start_date=None)):
+                if process.pk not in self.running:
+                    log.info("Restarting process %s" % process.pk)
+                    ret.append(process)
+
+        free = self.concurrency_level - len(self.running) - len(ret)
+        if free <= 0:
+            log.info("Running processes: %d, doing nothing" % len(self.running))
+            return ret
+
+        waiting = list(Process.objects.filter(start_date=None).select_related('pipeline').order_by('pk'))
+        log.info("Number of waiting processes: %d" % len(waiting))
+        ws_load = {}
+        for process in [b.process for b in self.running.values()] + ret:
+            ws_load[process.workspace_id] = ws_load.get(process.workspace_id, 0) + 1
+        while waiting and free > 0:
+            process = min(waiting, key=lambda p: (-p.get_priority(), ws_load.get(p.workspace_id, 0), p.pk))
+            waiting.remove(process)
+            log.info("running the waiting process %s" % process.pk)
+            ret.append(process)
+            ws_load[process.workspace_id] = ws_load.get(process.workspace_id, 0) + 1
+            free -= 1
+        return ret
 
     def mq_run(self, process_id="", restarting=False):
-        """Run a waiting process.
+        """Run waiting processes.
         
-           This method tries to run a waiting process and schedules itself to run again
-           when the process ends so that the queue of waiting processes can be emptied
+           This method tries to run waiting processes and schedules itself to run again
+           when each process ends so that the queue of waiting processes can be emptied
            """
-        process = self.wake_process(restarting)
-        if process:
-            d = Batch(process).run()
-            d.addCallback(self.mq_run)
+        for process in self.wake_processes(restarting):
+            batch = Batch(process, self.budget, self.durations)
+            self.running[process.pk] = batch
+            d = batch.run()
+            d.addBoth(self._batch_done, process.pk)
         return 'ok'
 
+    def _batch_done(self, result, process_pk):
+        batch = self.running.pop(process_pk, None)
+        if batch:
+            self.budget.remove(batch)
+        self.mq_run()
+        return result
+
 class Batch:
-    def __init__(self, process):
+    def __init__(self, process, budget=None, durations=None):
         self.cfg = Configurator()
-        self.max_outstanding = self.cfg.getint('MPROCESSOR', 'max_outstanding')
+        if budget is None:                 # running alone
+            budget = new_budget(self.cfg)
+        self.budget = budget
+        self.durations = durations or Durations()
+        self.weight = 1 + max(0, process.get_priority())
         self.batch_size = self.cfg.getint('MPROCESSOR', 'batch_size') # how many items to load
         self.pipeline = loads(process.pipeline.params)
         self.dag = DAG(self.pipeline)
         self.schedule_length = len(self.pipeline)
         self.process = process
         self.scripts = self._get_scripts(self.pipeline)
+        self.servers = self._get_server_classes(self.scripts)
+        # action -> (server class, script name), the limits that apply to it (see Budget)
+        self.slots = dict([(a, (self.servers[a], d['script_name'])) for a, d in self.pipeline.items()])
+        self.plans = {}                    # media type -> Plan, compiled for each batch of targets
+        self.templates = self._compile_params(self.pipeline)
         self.all_targets_read = False      # True when all targets have been read
         self.gameover = False              # True when all targets are done
         self.deferred = None               # used to signal end of batch job
-        self.outstanding = 0               # number of not yet answered requests
-        self.cur_batch = 0                 # index in batch
-        self.cur_task = 0                  # index in tasks
+        self.outstanding = 0               # number of not yet answered requests (see Budget)
+        self.last_pk = 0                   # pk of the last target read
+        self.prefetch = self.cfg.getint('MPROCESSOR', 'prefetch')
+        self.prefetching = False           # True while the next batch is read in a thread
+        self.next_page = None              # batch read in advance
+        self.ready = {}                    # slot -> deque of tasks whose next action has that slot
+        self.blocked = False               # True if ready actions wait for capacity in their slot
+        self.num_tasks = 0                 # loaded tasks not yet finished
         self.totals = {'update':0, 'passed':0, 'failed':0, 'targets': 0, None: 0} 
         self.results = {}
+        self.dirty = {}                    # items whose progress is not yet written to db
+        self.completions = 0               # completions since the last write
+        self.flush_call = None             # pending timed write
+        self.update_interval = self.cfg.getint('MPROCESSOR', 'update_interval')
+        self.update_period = self.cfg.getint('MPROCESSOR', 'update_period')
 
     def run(self):
         "Start the iteration initializing state so that the iteration starts correctly"
         log.debug('### Running process %s' % str(self.process.pk))
         self.deferred = defer.Deferred()
         self.process.start_date = datetime.datetime.now()
+        self.process.targets = self._count_targets()
         self.process.save()
-        self.process.targets = ProcessTarget.objects.filter(process=self.process).count()
-        self.tasks = []
+        self.budget.add(self)
         reactor.callLater(0, self._iterate)
         return self.deferred
 
+    def _count_targets(self):
+        "Returns the number of targets, refreshing the progress counters of the process"
+        return self.process.count_targets()
+
     def stop(self, seconds_offset=0):
         log.info('stopping process %s' % self.process.pk)
+        self._flush_progress()
         when = datetime.datetime.now() + datetime.timedelta(seconds=seconds_offset)
         self.process.end_date = when
         self.process.save()
         self.gameover = True
+        self._publish([])
+        self.budget.remove(self)
         self.deferred.callback(None)
 
     def _update_item_stats(self, item, action, result, success, failure, cancelled):
@@ -134,11 +396,87 @@ class Batch:
         if item.pk not in self.results:
             self.results[item.pk] = {}
         self.results[item.pk][action] = (success, result)
-        if item.actions_todo <= 0 or failure > 0:
-            item.result = dumps(self.results[item.pk])
-        if item.actions_todo <= 0:
-            #log.debug('_update_item_stats: finalizing item %s' % item.target_id) #d
-            del self.results[item.pk]
+        self.dirty[item.pk] = item
+
+    def _progress_done(self):
+        """Called after each completion, writes the progress of the dirty items
+           every update_interval completions or every update_period ms.
+
+           Progress not yet written when the server dies is lost: on restart 
+           (see MProcessor.wake_processes) the corresponding actions are repeated.
+        """
+        self.completions += 1
+        if self.completions >= self.update_interval:
+            self._flush_progress()
+        elif self.flush_call is None and self.dirty:
+            self.flush_call = reactor.callLater(self.update_period / 1000.0, self._flush_progress)
+
+    def _flush_progress(self):
+        "Write to db the progress of all dirty items"
+        if self.flush_call is not None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
+        self.completions = 0
+        if not self.dirty:
+            return
+        updates = []
+        completed = failed = 0
+        for item in self.dirty.values():
+            fields = {'actions_passed': item.actions_passed,
+                      'actions_failed': item.actions_failed,
+                      'actions_cancelled': item.actions_cancelled,
+                      'actions_todo': item.actions_todo}
+            if item.actions_todo <= 0 or item.actions_failed > 0:
+                item.result = fields['result'] = dumps(self.results[item.pk])
+            if item.actions_todo <= 0:
+                #log.debug('_flush_progress: finalizing item %s' % item.target_id) #d
+                del self.results[item.pk]
+            updates.append((item.pk, fields))
+            # update the counters of the process with the changes since the last write
+            counted = (item.actions_todo <= 0, item.actions_failed > 0)
+            completed += counted[0] - item.counted[0]
+            failed += counted[1] - item.counted[1]
+            item.counted = counted
+        changed = [item.target_id for item in self.dirty.values()]
+        self.dirty = {}
+        self.process.targets_completed += completed
+        self.process.targets_failed += failed
+        self.process.targets_pending -= completed
+        self._save_targets(updates)
+        self.durations.save()
+        self._publish(changed)
+
+    def _publish(self, target_ids):
+        "Notifies the GUI of the targets whose progress has just been written, see progress.py"
+        progress.publisher.publish(self.process.workspace_id, {
+            'process': self.process.pk,
+            'items': target_ids,
+            'targets': self.process.targets,
+            'completed': self.process.targets_completed,
+            'failed': self.process.targets_failed,
+            'finished': self.gameover,
+        })
+
+    @transaction.commit_on_success
+    def _save_targets(self, updates):
+        """updates is a list of (ProcessTarget.pk, {field: value}), written in a single transaction
+           together with the progress counters of the process.
+
+           Targets with the same new values (those without a result, usually most of
+           them) are written by a single query.
+        """
+        groups = {}
+        for pk, fields in updates:
+            if 'result' in fields:
+                ProcessTarget.objects.filter(pk=pk).update(**fields)
+            else:
+                groups.setdefault(tuple(sorted(fields.items())), []).append(pk)
+        for fields, pks in groups.items():
+            for start in xrange(0, len(pks), UPDATE_CHUNK):
+                ProcessTarget.objects.filter(pk__in=pks[start:start + UPDATE_CHUNK]).update(**dict(fields))
+        Process.objects.filter(pk=self.process.pk).update(targets_completed=self.process.targets_completed,
+                    targets_failed=self.process.targets_failed, targets_pending=self.process.targets_pending)
         
     def _get_scripts(self, pipeline):
         """Load scripts from plugin directory. 
@@ -162,62 +500,212 @@ class Batch:
                 scripts[script_key] = (f, script_dict.get('params', {}))
         return scripts
 
+    def _get_server_classes(self, scripts):
+        """Returns the dictionary {'action': server class}, the md_server of the
+           plugin class defined in the module of the script, if any
+        """
+        servers = {}
+        for action, (method, params) in scripts.items():
+            module = sys.modules.get(method.__module__)
+            servers[action] = 'GenericCmdline'
+            for obj in vars(module).values():
+                if isinstance(obj, (type, types.ClassType)) and obj.__module__ == method.__module__ and getattr(obj, 'md_server', None):
+                    servers[action] = obj.md_server
+                    break
+        return servers
+
+    def _get_plan(self, media_type):
+        """Returns the plan of the DAG for targets of media_type, with the actions on
+           the longest path first according to the recorded durations (see Durations)
+        """
+        plan = self.plans.get(media_type)
+        if plan is None:
+            weights = dict([(action, self.durations.get(data['script_name'], media_type)) for action, data in self.pipeline.items()])
+            plan = self.plans[media_type] = self.dag.compile(True, weights)
+        return plan
+
+    def _compile_params(self, pipeline):
+        """Resolve once the parameters of each action of the pipeline.
+
+           Returns the dictionary
+           {'action': (params, keys of params left empty, action name without digits)}
+           The params dictionaries are templates and must never be modified.
+        """
+        templates = {}
+        for action, script_dict in pipeline.items():
+            params = script_dict.get('params', {})
+            empty = tuple([k for k, v in params.items() if v == ''])
+            m = _action_base.match(action)     # cut out digits from action name
+            templates[action] = (params, empty, m and m.group() or action)
+        return templates
+
+    def _resolve_params(self, action, item_params):
+        """Returns a new dictionary with the parameters of action for an item.
+
+           item_params is the decoded ProcessTarget.params (see Process.add_params)
+        """
+        template, empty, base_name = self.templates[action]
+        params = dict(template)
+        own = item_params.get(action, {})
+        for k in empty:
+            if k in own:
+                params[k] = own[k]
+        params.update(item_params.get('*', {}))
+        params.update(item_params.get(base_name, {}))
+        return params
+
+    def _load_targets(self, last_pk, limit):
+        """Returns the next page of targets still to be processed, ordered by pk,
+           with the name of the media type of their item in media_type.
+
+           Targets completed in a previous run (see MProcessor.wake_processes) are skipped.
+        """
+        from dam.repository.models import Item
+        targets = list(ProcessTarget.objects.filter(process=self.process.pk, pk__gt=last_pk, 
+                    actions_todo__gt=0).order_by('pk')[:limit])
+        item_ids = [int(x.target_id) for x in targets if x.target_id.isdigit()]
+        media_types = dict(Item.objects.filter(pk__in=item_ids).values_list('pk', 'type__name'))
+        for x in targets:
+            x.media_type = x.target_id.isdigit() and media_types.get(int(x.target_id)) or None
+        return targets
+
     def _new_batch(self):
-        "Loads from db the next batch of items and associate a schedule to each item"
+        """Loads from db the next batch of items and associate a schedule to each item.
+
+           The new tasks are appended to the ready queue. Returns the number of tasks loaded.
+           If prefetch is enabled, the following batch is read in a thread while this one is
+           running.
+        """
         if self.all_targets_read:
-            return []
+            return 0
 
-        targetset = ProcessTarget.objects.filter(process=self.process.pk)[self.cur_batch:self.cur_batch + self.batch_size]
-        if targetset:
-            self.cur_batch += self.batch_size
-            ret = [{'item':x, 'schedule':Schedule(self.dag, x.target_id)} for x in targetset]   # item, index of current action, schedule
+        if self.next_page is not None:
+            targetset, self.next_page = self.next_page, None
+        elif self.prefetching:
+            return 0                       # _page_loaded will iterate again
         else:
-            self.all_targets_read = True
-            ret = []
-        return ret
-
-    def _get_action(self):
-        """returns the first action found or None. Delete tasks with no actions left"""
-        #log.debug("_get_action on num_tasks=%s" % len(self.tasks)) #d
-        to_delete = []
-        action = ''
-        for n in xrange(len(self.tasks)):
-            idx = (self.cur_task + n) % len(self.tasks)
-            task = self.tasks[idx]
-            action = task['schedule'].action_to_run()
-            if action is None:
-                to_delete.append(task)
-            elif action:
-                break
+            targetset = self._load_targets(self.last_pk, self.batch_size)
 
-        #log.debug('to_delete %s' % to_delete) #d
+        if len(targetset) < self.batch_size:
+            self.all_targets_read = True
+        if not targetset:
+            return 0
+
+        self.last_pk = targetset[-1].pk
+        self.plans = {}                    # recompiled with the current durations
+        for x in targetset:
+            x.counted = (x.actions_todo <= 0, x.actions_failed > 0)     # as seen by process counters
+            if x.actions_todo != self.schedule_length:
+                # interrupted in a previous run: the whole pipeline is run again
+                x.actions_passed = x.actions_failed = x.actions_cancelled = 0
+                x.actions_todo = self.schedule_length
+            media_type = getattr(x, 'media_type', None)
+            task = {'item':x, 'queued':False, 'media_type': media_type, 'params': x.params and loads(x.params) or {}}
+            task['schedule'] = Schedule(self.dag, x.target_id, on_ready=lambda s, t=task: self._push_ready(t),
+                                        plan=self._get_plan(media_type))
+            self._queue(task)
+        self.num_tasks += len(targetset)
+        if self.prefetch and not self.all_targets_read:
+            self.prefetching = True
+            d = threads.deferToThread(self._load_targets, self.last_pk, self.batch_size)
+            d.addCallbacks(self._page_loaded, self._page_failed)
+        return len(targetset)
+
+    def _page_loaded(self, targetset):
+        self.prefetching = False
+        self.next_page = targetset
+        if not self.gameover:
+            self._reschedule()
+
+    def _page_failed(self, failure):
+        log.error('prefetch of targets of process %s failed: %s' % (self.process.pk, str(failure)))
+        self.prefetching = False           # the next batch is read synchronously
+        if not self.gameover:
+            self._reschedule()
+
+    def _queue(self, task, slot=None):
+        "Appends task to the ready queue of the slot (see Budget) of its next action"
+        task['queued'] = True
+        if slot is None:
+            slot = self.slots[task['schedule'].next_action()]
+        if slot not in self.ready:
+            self.ready[slot] = deque()
+        self.ready[slot].append(task)
+
+    def _push_ready(self, task):
+        "Called by the schedule of task when some of its actions go ready"
+        if not task['queued']:
+            self._queue(task)
+
+    def _next_task(self):
+        """Pops a task from the queue of the least busy server class with spare capacity.
+           Returns None if no task is ready, or if none can run within the limits.
+
+           A task stays in the queue of the action that was next when it was queued,
+           but an action completed since then may have made ready an action that
+           comes earlier in the plan: such a task is moved to the queue of the slot
+           of its actual next action, so that the limits are checked for it.
+        """
+        while True:
+            queues = [(self.budget.load(slot[0]), slot) for slot, q in self.ready.items() if q and self.budget.has_capacity(*slot)]
+            if not queues:
+                return None
+            slot = min(queues, key=lambda x: x[0])[1]
+            task = self.ready[slot].popleft()
+            action = task['schedule'].next_action()
+            if action is None or self.slots[action] == slot:
+                return task
+            self._queue(task, self.slots[action])
 
-        for t in to_delete:                   
-            #log.debug('deleting done target %s' % t['item'].target_id) #d
-            self.tasks.remove(t)
+    def _task_done(self, task):
+        self.num_tasks -= 1
 
-        # update cur_task so that we do not always start querying the same task for new actions
-        if action:
-            idx = self.tasks.index(task)
-            self.cur_task = (idx + 1) % len(self.tasks)
-        else:
-            self.cur_task = 0
+    def _get_action(self):
+        """returns the first action found in the ready queues or (None, None).
 
-        # if action is None or empy there is no action ready to run
+           The queue of the server class with fewer outstanding requests is served
+           first, among those whose class and script have spare capacity. Tasks of a queue are served round robin: a task that still has
+           ready actions is appended again at the end of the queue of its next action.
+        """
+        while True:
+            task = self._next_task()
+            if task is None:
+                break
+            schedule = task['schedule']
+            action = schedule.action_to_run()
+            if action:
+                if schedule.has_ready():
+                    self._queue(task)
+                else:
+                    task['queued'] = False
+                return action, task
+            task['queued'] = False
+            if action is None:            # should not happen: finished tasks are not queued
+                self._task_done(task)
+
+        # actions are ready but their server class or script is at its limit:
+        # wait for a release (see Budget) without loading more targets
+        self.blocked = any(self.ready.values())
+        if self.blocked:
+            self.budget.stall(self)
+            return None, None
+
+        # no action is ready to run
         # if there are new targets available try to read some and find some new action
-        if action:
-            return action, task
+        if not self.all_targets_read and self.budget.available(self):
+            if self._new_batch():
+                return self._get_action()
+        if self.all_targets_read and not self.num_tasks:
+            log.debug("_get_action: gameover")
+            self.stop()
+        return  None, None
+
+    def _reschedule(self):
+        "Iterate again as soon as there is a free slot in the budget"
+        if self.budget.available(self):
+            reactor.callLater(0, self._iterate)
         else:
-            if not self.all_targets_read and self.outstanding < self.max_outstanding:
-                new_tasks = self._new_batch()
-                if new_tasks:
-                    self.cur_task = len(self.tasks)
-                    self.tasks.extend(new_tasks)
-            if self.all_targets_read and not self.tasks:
-                log.debug("_get_action: gameover")
-                self.stop()
-            return  None, None
-
+            self.budget.stall(self)
 
     def _iterate(self):
         """ Run the actions listed in schedule on the items returned by _new_batch """
@@ -228,55 +716,50 @@ class Batch:
         action, task = self._get_action()
         if action:
             item, schedule = task['item'], task['schedule']
-            method, params = self.scripts[action]
+            method, params = self.scripts[action][0], {}
+            self.budget.acquire(self, *self.slots[action])
+            started = time.time()
             try:
-                item_params = loads(item.params)
-
-                # tmp bug fixing starts here
-                for k in params.keys():
-                    if params[k] == '' and (k in item_params[action]):
-                        params[k] = item_params[action][k]
-                # tmp bug fixing ends here
-
-                params.update(item_params.get('*', {}))
-                x = re.compile('^[a-z_]+' ) # cut out digits from action name
-                params.update(item_params.get(x.match(action).group(), {}))
-                self.outstanding += 1
-                #params = {u'source_variant_name': u'original'}
+                params = self._resolve_params(action, task['params'])
                 d = method(self.process.workspace, item.target_id, **params)
             except Exception, e:
                 log.error('ERROR in %s: %s %s' % (str(method), type(e), str(e)))
-                self._handle_err(str(e), item, schedule, action, params)
+                self._handle_err(str(e), task, action, params, started)
             else:
                 d.addCallbacks(self._handle_ok, self._handle_err, 
-                    callbackArgs=[item, schedule, action, params], errbackArgs=[item, schedule, action, params])
+                    callbackArgs=[task, action, params, started], errbackArgs=[task, action, params, started])
         # If _get_action did not find anything and there are no more targets, no action
         # will be available until an action completes and allows more actions to go ready.
-        if self.outstanding < self.max_outstanding and (action or not self.all_targets_read):
+        if action or not (self.all_targets_read or self.prefetching or self.blocked):
             #log.debug('_iterate: rescheduling') #d
-            reactor.callLater(0, self._iterate)
+            self._reschedule()
 
-    def _handle_ok(self, result, item, schedule, action, params):
+    def _handle_ok(self, result, task, action, params, started):
+        item, schedule = task['item'], task['schedule']
         #log.info("_handle_ok: target %s: action %s: %s" % (item.target_id, action, result)) #d
-        self.outstanding -= 1
+        self.budget.release(self, *self.slots[action])
+        self.durations.record(self.pipeline[action]['script_name'], task['media_type'], time.time() - started)
         schedule.done(action)
-        if self.outstanding < self.max_outstanding:
-            #log.debug('_handle_ok: rescheduling') #d
-            reactor.callLater(0, self._iterate)
         self._update_item_stats(item, action, result, 1, 0, 0)
-        item.save()
-
-    def _handle_err(self, result, item, schedule, action, params):
+        self._progress_done()
+        if schedule.is_finished():
+            self._task_done(task)
+        #log.debug('_handle_ok: rescheduling') #d
+        self._reschedule()
+
+    def _handle_err(self, result, task, action, params, started):
+        item, schedule = task['item'], task['schedule']
         log.error('_handle_err action %s on target_id=%s: %s' % (action, item.target_id, str(result)))
-        self.outstanding -= 1
+        self.budget.release(self, *self.slots[action])
         cancelled = schedule.fail(action)
         self._update_item_stats(item, action, str(result), 0, 1, 0)
         for a in cancelled:
             self._update_item_stats(item, a, "cancelled on failed %s" % action, 0, 0, 1)
-        if self.outstanding < self.max_outstanding:
-            #log.debug('_handle_err: rescheduling') #d
-            reactor.callLater(0, self._iterate)
-        item.save()
+        self._progress_done()
+        if schedule.is_finished():
+            self._task_done(task)
+        #log.debug('_handle_err: rescheduling') #d
+        self._reschedule()
 
 
 def start_server():
@@ -323,6 +806,9 @@ class fake_config:
             'plugins': 'dam.mprocessor.plugins',
             'max_outstanding': '17',
             'batch_size': '5',
+            'update_interval': '5',
+            'update_period': '1000',
+            'prefetch': '0',
         },
     }
     def get(self, section, option):
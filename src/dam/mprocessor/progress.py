@@ -0,0 +1,161 @@
+"""
+Progress notifications from the mprocessor to the GUI.
+
+Each time the progress of a process is written on db, the mprocessor publishes
+a notification with the targets that changed and the counters of the process.
+Web processes keep the notifications received for each workspace in a
+LocalChannel, where get_status waits for them instead of polling the db.
+
+If progress_port is set in the MPROCESSOR section of the configuration, the
+mprocessor accepts subscribers on that port of localhost and sends them a json
+line for each notification; each web process subscribes with a thread of its
+own. Otherwise notifications go to the LocalChannel of the publishing process,
+which is enough when publisher and reader share a process (e.g. tests).
+"""
+import socket
+import threading
+import time
+from collections import deque
+from json import dumps, loads
+from twisted.internet.protocol import Protocol
+
+HISTORY = 1000           # notifications kept for each workspace
+RECONNECT_DELAY = 5      # seconds between connection attempts of a subscriber
+
+
+class LocalChannel:
+    """Keeps the last notifications of every workspace and wakes up who waits for them.
+
+       Notifications are numbered by the publisher, so that a reader can ask for
+       those following the last one it has seen, whatever web process serves it.
+    """
+    def __init__(self, history=HISTORY):
+        self.cond = threading.Condition()
+        self.history = history
+        self.seq = 0                       # number of the last notification
+        self.events = {}                   # workspace_id -> deque of (seq, message)
+        self.live = False                  # True when notifications are being received
+
+    def publish(self, workspace_id, seq, message):
+        self.cond.acquire()
+        try:
+            if seq <= self.seq:            # the publisher was restarted
+                self.events = {}
+            self.seq = seq
+            if workspace_id not in self.events:
+                self.events[workspace_id] = deque(maxlen=self.history)
+            self.events[workspace_id].append((seq, message))
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def get(self, workspace_id, since):
+        "Returns the number of the last notification and the messages of workspace_id after since"
+        return self.seq, [m for s, m in self.events.get(workspace_id, ()) if s > since]
+
+    def wait(self, workspace_id, since, timeout):
+        """Like get, but waits up to timeout seconds for a message.
+           Returns at once if since is not a valid notification number.
+        """
+        deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            while True:
+                seq, messages = self.get(workspace_id, since)
+                remaining = deadline - time.time()
+                if messages or since > seq or remaining <= 0:
+                    return seq, messages
+                self.cond.wait(remaining)
+        finally:
+            self.cond.release()
+
+
+channel = LocalChannel()
+
+
+class Publisher:
+    "Used by the mprocessor to send notifications, to subscribers or to the local channel"
+    def __init__(self):
+        self.seq = 0
+        self.port = None
+        self.subscribers = []
+
+    def listen(self, port):
+        from twisted.internet import reactor, protocol
+        factory = protocol.ServerFactory()
+        factory.protocol = _SubscriberProtocol
+        factory.publisher = self
+        reactor.listenTCP(port, factory, interface='127.0.0.1')
+        self.port = port
+
+    def publish(self, workspace_id, message):
+        self.seq += 1
+        message['seq'] = self.seq
+        message['workspace'] = workspace_id
+        if self.port is None:
+            channel.live = True
+            channel.publish(workspace_id, self.seq, message)
+        else:
+            line = dumps(message) + '\n'
+            for subscriber in self.subscribers:
+                subscriber.transport.write(line)
+
+
+class _SubscriberProtocol(Protocol):
+    def connectionMade(self):
+        self.factory.publisher.subscribers.append(self)
+
+    def connectionLost(self, reason):
+        self.factory.publisher.subscribers.remove(self)
+
+    def dataReceived(self, data):
+        pass
+
+
+publisher = Publisher()
+
+
+def _receive(port):
+    "Body of the subscriber thread: copies into the local channel what the mprocessor publishes"
+    while True:
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+            channel.live = True
+            for line in iter(sock.makefile().readline, ''):
+                message = loads(line)
+                channel.publish(message['workspace'], message['seq'], message)
+            sock.close()
+        except (socket.error, ValueError, KeyError):
+            pass
+        channel.live = False
+        time.sleep(RECONNECT_DELAY)
+
+_subscribe_lock = threading.Lock()
+_subscribed = False
+
+def get_channel():
+    """Returns the local channel, subscribing first (once per process) to the
+       notifications of the mprocessor if progress_port is configured.
+    """
+    global _subscribed
+    if not _subscribed:
+        _subscribe_lock.acquire()
+        try:
+            if not _subscribed:
+                _subscribed = True
+                port = get_port()
+                if port:
+                    t = threading.Thread(target=_receive, args=(port,))
+                    t.setDaemon(True)
+                    t.start()
+        finally:
+            _subscribe_lock.release()
+    return channel
+
+def get_port():
+    "Returns the configured progress_port, None if notifications are local"
+    from mediadart.config import Configurator
+    try:
+        return Configurator().getint('MPROCESSOR', 'progress_port')
+    except Exception:
+        return None
@@ -1,100 +1,107 @@
 from mediadart import log
 
-class Schedule:
+class Schedule(object):
     """
         Manages action states across execution. An action can be in 5 states:
             <ready>: if it can be run
-            <wait>:  if it depends on an running action
+            <wait>:  if it depends on an action not yet done
             <done>:  if it has finished running
             <fail>:  if it produced an error
             <cancelled>: if it depends on a failed action.
 
-        When an action is <ready> its index is in the set self.ready
+        The graph is the Plan of the DAG (see pipeline.Plan), shared by all the
+        schedules; a schedule only holds bitmasks of the actions of the plan:
+            todo:   actions not yet run nor cancelled (<ready> or <wait>)
+            ready:  actions of todo whose predecessors are all done
+            active: actions of todo and running actions
+            done:   actions that completed successfully
 
-        When an action is in <wait> the list self.actions[action]['wait'] holds the
-        name of the actions to be waited upon.
+        Ready actions are run in the order of the plan, which puts first those
+        on the longest path when the plan is compiled with weights.
 
-        An action is in <done>, <fail> or <cancelled> when it is not present in
-        self.actions.
+        If on_ready is given, it is called with the schedule as argument every time
+        done() makes some action ready while none was, so that the owner can keep
+        a queue of the schedules that have work to do.
     """
-    def __init__(self, dag, target, sorted=True):
-        self.target = target   # used only for logging
-        self.dag = dag
-        a = self.action_list = self.dag.sort(sorted)
-        self.ready = set(range(len(a)))
-        self.actions = dict([(x, {'index':y, 'wlist':[]}) for (x,y) in zip(a, xrange(len(a)))])
-
-    def _cb_set_to_wait(self, node, root):
-        "set all actions dependent on root to wait"
-        if node.name != root and node.name in self.actions:
-            if root not in self.actions[node.name]['wlist']:
-                self.actions[node.name]['wlist'].append(root)
-            r = self.actions[node.name]['index']
-            if r in self.ready:
-                self.ready.remove(r)
-
-    def _cb_set_to_ready(self, node, root):
-        "mark all actions dependent on root (which just completed) as ready to run"
-        action = self.actions.get(node.name, None)
-        if action and root in action['wlist']:
-            action['wlist'].remove(root)
-            if not action['wlist']:
-                self.ready.add(action['index'])
+    __slots__ = ('target', 'plan', 'on_ready', 'todo', 'ready', 'active', 'done_mask')
 
-    def _cb_remove(self, node, user_data):
-        "lo stato non e' ready di sicuro del nodo"
-        log.info('target %s: cancelling %s on failed %s' % (self.target, node.name, user_data['failed_action']))
-        if node.name in self.actions:
-            del self.actions[node.name]
-            if node.name != user_data['failed_action']:
-                user_data['deleted'].append(node.name)
+    def __init__(self, dag, target, sorted=True, on_ready=None, plan=None):
+        self.target = target   # used only for logging
+        self.plan = plan or dag.get_plan(sorted)
+        self.on_ready = on_ready
+        self.todo = self.active = self.plan.all
+        self.ready = self.plan.roots
+        self.done_mask = 0
 
     def action_to_run(self):
         """Return the first action ready to run.
            If all actions are done, failed, or cancelled, returns None
            If no action is ready to run returns ''
         """
-        #log.debug("action_to_run item=%s, actions=%s ready=%s" % (self.target, len(self.actions), len(self.ready))) #d 
-        if not self.actions:
-            #log.debug('action_to_run: no actions') #d
+        if not self.active:
             return None
         if not self.ready:
-            #log.debug('action_to_run: nothing ready') #d
             return ''
-        else:
-            r = min(self.ready)
-            action = self.action_list[r]
-            log.info('### target %s: run %s' % (self.target, action))
-            self.ready.remove(r)
-            self.dag.visit(action, self._cb_set_to_wait, action)
-            #self.show() #d
-            return action
+        bit = self.ready & -self.ready
+        action = self.plan.actions[bit.bit_length() - 1]
+        log.info('### target %s: run %s' % (self.target, action))
+        self.ready &= ~bit
+        self.todo &= ~bit
+        return action
+
+    def next_action(self):
+        "Returns the action that action_to_run would run, None if no action is ready"
+        if not self.ready:
+            return None
+        return self.plan.actions[(self.ready & -self.ready).bit_length() - 1]
+
+    def has_ready(self):
+        return bool(self.ready)
+
+    def is_finished(self):
+        "True if all actions are done, failed or cancelled"
+        return not self.active
 
     def done(self, action):
         log.debug('#### target %s: done %s' % (self.target, action))
-        del self.actions[action]
-        self.dag.visit(action, self._cb_set_to_ready, action)
-        #self.show() #d
+        was_ready = bool(self.ready)
+        plan = self.plan
+        i = plan.index[action]
+        self.active &= ~(1 << i)
+        self.done_mask |= 1 << i
+        for j in plan.successors[i]:
+            if self.todo >> j & 1 and not plan.predecessors[j] & ~self.done_mask:
+                self.ready |= 1 << j
+        if self.ready and not was_ready and self.on_ready:
+            self.on_ready(self)
 
     def fail(self, action):
-        "delete action and all actions dependent on it. Returns the number of actions deleted"
+        "delete action and all actions dependent on it. Returns the names of the actions cancelled"
         log.debug('#### %s: FAIL %s' % (self.target, action))
-        user_data = {'failed_action':action, 'deleted':[]}
-        self.dag.visit(action, self._cb_remove, user_data)
-        #self.show()
-        return user_data['deleted']
+        i = self.plan.index[action]
+        cancelled = self.plan.descendants[i] & self.active
+        self.active &= ~(cancelled | 1 << i)
+        self.todo &= ~cancelled
+        self.ready &= ~cancelled
+        deleted = self.plan.names(cancelled)
+        for name in deleted:
+            log.info('target %s: cancelling %s on failed %s' % (self.target, name, action))
+        return deleted
 
     def show(self):
         ret = "sched %s: " % self.target
-        for action in self.action_list:
-            if action not in self.actions:
+        plan = self.plan
+        for i, action in enumerate(plan.actions):
+            bit = 1 << i
+            if not self.active & bit:
                 ret += "%s:k, " % action    # done, failed or cancelled
-            elif self.actions[action]['index'] in self.ready:
+            elif self.ready & bit:
                 ret += "%s:=, " % action    # ready
-            elif not self.actions[action]['wlist']:
+            elif not self.todo & bit:
                 ret += "%s:@, " % action    # running
             else:
-                ret += ("%s:<%s>, " % (action, '-'.join(self.actions[action]['wlist'])))     # waiting
+                waiting = plan.names(plan.predecessors[i] & ~self.done_mask)
+                ret += ("%s:<%s>, " % (action, '-'.join(waiting)))     # waiting
         log.debug(ret)
 
     def __str__(self):
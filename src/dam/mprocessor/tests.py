@@ -0,0 +1,323 @@
+"""
+Unit tests of the mprocessor scheduling. They run without MediaDART and
+without reading targets from the database:
+
+python manage.py test mprocessor
+"""
+from json import dumps, loads
+from django.test import TestCase
+from twisted.internet.task import Clock
+
+from dam.mprocessor import processor
+from dam.mprocessor.pipeline import DAG
+from dam.mprocessor.schedule import Schedule
+
+
+class FakeConfig:
+    dictionary = {
+        'MPROCESSOR': {
+            'plugins': 'dam.mprocessor.plogins',
+            'max_outstanding': '10',
+            'batch_size': '10',
+            'update_interval': '100',
+            'update_period': '1000',
+            'prefetch': '0',
+        },
+    }
+    def get(self, section, option):
+        return self.dictionary[section][option]
+
+    def getint(self, section, option):
+        return int(self.dictionary[section][option])
+
+
+class FakePipeline:
+    def __init__(self, pipeline):
+        self.params = dumps(pipeline)
+
+
+class FakeProcess:
+    pk = 0
+    workspace = None
+    workspace_id = 0
+    def __init__(self, pipeline):
+        self.pipeline = FakePipeline(pipeline)
+        self.targets = self.targets_pending = 0
+        self.targets_completed = self.targets_failed = 0
+
+    def get_priority(self):
+        return 0
+
+
+class FakeTarget:
+    def __init__(self, pk=1, actions_todo=1):
+        self.pk = pk
+        self.target_id = str(pk)
+        self.params = ''
+        self.actions_passed = self.actions_failed = self.actions_cancelled = 0
+        self.actions_todo = actions_todo
+        self.counted = (False, False)       # see Batch._new_batch
+        self.result = ''
+
+
+class FakeQuerySet:
+    def __init__(self, queries, lookups):
+        self.queries = queries
+        self.lookups = lookups
+
+    def update(self, **fields):
+        self.queries.append((self.lookups, fields))
+        return 1
+
+
+class FakeManager:
+    "Records the updates made by the Batch, in place of the objects manager of a model"
+    def __init__(self):
+        self.queries = []
+
+    def filter(self, **lookups):
+        return FakeQuerySet(self.queries, lookups)
+
+
+class FakeModel:
+    def __init__(self):
+        self.objects = FakeManager()
+
+
+class FakeBatch(processor.Batch):
+    "A Batch whose actions run on the server classes in servers, without plugins"
+    def __init__(self, process, budget, servers):
+        self.fake_servers = servers
+        processor.Batch.__init__(self, process, budget, processor.Durations(persistent=False))
+
+    def _get_scripts(self, pipeline):
+        return dict([(k, (None, v.get('params', {}))) for k, v in pipeline.items()])
+
+    def _get_server_classes(self, scripts):
+        return self.fake_servers
+
+
+def action(script_name, inputs, outputs):
+    return {'script_name': script_name, 'params': {}, 'in': inputs, 'out': outputs}
+
+def new_task(batch, plan, target_id='1'):
+    "Returns a task as made by Batch._new_batch, appended to the ready queue of batch"
+    task = {'item': FakeTarget(), 'queued': False, 'media_type': None, 'params': {}}
+    task['schedule'] = Schedule(batch.dag, target_id, on_ready=lambda s: batch._push_ready(task), plan=plan)
+    batch._queue(task)
+    batch.num_tasks += 1
+    return task
+
+
+class ScheduleTest(TestCase):
+    """
+    a -> b -> d
+    a -> c
+    """
+    pipeline = {
+        'a': action('s1', [], ['x']),
+        'b': action('s2', ['x'], ['y']),
+        'c': action('s3', ['x'], []),
+        'd': action('s4', ['y'], []),
+    }
+
+    def setUp(self):
+        self.dag = DAG(self.pipeline)
+        self.plan = self.dag.compile(False, {'a': 1, 'b': 1, 'c': 1, 'd': 5})
+
+    def test_plan(self):
+        plan = self.plan
+        self.assertEqual(plan.actions, ('a', 'b', 'd', 'c'))   # longest path first
+        self.assertEqual(plan.names(plan.roots), ['a'])
+        self.assertEqual(plan.all, 15)
+        self.assertEqual(sorted(plan.names(plan.descendants[plan.index['a']])), ['b', 'c', 'd'])
+        self.assertEqual(plan.names(plan.predecessors[plan.index['d']]), ['b'])
+        self.assertEqual(plan.names(plan.descendants[plan.index['c']]), [])
+
+    def test_run(self):
+        woken = []
+        schedule = Schedule(self.dag, '1', on_ready=woken.append, plan=self.plan)
+        self.assertEqual(schedule.next_action(), 'a')
+        self.assertEqual(schedule.action_to_run(), 'a')
+        self.assertEqual(schedule.action_to_run(), '')
+        self.assertEqual(schedule.next_action(), None)
+        schedule.done('a')
+        self.assertEqual(woken, [schedule])
+        self.assertEqual(schedule.action_to_run(), 'b')
+        self.assertEqual(schedule.action_to_run(), 'c')
+        schedule.done('c')
+        self.assertEqual(len(woken), 1)                        # nothing went ready
+        schedule.done('b')
+        self.assertEqual(len(woken), 2)
+        self.assertEqual(schedule.action_to_run(), 'd')
+        self.assertFalse(schedule.is_finished())
+        schedule.done('d')
+        self.assertTrue(schedule.is_finished())
+        self.assertEqual(schedule.action_to_run(), None)
+
+    def test_fail(self):
+        schedule = Schedule(self.dag, '1', plan=self.plan)
+        self.assertEqual(schedule.action_to_run(), 'a')
+        schedule.done('a')
+        self.assertEqual(schedule.action_to_run(), 'b')
+        self.assertEqual(schedule.fail('b'), ['d'])
+        self.assertEqual(schedule.action_to_run(), 'c')
+        self.assertEqual(schedule.action_to_run(), '')
+        self.assertFalse(schedule.is_finished())
+        schedule.done('c')
+        self.assertTrue(schedule.is_finished())
+
+    def test_fail_root(self):
+        schedule = Schedule(self.dag, '1', plan=self.plan)
+        schedule.action_to_run()
+        self.assertEqual(sorted(schedule.fail('a')), ['b', 'c', 'd'])
+        self.assertTrue(schedule.is_finished())
+        self.assertEqual(schedule.action_to_run(), None)
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        self.configurator = processor.Configurator
+        processor.Configurator = FakeConfig
+
+    def tearDown(self):
+        processor.Configurator = self.configurator
+
+    def test_round_robin(self):
+        "Tasks of a queue take turns: a task with more ready actions goes back at the end"
+        pipeline = {
+            'p': action('s1', [], []),
+            'q': action('s1', [], []),
+        }
+        batch = FakeBatch(FakeProcess(pipeline), processor.Budget(10), {'p': 'A', 'q': 'A'})
+        plan = DAG(pipeline).compile(False, {'p': 2, 'q': 1})
+        t1 = new_task(batch, plan, '1')
+        t2 = new_task(batch, plan, '2')
+        self.assertEqual(batch._get_action(), ('p', t1))
+        self.assertEqual(batch._get_action(), ('p', t2))
+        self.assertEqual(batch._get_action(), ('q', t1))
+        self.assertEqual(batch._get_action(), ('q', t2))
+        self.assertFalse(t1['queued'] or t2['queued'])
+        self.assertFalse(any(batch.ready.values()))
+
+    def test_task_woken_by_done(self):
+        "A task with no ready action leaves the queue and goes back when done() makes one ready"
+        pipeline = {
+            'p': action('s1', [], ['x']),
+            'q': action('s2', ['x'], []),
+        }
+        batch = FakeBatch(FakeProcess(pipeline), processor.Budget(10), {'p': 'A', 'q': 'B'})
+        task = new_task(batch, DAG(pipeline).get_plan())
+        self.assertEqual(batch._get_action(), ('p', task))
+        self.assertFalse(task['queued'])
+        task['schedule'].done('p')
+        self.assertTrue(task['queued'])
+        self.assertEqual(list(batch.ready[('B', 's2')]), [task])
+        self.assertEqual(batch._get_action(), ('q', task))
+
+    def test_limits_of_action_made_ready(self):
+        """
+        c depends on r1 and comes before r2 in the plan: when r1 is done the
+        task, queued for r2, must wait for the limit of the server class of c.
+        """
+        pipeline = {
+            'r1': action('s1', [], ['x']),
+            'c': action('s2', ['x'], []),
+            'r2': action('s3', [], []),
+        }
+        budget = processor.Budget(10, {'B': 1})
+        batch = FakeBatch(FakeProcess(pipeline), budget, {'r1': 'A', 'c': 'B', 'r2': 'C'})
+        plan = DAG(pipeline).compile(False, {'r1': 1, 'c': 5, 'r2': 1})
+        self.assertEqual(plan.actions, ('r1', 'c', 'r2'))
+        task = new_task(batch, plan)
+        batch.all_targets_read = True
+
+        self.assertEqual(batch._get_action(), ('r1', task))
+        budget.server_load['B'] = 1
+        task['schedule'].done('r1')
+        self.assertEqual(batch._get_action(), (None, None))
+        self.assertTrue(batch.blocked)
+
+        budget.server_load['B'] = 0
+        self.assertEqual(batch._get_action(), ('c', task))
+        self.assertEqual(batch._get_action(), ('r2', task))
+
+
+class ProgressTest(TestCase):
+    """
+    Progress of the targets is written every update_interval completions or
+    every update_period ms, targets with the same new values in one query.
+    """
+    pipeline = {
+        'p': action('s1', [], []),
+        'q': action('s1', [], []),
+    }
+
+    def setUp(self):
+        self.saved = (processor.Configurator, processor.reactor, processor.Process,
+                      processor.ProcessTarget, processor.UPDATE_CHUNK)
+        processor.Configurator = FakeConfig
+        processor.reactor = self.clock = Clock()
+        processor.Process = FakeModel()
+        processor.ProcessTarget = self.targets = FakeModel()
+        self.process = FakeProcess(self.pipeline)
+        self.process.targets = self.process.targets_pending = 4
+        self.batch = FakeBatch(self.process, processor.Budget(10), {'p': 'A', 'q': 'A'})
+        self.batch.update_interval = 3
+        self.batch._publish = lambda target_ids: None
+        self.items = [FakeTarget(pk, 2) for pk in (1, 2, 3, 4)]
+
+    def tearDown(self):
+        (processor.Configurator, processor.reactor, processor.Process,
+         processor.ProcessTarget, processor.UPDATE_CHUNK) = self.saved
+
+    def complete(self, item, action, success=True):
+        "What Batch._handle_ok and _handle_err do with the progress of item"
+        self.batch._update_item_stats(item, action, 'result of %s' % action, int(success), int(not success), 0)
+        self.batch._progress_done()
+
+    def queries(self):
+        "Updates of targets made since the last call, single targets first"
+        queries, self.targets.objects.queries[:] = list(self.targets.objects.queries), []
+        return sorted([(l.get('pk'), sorted(l.get('pk__in', [])), f) for l, f in queries])
+
+    def test_interval(self):
+        item1, item2, item3, item4 = self.items
+        self.complete(item1, 'p')
+        self.complete(item2, 'p')
+        self.assertEqual(self.queries(), [])
+        self.complete(item3, 'p', False)
+        updated = {'actions_passed': 1, 'actions_failed': 0, 'actions_cancelled': 0, 'actions_todo': 1}
+        queries = self.queries()
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(queries[0], (None, [1, 2], updated))                  # same values: one query
+        pk, pks, fields = queries[1]
+        self.assertEqual((pk, fields['actions_failed']), (3, 1))               # a result: alone
+        self.assertEqual(loads(fields['result']), {'p': [0, 'result of p']})
+        self.assertEqual(self.batch.flush_call, None)
+        self.assertEqual(self.process.targets_failed, 1)
+
+    def test_period(self):
+        item1, item2, item3, item4 = self.items
+        self.complete(item1, 'p')
+        self.complete(item1, 'q')
+        self.assertEqual(self.queries(), [])
+        self.clock.advance(0.999)
+        self.assertEqual(self.queries(), [])
+        self.clock.advance(0.001)
+        queries = self.queries()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0][0], 1)
+        self.assertEqual(loads(queries[0][2]['result']), {'p': [1, 'result of p'], 'q': [1, 'result of q']})
+        self.assertEqual((self.process.targets_completed, self.process.targets_pending), (1, 3))
+        self.assertEqual(processor.Process.objects.queries[-1][1]['targets_completed'], 1)
+        self.assertEqual(self.batch.results, {})                                # finished targets are dropped
+        self.clock.advance(10)
+        self.assertEqual(self.queries(), [])                                    # nothing dirty, nothing written
+
+    def test_chunks(self):
+        processor.UPDATE_CHUNK = 2
+        for item in self.items[:3]:
+            self.complete(item, 'p')
+        queries = self.queries()
+        self.assertEqual([pks for pk, pks, fields in queries], [[1, 2], [3]])
@@ -20,7 +20,7 @@ from dam.plugins.common.adapter import Adapter
 from dam.repository.models import get_storage_file_name
 from dam.core.dam_repository.models import Type
 from dam.plugins.adapt_image_idl import inspect
-from dam.metadata.models import MetadataProperty, MetadataValue
+from dam.metadata.models import MetadataValue, get_schema_cache
 from dam.variants.models import Variant
 from dam.repository.models import Item, Component
 from django.contrib.contenttypes.models import ContentType
@@ -35,6 +35,9 @@ def run(workspace,              # workspace object
         source_variant_name,    # name of the source variant (a string)
         output_variant_name,    # name of the destination variat (a string)
         output_extension,       # desired extension (with the dot)
+                                # output_variant_name can be a list, to generate several renditions
+                                # from a single decode of the source: resize_h, resize_w and
+                                # output_extension are then lists too, or a value for all of them
         actions = [],           # ordered list of actions from resize, crop, watermark
         resize_h = None,        # desired height (aspect ratio is preserved)
         resize_w = None,        # desired width
@@ -64,21 +67,37 @@ class AdaptImage(Adapter):
     md_server = 'MediumLoad'
     #fake = True
 
-    def get_cmdline(self, output_variant_name, output_extension, actions, resize_h,
-                   resize_w, crop_w, crop_h, crop_x, crop_y, crop_ratio, pos_x_percent,
-                   pos_y_percent, wm_id, rotation):
-        if not isinstance(actions, list):
-            actions = [actions]
-
+    def _get_out_type(self, output_extension):
+        "Returns the (dam_repository.Type, extension) of an output"
         if output_extension == 'same_as_source':
-            self.out_type = self.source.media_type
-            output_extension = self.source.media_type.ext
-        else:
-            self.out_type = Type.objects.get_or_create_by_filename('foo%s' % output_extension)
-                
+            return self.source.media_type, self.source.media_type.ext
+        return Type.objects.get_or_create_by_filename('foo%s' % output_extension), output_extension
+
+    def _save_rotation(self, output_variant_names, rotation):
+        """Adds rotation to the manual_rotation of the first rendition and returns the
+           new value, that is recorded as the manual_rotation of all the renditions:
+           they are all rotated by it, from a single decode of the source
+        """
+        new_rotation = int(rotation)
+        try:
+            ws = self.workspace
+            variant = Variant.objects.get(name= output_variant_names[0])
+            component = self.item.get_variant(ws,variant)
+            schema = get_schema_cache().get_property('notreDAM', 'manual_rotation')
+            last = component.get_metadata_values(schema)
+            if last != None:
+                new_rotation += int(last)
+            for name in output_variant_names:
+                MetadataValue.objects.save_metadata_value([self.item], {schema.id:[int(new_rotation)]}, name, ws)
+        except Exception, err:
+            log.debug("***===> Exception while setting manual_rotation metadata %s" % (err))
+        return new_rotation
+
+    def _get_argv(self, output_variant_names, actions, resize_h, resize_w, crop_w, crop_h, crop_x, crop_y,
+                  crop_ratio, pos_x_percent, pos_y_percent, wm_id, rotation):
+        "Returns the convert options applying actions, recording the rotation for all output_variant_names"
         features = self.source.get_features()
         argv = ""
-        new_rotation = 0
         for action in actions:
             if action == 'resize':
                 argv +=  '-auto-orient -resize %sx%s' % (resize_w, resize_h)
@@ -98,25 +117,66 @@ class AdaptImage(Adapter):
                 pos_y = int(float(pos_y_percent) * float(features.get_height())/100.)
                 argv +=  ' -gravity NorthWest "file://%s" -geometry +%s+%s -composite' % (wm_id, pos_x, pos_y)
             elif action == 'rotate':
-                new_rotation = int(rotation)
-                try:
-                    ws = self.workspace
-                    variant = Variant.objects.get(name= output_variant_name)
-                    component = self.item.get_variant(ws,variant)
-                    schema = MetadataProperty.objects.get(namespace__prefix='notreDAM', field_name = 'manual_rotation')
-                    last = component.get_metadata_values(schema)
-                    ctype = ContentType.objects.get_for_model(Component)
-                    if last != None:
-                        new_rotation += int(last)
-                    MetadataValue.objects.save_metadata_value([self.item], {schema.id:[int(new_rotation)]},output_variant_name, ws)
-                except Exception, err:
-                    log.debug("***===> Exception while setting manual_rotation metadata %s" % (err))
-                argv += ' -rotate %s' % (new_rotation)
+                argv += ' -rotate %s' % self._save_rotation(output_variant_names, rotation)
+        return argv
+
+    def get_cmdline(self, output_variant_name, output_extension, actions, resize_h,
+                   resize_w, crop_w, crop_h, crop_x, crop_y, crop_ratio, pos_x_percent,
+                   pos_y_percent, wm_id, rotation):
+        if not isinstance(actions, list):
+            actions = [actions]
+        if isinstance(output_variant_name, list):
+            return self._get_multi_cmdline(output_variant_name, output_extension, actions, resize_h,
+                   resize_w, crop_w, crop_h, crop_x, crop_y, crop_ratio, pos_x_percent,
+                   pos_y_percent, wm_id, rotation)
+
+        self.out_type, output_extension = self._get_out_type(output_extension)
+        argv = self._get_argv([output_variant_name], actions, resize_h, resize_w, crop_w, crop_h, crop_x, crop_y,
+                              crop_ratio, pos_x_percent, pos_y_percent, wm_id, rotation)
         
         log.debug("calling adapter")
         self.out_file = get_storage_file_name(self.item.ID, self.workspace.pk, output_variant_name, output_extension)
         self.cmdline = '"file://%s[0]" %s "outfile://%s"' % (self.source.uri, argv, self.out_file)
 
+    def _get_multi_cmdline(self, output_variant_names, output_extension, actions, resize_h,
+                   resize_w, crop_w, crop_h, crop_x, crop_y, crop_ratio, pos_x_percent,
+                   pos_y_percent, wm_id, rotation):
+        """
+        Command line generating a rendition for each of output_variant_names from a
+        single decode of the source. resize_w, resize_h and output_extension are
+        either lists, with the value for each rendition, or a single value for all.
+        The actions are applied for the largest rendition, then each of the others
+        is resized from the previous one, in memory: all the renditions are rotated
+        by the same angle, recorded as the manual_rotation of each of them.
+        """
+        n = len(output_variant_names)
+        def _values(v, param):
+            if isinstance(v, list):
+                if len(v) != n:
+                    raise Exception('%s has %d values for %d output variants' % (param, len(v), n))
+                return v
+            return [v] * n
+        outputs = zip(output_variant_names, _values(resize_w, 'resize_w'), _values(resize_h, 'resize_h'),
+                      _values(output_extension, 'output_extension'))
+        outputs.sort(key=lambda o: -int(o[1] or 0) * int(o[2] or 0))      # largest first
+
+        name, w, h, ext = outputs[0]
+        argv = self._get_argv([o[0] for o in outputs], actions, h, w, crop_w, crop_h, crop_x, crop_y,
+                              crop_ratio, pos_x_percent, pos_y_percent, wm_id, rotation)
+        self.outputs = []
+        self.cmdline = '"file://%s[0]" %s' % (self.source.uri, argv)
+        for i, (name, w, h, ext) in enumerate(outputs):
+            out_type, ext = self._get_out_type(ext)
+            out_file = get_storage_file_name(self.item.ID, self.workspace.pk, name, ext)
+            self.outputs.append((name, out_type, out_file))
+            if i and 'resize' in actions:
+                self.cmdline += ' -resize %sx%s' % (w, h)
+            if i < n - 1:
+                self.cmdline += ' -write "outfile://%s"' % out_file
+            else:
+                self.cmdline += ' "outfile://%s"' % out_file
+        self.out_type, self.out_file = self.outputs[0][1:]
+
 
 #
 # Stand alone test: need to provide a compatible database (item 2 must be an item with a audio comp.)
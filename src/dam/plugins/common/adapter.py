@@ -6,7 +6,7 @@ from dam.repository.models import get_storage_file_name
 from dam.plugins.common.utils import get_source_rendition
 from dam.plugins.common.cmdline import splitstring, import_cmd
 from mediadart import log
-from mediadart.mqueue.mqclient_twisted import Proxy
+from dam.plugins.common.executor import get_executor
 
 
 class Adapter:
@@ -23,6 +23,8 @@ class Adapter:
     out_comp = None     # the component generated by this adapter
     out_file = None     # the output file
     out_type = None   # the dam_repository.Type of the output Component
+    outputs = None      # set by get_cmdline when the command line generates several renditions:
+                        # list of (variant name, dam_repository.Type, output file)
     fake = False        # set to have just the command line printed
 
     def __init__(self, deferred, workspace, item_id, source_variant_name):    
@@ -37,13 +39,17 @@ class Adapter:
         log.debug("[save_component] component %s" % self.out_comp.pk)        
         log.debug('##############\n%s\n' % result['data'])
         
-        directory, name = os.path.split(self.out_file)
-        self.out_comp.uri = name
-        self.out_comp.save()
+        for out_comp, out_file in self.out_comps:
+            directory, name = os.path.split(out_file)
+            out_comp.uri = name
+            out_comp.save()
         self.item.update_time = time.time()
         self.item.save()
         
-        self.deferred.callback(self.out_file)
+        if self.outputs:
+            self.deferred.callback([out_file for out_comp, out_file in self.out_comps])
+        else:
+            self.deferred.callback(self.out_file)
         
     def handle_error(self, result):
         self.deferred.errback(Failure(Exception(result.getErrorMessage())))
@@ -52,9 +58,13 @@ class Adapter:
         # get basic data (avoid creating stuff in DB)
         try:
             self.get_cmdline(output_variant_name, output_type, **params)
-            output_variant = Variant.objects.get(name = output_variant_name)
-            self.out_comp = self.item.create_variant(output_variant, self.workspace, self.out_type)
-            self.out_comp.source = self.source
+            self.out_comps = []
+            for variant_name, out_type, out_file in self.outputs or [(output_variant_name, self.out_type, self.out_file)]:
+                output_variant = Variant.objects.get(name = variant_name)
+                out_comp = self.item.create_variant(output_variant, self.workspace, out_type)
+                out_comp.source = self.source
+                self.out_comps.append((out_comp, out_file))
+            self.out_comp = self.out_comps[0][0]
             args = splitstring(self.cmdline)
         except Exception, e:
             log.error('Error in %s: %s %s' % (self.__class__.__name__, type(e), str(e)))
@@ -63,7 +73,6 @@ class Adapter:
             if self.fake:
                 log.debug('######### Command line:\n%s' % str(args))
             else:
-                proxy = Proxy(self.md_server)
-                d = proxy.call(self.remote_exe, args, self.env)
+                d = get_executor(self.md_server).call(self.remote_exe, args, self.env)
                 d.addCallbacks(self.handle_result, self.handle_error)
         return self.deferred    # if executed stand alone
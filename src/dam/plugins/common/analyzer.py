@@ -7,7 +7,7 @@ from dam.plugins.common.utils import get_source_rendition
 from dam.plugins.common.cmdline import splitstring, import_cmd
 from mediadart import log
 from mediadart.storage import Storage
-from mediadart.mqueue.mqclient_twisted import Proxy
+from dam.plugins.common.executor import get_executor
 
 
 class Analyzer:
@@ -58,8 +58,7 @@ class Analyzer:
             if self.fake:
                 log.debug('######### Command line:\n%s' % str(args))
             else:
-                proxy = Proxy(self.md_server)
-                d = proxy.call(self.remote_exe, args, self.env)
+                d = get_executor(self.md_server).call(self.remote_exe, args, self.env)
                 d.addCallbacks(self.handle_result, self.handle_error, callbackArgs=self.cb_args)
         return self.deferred    # if executed stand alone
 
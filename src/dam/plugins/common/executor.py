@@ -0,0 +1,210 @@
+#########################################################################
+#
+# NotreDAM, Copyright (C) 2009, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it
+# Web: www.notre-dam.org
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#########################################################################
+
+"""
+Executors of the command lines of the plugins (see Adapter and Analyzer).
+
+An executor has a method call(remote_exe, args, env) returning a deferred
+fired with {'data': standard output of the command}, as the mediadart
+servers do. args is the list returned by splitstring, where the arguments
+file://<path> and outfile://<path> name files of the storage.
+
+The executor is chosen by the option executor of the MPROCESSOR section:
+"mediadart" (the default) sends the command lines to the mediadart servers
+of the class of the plugin (md_server); "local" runs them on this machine,
+in a pool of at most local_workers subprocesses, killing those running for
+more than local_timeout seconds.
+"""
+
+import os
+import errno
+from collections import deque
+from twisted.internet import reactor, defer, protocol
+from twisted.internet.error import ProcessDone
+from twisted.python.procutils import which
+from mediadart import log
+from mediadart.mqueue.mqclient_twisted import Proxy
+from dam.settings import MEDIADART_STORAGE
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 600      # seconds
+
+_prefixes = ('file://', 'outfile://')
+
+
+class MediadartExecutor:
+    "Sends the command lines to the mediadart servers of class md_server"
+    def __init__(self, md_server):
+        self.md_server = md_server
+
+    def call(self, remote_exe, args, env):
+        return Proxy(self.md_server).call(remote_exe, args, env)
+
+
+def resolve_args(args, storage=MEDIADART_STORAGE):
+    """Returns args with the file:// and outfile:// arguments replaced by paths in
+       storage. The directories of the output files are created if missing
+    """
+    ret = []
+    for a in args:
+        for prefix in _prefixes:
+            if a.startswith(prefix):
+                a = os.path.join(storage, a[len(prefix):])
+                if prefix == 'outfile://' and not os.path.isdir(os.path.dirname(a)):
+                    try:
+                        os.makedirs(os.path.dirname(a))
+                    except OSError, e:
+                        if e.errno != errno.EEXIST:    # created meanwhile by another command
+                            raise
+                break
+        ret.append(a)
+    return ret
+
+
+class _Job:
+    def __init__(self, argv, env):
+        self.argv = argv
+        self.env = env
+        self.deferred = None
+        self.transport = None          # set while running
+        self.timeout_call = None
+        self.timed_out = False
+
+
+class _CommandProtocol(protocol.ProcessProtocol):
+    def __init__(self, executor, job):
+        self.executor = executor
+        self.job = job
+        self.out = []
+        self.err = []
+
+    def outReceived(self, data):
+        self.out.append(data)
+
+    def errReceived(self, data):
+        self.err.append(data)
+
+    def processEnded(self, reason):
+        error = None
+        if not reason.check(ProcessDone):
+            error = str(reason.value)      # exit status or signal
+        self.executor._ended(self.job, error, ''.join(self.out), ''.join(self.err))
+
+
+class LocalExecutor:
+    """
+        Runs the command lines in local subprocesses, at most workers at the
+        same time; the others wait in a queue. A command running for more than
+        timeout seconds is killed, as is a command whose deferred is cancelled.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, storage=MEDIADART_STORAGE):
+        self.workers = workers
+        self.timeout = timeout
+        self.storage = storage
+        self.running = set()
+        self.waiting = deque()
+
+    def call(self, remote_exe, args, env):
+        exe = which(remote_exe)
+        try:
+            argv = [exe and exe[0] or remote_exe] + resolve_args(args, self.storage)
+        except Exception, e:
+            return defer.fail(e)
+        job = _Job(argv, dict(os.environ, **(env or {})))
+        job.deferred = defer.Deferred(lambda d: self._cancel(job))
+        self.waiting.append(job)
+        self._start()
+        return job.deferred
+
+    def _start(self):
+        while self.waiting and len(self.running) < self.workers:
+            job = self.waiting.popleft()
+            log.debug('local executor: running %s' % ' '.join(job.argv))
+            try:
+                job.transport = reactor.spawnProcess(_CommandProtocol(self, job), job.argv[0], job.argv, job.env)
+            except Exception, e:
+                job.deferred.errback(e)
+                continue
+            self.running.add(job)
+            if self.timeout:
+                job.timeout_call = reactor.callLater(self.timeout, self._expire, job)
+
+    def _kill(self, job):
+        try:
+            job.transport.signalProcess('KILL')
+        except Exception:
+            pass                       # already dead
+
+    def _expire(self, job):
+        job.timeout_call = None
+        job.timed_out = True
+        log.error('local executor: %s timed out after %s s' % (job.argv[0], self.timeout))
+        self._kill(job)
+
+    def _cancel(self, job):
+        "Canceller of the deferred of job: the deferred is failed with CancelledError"
+        if job in self.running:
+            self._kill(job)
+        elif job in self.waiting:
+            self.waiting.remove(job)
+
+    def _ended(self, job, error, out, err):
+        self.running.discard(job)
+        if job.timeout_call is not None:
+            job.timeout_call.cancel()
+            job.timeout_call = None
+        if not job.deferred.called:
+            if job.timed_out:
+                job.deferred.errback(Exception('%s timed out after %s s' % (job.argv[0], self.timeout)))
+            elif error:
+                job.deferred.errback(Exception('%s failed: %s %s' % (job.argv[0], error, err.strip())))
+            else:
+                job.deferred.callback({'data': out})
+        self._start()
+
+
+_options = None
+_local_executor = None
+
+def _get_options():
+    "Returns the options of the executors, read once from the MPROCESSOR section"
+    global _options
+    if _options is None:
+        from mediadart.config import Configurator
+        cfg = Configurator()
+        def get(option, default):
+            try:
+                return cfg.get('MPROCESSOR', option)
+            except Exception:
+                return default
+        _options = {
+            'executor': get('executor', 'mediadart'),
+            'local_workers': int(get('local_workers', DEFAULT_WORKERS)),
+            'local_timeout': float(get('local_timeout', DEFAULT_TIMEOUT)),
+        }
+    return _options
+
+def get_executor(md_server):
+    "Returns the executor of the command lines of the plugins of class md_server"
+    global _local_executor
+    options = _get_options()
+    if options['executor'] != 'local':
+        return MediadartExecutor(md_server)
+    if _local_executor is None:
+        _local_executor = LocalExecutor(options['local_workers'], options['local_timeout'])
+    return _local_executor
@@ -0,0 +1,88 @@
+"""
+Tests of the local executor of the plugin command lines. They run real
+subprocesses (echo and sleep) in the twisted reactor, so they use trial
+instead of the django test runner:
+
+trial dam.plugins.common.test_executor
+"""
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+
+from dam.plugins.common.executor import LocalExecutor, resolve_args
+
+
+class LocalExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage)
+
+    def wait_idle(self, executor):
+        "Returns a deferred fired when executor has no more subprocesses, killed ones included"
+        d = defer.Deferred()
+        def check():
+            if executor.running or executor.waiting:
+                reactor.callLater(0.05, check)
+            else:
+                d.callback(None)
+        check()
+        return d
+
+    def test_resolve_args(self):
+        args = resolve_args(['-i', 'file://a/in.jpg', 'outfile://b/c/out.jpg'], self.storage)
+        self.assertEqual(args, ['-i', os.path.join(self.storage, 'a/in.jpg'), os.path.join(self.storage, 'b/c/out.jpg')])
+        self.assertTrue(os.path.isdir(os.path.join(self.storage, 'b/c')))
+        resolve_args(['outfile://b/c/other.jpg'], self.storage)     # directory already there
+
+    def test_output(self):
+        executor = LocalExecutor(storage=self.storage)
+        d = executor.call('echo', ['hello'], {})
+        d.addCallback(self.assertEqual, {'data': 'hello\n'})
+        return d
+
+    def test_failure(self):
+        executor = LocalExecutor(storage=self.storage)
+        return self.assertFailure(executor.call('false', [], {}), Exception)
+
+    def test_bad_args(self):
+        "Errors resolving the arguments fail the deferred, they are not raised"
+        storage = os.path.join(self.storage, 'file')
+        open(storage, 'w').close()
+        executor = LocalExecutor(storage=storage)
+        d = executor.call('echo', ['outfile://dir/out.jpg'], {})
+        self.assertFalse(executor.running or executor.waiting)
+        return self.assertFailure(d, OSError)
+
+    def test_timeout(self):
+        executor = LocalExecutor(timeout=0.2, storage=self.storage)
+        d = self.assertFailure(executor.call('sleep', ['10'], {}), Exception)
+        def check(e):
+            self.assertTrue('timed out' in str(e))
+            self.assertFalse(executor.running)
+        return d.addCallback(check)
+
+    def test_workers(self):
+        executor = LocalExecutor(workers=1, storage=self.storage)
+        d1 = executor.call('echo', ['one'], {})
+        d2 = executor.call('echo', ['two'], {})
+        self.assertEqual((len(executor.running), len(executor.waiting)), (1, 1))
+        d = defer.gatherResults([d1, d2])
+        d.addCallback(self.assertEqual, [{'data': 'one\n'}, {'data': 'two\n'}])
+        return d
+
+    def test_cancel(self):
+        executor = LocalExecutor(workers=1, storage=self.storage)
+        running = executor.call('sleep', ['10'], {})
+        waiting = executor.call('echo', ['never'], {})
+        waiting.cancel()
+        self.assertFalse(executor.waiting)
+        running.cancel()                   # killed: the deferred fails at once
+        d = defer.gatherResults([self.assertFailure(running, defer.CancelledError),
+                                 self.assertFailure(waiting, defer.CancelledError)])
+        d.addCallback(lambda _: self.wait_idle(executor))
+        return d
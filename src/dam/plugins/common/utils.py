@@ -1,7 +1,7 @@
 import mimetypes
 from struct import unpack
 from mediadart import log
-from dam.metadata.models import MetadataProperty, MetadataValue
+from dam.metadata.models import MetadataValue, get_schema_cache
 from dam.repository.models import Item, Component
 from dam.supported_types import mime_types_by_type
 
@@ -11,7 +11,7 @@ def save_type(ctype, component):
     "Extract and save the format of the component as the value of dc:format"
     mime_type = mimetypes.guess_type(component.uri)[0]
     component.format = mime_type.split('/')[1]
-    metadataschema_mimetype = MetadataProperty.objects.get(namespace__prefix='dc',field_name='format')
+    metadataschema_mimetype = get_schema_cache().get_property('dc', 'format')
     MetadataValue.objects.create(schema=metadataschema_mimetype, content_object=component, value=mime_type)
 
 def get_ext_by_type(type_name):
@@ -1,6 +1,6 @@
 from twisted.internet import reactor, defer
 from mediadart.mqueue.mqclient_twisted import Proxy
-from dam.core.dam_metadata.models import XMPStructure
+from dam.metadata.models import MetadataChange
 from dam.plugins.embed_xmp_idl import inspect
 from dam.variants.models import Variant
 from dam.repository.models import Item, Component
@@ -19,10 +19,12 @@ def run(workspace, item_id, source_variant_name):
 
 
 class EmbedXMP:
+    md_server = 'XMPEmbedder'
+
     def __init__(self, deferred, workspace, item_id, variant_name):
         self.deferred = deferred
         self.workspace = workspace
-        self.proxy = Proxy('XMPEmbedder') 
+        self.proxy = Proxy(self.md_server) 
         self.item = Item.objects.get(pk = item_id)
         self.item, self.component = get_source_rendition(item_id, variant_name, workspace)
 
@@ -31,41 +33,10 @@ class EmbedXMP:
         """
         Reset flags modified in Component and in its metadata
         """
-        comp_metadata = self.component.metadata.filter(modified = True)
-        for m in comp_metadata:
-            m.modified = False
-            m.save()
-        self.component.modified_metadata = False
-        self.component.save()
-
-    def _populate(self, dictionary, metadata, structures):
-        for im in metadata:
-            if im.schema.namespace.uri not in dictionary:
-                dictionary[im.schema.namespace.uri] = {'prefix': im.schema.namespace.prefix, 'fields': {}}
-            if im.schema.field_name not in dictionary[im.schema.namespace.uri]['fields']:
-                if im.schema.type == 'lang':
-                    dictionary[im.schema.namespace.uri]['fields'][im.schema.field_name] = {'type':im.schema.type,'is_array':im.schema.is_array,'value':[im.value],'qualifier':[im.language], 'xpath':[]}
-                elif im.schema.type in structures:
-                    dictionary[im.schema.namespace.uri]['fields'][im.schema.field_name] = {'type':im.schema.type,'is_array':im.schema.is_array,'value':[im.value],'qualifier':[],'xpath':[im.xpath]}
-                else:
-                    dictionary[im.schema.namespace.uri]['fields'][im.schema.field_name] = {'type':im.schema.type,'is_array':im.schema.is_array,'value':[im.value],'qualifier':[],'xpath':[]}
-            else:
-                dictionary[im.schema.namespace.uri]['fields'][im.schema.field_name]['value'].append(im.value)
-                if im.schema.type == 'lang':
-                    dictionary[im.schema.namespace.uri]['fields'][im.schema.field_name]['qualifier'].append(im.language)
-                elif im.schema.type in structures:
-                    dictionary[im.schema.namespace.uri]['fields'][im.schema.field_name]['xpath'].append(im.xpath)
-        return dictionary
+        MetadataChange.objects.reset(self.component)
 
     def _synchronize_metadata(self):
-        changes = {}
-        structures = [s.name for s in XMPStructure.objects.all()]
-        metadata = self.item.metadata.filter(modified = True)
-        self._populate(changes, metadata, structures)
-
-        metadata = self.component.metadata.filter(modified = True)
-        self._populate(changes, metadata, structures)
-        return changes
+        return MetadataChange.objects.get_changes(self.component)
 
     def _cb_embed_reset_xmp(self, result):
         if result:
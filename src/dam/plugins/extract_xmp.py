@@ -15,7 +15,7 @@ get_models()
 
 from django.contrib.contenttypes.models import ContentType
 from dam.repository.models import Component
-from dam.metadata.models import MetadataProperty, MetadataValue
+from dam.metadata.models import MetadataProperty, MetadataValue, MetadataToken
 from dam.core.dam_metadata.models import XMPNamespace
 from dam.preferences.views import get_metadata_default_language
 from dam.variants.models import Variant
@@ -48,9 +48,11 @@ def run(workspace, item_id, source_variant_name):
 ## are saved, and an error is returned.
 ##
 class ExtractXMP:
+    md_server = 'XMPExtractor'
+
     def __init__(self, deferred, workspace, item_id, variant_name):
         self.deferred = deferred
-        self.proxy = Proxy('XMPExtractor')
+        self.proxy = Proxy(self.md_server)
         self.workspace = workspace
         self.item = Item.objects.get(pk = item_id)
         self.item, self.component = get_source_rendition(item_id, variant_name, workspace)
@@ -152,6 +154,7 @@ class ExtractXMP:
                 elif x.xpath == 'exif:GPSLongitude':
                     longitude = x.value
                 x.save()
+            MetadataToken.objects.index_items([self.item.pk])
         except Exception, e:
             log.error('Error in %s: %s %s' % (self.__class__.__name__, type(e), str(e)))
             self.deferred.errback(e)
@@ -63,12 +63,116 @@ def _get_resource_url(id):
         url = None
     return url
 
+_caption_re = re.compile('%(?P<namespace>\w+):(?P<field>\w+)%')
+
+def _caption_value(values, language):
+    "see Item._replace_groups"
+    if isinstance(values, list):
+        value = values[0]
+    elif isinstance(values, dict):
+        value = values.get(language, '')
+    else:
+        value = values
+    if not value:
+        value = ''
+    return value
+
 class ItemManager(models.Manager):
     def create(self, workspace, **kwargs):
         from workspace.models import WorkspaceItem
         item = super(ItemManager, self).create(**kwargs)
         item.add_to_ws(workspace, True)
         return item
+
+    def get_info_many(self, items, workspace, caption = None, default_language = None, check_deleted = False, fullscreen_caption = None):
+        """
+        Returns the list of Item.get_info for the given items, computed with a
+        fixed number of queries whatever the number of items.
+        """
+        from dam.geo_features.models import GeoInfo
+        from dam.workflow.models import StateItemAssociation
+        from dam.workspace.models import WorkspaceItem
+        from dam.core.dam_repository.models import Type
+
+        items = list(items)
+        pks = [item.pk for item in items]
+        if not pks:
+            return []
+
+        ws_items = {}
+        for item_id, last_update, deleted in WorkspaceItem.objects.filter(item__in = pks, workspace = workspace).values_list('item', 'last_update', 'deleted'):
+            ws_items[item_id] = (last_update, deleted)
+        in_progress = set(ProcessTarget.objects.filter(target_id__in = [str(pk) for pk in pks], actions_todo__gt = 0, 
+                                                       process__workspace = workspace).values_list('target_id', flat = True))
+        geotagged = set(GeoInfo.objects.filter(item__in = pks).values_list('item', flat = True))
+        originals = {}                     # item pk -> (component pk, media type name, size, file name)
+        for item_id, comp_id, type_name, size, file_name in Component.objects.filter(item__in = pks, variant__name = 'original').values_list('item', 'pk', 'type__name', 'size', 'file_name'):
+            originals.setdefault(item_id, (comp_id, type_name, size, file_name))
+        states = {}
+        for item_id, state_id in StateItemAssociation.objects.filter(item__in = pks).values_list('item', 'state'):
+            states.setdefault(item_id, state_id)
+        types = dict(Type.objects.filter(pk__in = set([item.type_id for item in items])).values_list('pk', 'name'))
+
+        captions = {}
+        for template in (caption, fullscreen_caption):
+            if template and default_language and template not in captions:
+                captions[template] = self._get_captions(items, template, default_language, types, originals)
+
+        ret = []
+        for item in items:
+            last_update, deleted = ws_items.get(item.pk, (item.update_time, False))
+            t = time.mktime(last_update.utctimetuple())
+            original = originals.get(item.pk)
+            info = {
+                'name': caption and default_language and captions[caption][item.pk] or '',
+                'size': original and float(original[2]) or float(0), 
+                'pk': smart_str(item.pk), 
+                '_id':item._id,
+                'status': str(item.pk) in in_progress and 'in_progress' or 'completed',
+                'url':smart_str('/item/%s/%s/?t=%s'%(item.ID, 'thumbnail', t)), 
+                'type': smart_str(types[item.type_id]),
+                'url_preview':'/item/%s/%s/?t=%s'%(item.ID, 'preview', t),
+                'url_fullscreen': '/item/%s/%s/?t=%s'%(item.ID, 'fullscreen', t),
+                'geotagged': item.pk in geotagged and 1 or 0,
+                'fullscreen_caption': fullscreen_caption and default_language and captions[fullscreen_caption][item.pk] or ''
+                }
+            if check_deleted:
+                info['deleted'] = deleted
+            if item.pk in states:
+                info['state'] = states[item.pk]
+            ret.append(info)
+        return ret
+
+    def _get_captions(self, items, template_string, language, types, originals):
+        """
+        Bulk version of Item._get_caption. Returns the dictionary {item pk: caption}
+        """
+        from dam.metadata.models import MetadataValue, MetadataProperty
+
+        ret = dict([(item.pk, '') for item in items])
+        try:
+            schemas = {}
+            for g in _caption_re.finditer(template_string):
+                if g.group(0) not in schemas:
+                    schemas[g.group(0)] = get_schema_cache().get_property(g.group('namespace'), g.group('field'))
+        except Exception, ex:
+            logger.exception(ex)
+            return ret
+
+        values = MetadataValue.objects.get_objects_values(schemas.values(), 
+                        dict([(item.pk, types[item.type_id]) for item in items]),
+                        dict([(item_pk, x[:2]) for item_pk, x in originals.items()]))
+        for item in items:
+            try:
+                caption = template_string
+                for placeholder, schema in schemas.items():
+                    caption = caption.replace(placeholder, _caption_value(values.get((schema.pk, item.pk)), language))
+                if not len(caption) and item.pk in originals:
+                    caption = unicode(originals[item.pk][3] or '')
+                ret[item.pk] = caption
+            except Exception, ex:
+                logger.exception(ex)
+        return ret
         
 class Item(AbstractItem):
 
@@ -132,7 +236,8 @@ class Item(AbstractItem):
         @param property_name: the name of the metadata, for example title, subject etc.
         @param value: value for the given metadata
         """
-        property = MetadataProperty.objects.get(field_name = property_name, namespace__prefix = property_namespace)
+        schemas = get_schema_cache()
+        property = schemas.get_property(property_namespace, property_name)
     
         new_metadata = {}
 
@@ -150,13 +255,13 @@ class Item(AbstractItem):
             
 #                dict
 
-        elif property.type in XMPStructure.objects.all().values_list('name',  flat = True):
+        elif schemas.get_structure(property.type) is not None:
 #                list of dict
             
             if not isinstance(value,  list):
                 raise Exception('format of metadata %s is invalid; it must be a list of dictionaries' % property)
             
-            structure = XMPStructure.objects.get(name = property.type)
+            structure = schemas.get_structure(property.type)
             structure_list = []
             
             for _structure in value:
@@ -167,11 +272,11 @@ class Item(AbstractItem):
                 for el in _structure.keys():
                     property_namespace,   property_field_name = el.split('_')
                     try:
-                        el_property = MetadataProperty.objects.get(namespace__prefix = property_namespace,  field_name = property_field_name)
+                        el_property = schemas.get_property(property_namespace, property_field_name)
                     except MetadataProperty.DoesNotExist:
                         raise Exception('metadata schema %s unknown' % el)
                     logger.debug('structure %s'%structure)
-                    if el_property not in structure.properties.all():
+                    if el_property not in structure:
                         raise Exception('unexpected property %s' % el)
                     
                     tmp_dict[str(el_property.pk)] = _structure[el]
@@ -376,7 +481,7 @@ class Item(AbstractItem):
                 values = None
         else:
             for m in self.metadata.all().distinct('schema').values('schema'):
-                prop = MetadataProperty.objects.get(pk=m['schema'])
+                prop = get_schema_cache().get_property_by_pk(m['schema'])
                 schema_value, delete, b = MetadataValue.objects.get_metadata_values([self.pk], prop, set([self.type.name]), set([original_component.media_type.name]), [original_component.pk])
                 if delete:
                     return None
@@ -400,7 +505,7 @@ class Item(AbstractItem):
         default_language = get_metadata_default_language(user, workspace)
         values = []
         for d, v in descriptors.iteritems():
-            desc = MetadataDescriptor.objects.get(pk=d)
+            desc = get_schema_cache().get_descriptor(d)
             desc_dict = {'caption': '%s' % desc.name}
             desc_value = v
             if isinstance(v, dict):
@@ -414,7 +519,7 @@ class Item(AbstractItem):
                         if not isinstance(desc_value, dict):
                             desc_value = {'properties': []}
                         for key, v_value  in value.iteritems():
-                            p = MetadataProperty.objects.get(pk=key)
+                            p = get_schema_cache().get_property_by_pk(key)
                             desc_value['properties'].append({'caption': p.caption, 'value': v_value})
             desc_dict['value'] = desc_value
             values.append(desc_dict)
@@ -429,20 +534,17 @@ class Item(AbstractItem):
         given workspace
         @param workspace an instance of workspace.DAMWorkspace
         """
-        from dam.metadata.models import MetadataDescriptorGroup
-
+        schemas = get_schema_cache()
+        basic = []
         if workspace:
-            basic = MetadataDescriptorGroup.objects.filter(basic_summary=True, workspace=workspace)
-            if basic.count() == 0:
-                basic = MetadataDescriptorGroup.objects.filter(basic_summary=True)[0]
-            else:
-                basic = basic[0]
-        else:
-            basic = MetadataDescriptorGroup.objects.filter(basic_summary=True)[0]
+            basic = schemas.get_descriptor_groups(basic_summary=True, workspace_id=workspace.pk)
+        if not basic:
+            basic = schemas.get_descriptor_groups(basic_summary=True)
+        basic = basic[0]
         
         descriptors = {}
-        for d in basic.descriptors.all():
-            for p in d.properties.all():
+        for d in schemas.get_group_descriptors(basic.pk):
+            for p in schemas.get_descriptor_properties(d.pk):
                 schema_value = self.get_metadata_values(p)
                 if schema_value:
                     descriptors[d.pk] = schema_value
@@ -538,18 +640,9 @@ class Item(AbstractItem):
         namespace = group.group('namespace')
         field = group.group('field')
         try:
-            schema = MetadataProperty.objects.get(namespace__prefix=namespace, field_name=field)
+            schema = get_schema_cache().get_property(namespace, field)
             values = self.get_metadata_values(schema)
-            if isinstance(values, list):
-                value = values[0]
-            elif isinstance(values, dict):
-                value = values.get(default_language, '')
-            else:
-                value = values
-            if not value:
-                value = ''
-    
-            return value
+            return _caption_value(values, default_language)
         except:
             raise
             return ''
@@ -578,68 +671,11 @@ class Item(AbstractItem):
         return caption
         
     def get_info(self, workspace,  caption = None, default_language = None, check_deleted = False, fullscreen_caption = None):
-        from dam.geo_features.models import GeoInfo
-        if caption and default_language: 
-            caption = self._get_caption(caption, default_language)
-        else:
-            caption = ''
-        if fullscreen_caption and default_language: 
-            fullscreen_caption = self._get_caption(fullscreen_caption, default_language)
-        else:
-            fullscreen_caption = ''
-
-#        now = '?t=' + str(time.time());
-        t = time.mktime(self.get_last_update(workspace).utctimetuple())
-        thumb_url = '/item/%s/%s/?t=%s'%(self.ID, 'thumbnail', t);
-        preview_url = '/item/%s/%s/?t=%s'%(self.ID, 'preview', t);
-        fullscreen_url = '/item/%s/%s/?t=%s'%(self.ID, 'fullscreen', t);
-        in_progress = ProcessTarget.objects.filter(target_id = str(self.pk),actions_todo__gt = 0, process__workspace = workspace).count() > 0;
-        
-        if in_progress:
-            status = 'in_progress';
-#            now = '?t=' + str(time.time());
-#            thumb_url += now;
-#            preview_url += now;
-#            fullscreen_url += now;
-           
-        else:
-            status = 'completed'
-
-        
-        if GeoInfo.objects.filter(item=self).count() > 0:
-            geotagged = 1
-        else:
-            geotagged = 0
-        
-        
-        
-        info = {
-            'name': caption,
-            'size':self.get_file_size(), 
-            'pk': smart_str(self.pk), 
-            '_id':self._id,
-            'status': status,
-            #'thumb': thumb_url is not None,
-            'url':smart_str(thumb_url), 
-            'type': smart_str(self.type.name),
-            'url_preview':preview_url,
-			'url_fullscreen': fullscreen_url,
-#            'preview_available': False,
-            'geotagged': geotagged,
-            'fullscreen_caption': fullscreen_caption
-            }
-        
-        if check_deleted: #performance can be improved here
-            deleted = self.workspaceitem_set.get(workspace = workspace).deleted            
-            info['deleted'] = deleted
-         
-        states = self.stateitemassociation_set.all()
-        if states.count():
-            state_association = states[0]
-        
-            info['state'] = state_association.state.pk
-    
-        return info
+        """
+        Returns the dictionary describing the item in the GUI. 
+        To describe several items use Item.objects.get_info_many
+        """
+        return Item.objects.get_info_many([self], workspace, caption, default_language, check_deleted, fullscreen_caption)[0]
 
 
 def get_storage_file_name(item_id, workspace_id, variant_name, extension):
@@ -709,7 +745,7 @@ class Component(AbstractComponent):
         values = component.metadata.all().values('xpath', 'language', 'schema_id', 'value', 'content_type_id')
         for value in values:
             schema_id = value.pop('schema_id')
-            value['schema'] = MetadataProperty.objects.get(pk = schema_id)
+            value['schema'] = get_schema_cache().get_property_by_pk(schema_id)
             value['object_id'] = self.pk
             MetadataValue.objects.create(**value)
             
@@ -864,7 +900,7 @@ class Component(AbstractComponent):
                 values = None
         else:
             for m in self.metadata.all().distinct('schema').values('schema'):
-                prop = MetadataProperty.objects.get(pk=m['schema'])
+                prop = get_schema_cache().get_property_by_pk(m['schema'])
                 schema_value, delete, b = MetadataValue.objects.get_metadata_values([self.item.pk], prop, set([self.item.type.name]), set([self.media_type.name]), [self.pk], self)
                 if delete:
                     return None
@@ -889,7 +925,7 @@ class Component(AbstractComponent):
         default_language = get_metadata_default_language(user, workspace)
         values = []
         for d, v in descriptors.iteritems():
-            desc = MetadataDescriptor.objects.get(pk=d)
+            desc = get_schema_cache().get_descriptor(d)
             desc_dict = {'caption': '%s' % desc.name}
             desc_value = v
             logger.info("desc_value %s " %desc_value)
@@ -904,7 +940,7 @@ class Component(AbstractComponent):
                         if not isinstance(desc_value, dict):
                             desc_value = {'properties': []}
                         for key, v_value  in value.iteritems():
-                            p = MetadataProperty.objects.get(pk=key)
+                            p = get_schema_cache().get_property_by_pk(key)
                             desc_value['properties'].append({'caption': p.caption, 'value': v_value})
             desc_dict['value'] = desc_value
             values.append(desc_dict)
@@ -918,8 +954,9 @@ class Component(AbstractComponent):
         """
         item_list = [self.item.pk]
         descriptors = {}
-        for d in desc_group.descriptors.all():
-            for p in d.properties.all():
+        schemas = get_schema_cache()
+        for d in schemas.get_group_descriptors(desc_group.pk):
+            for p in schemas.get_descriptor_properties(d.pk):
                 schema_value = self.get_metadata_values(p)
                 if schema_value:
                     descriptors[d.pk] = schema_value
@@ -224,7 +224,7 @@ def run_script(request):
 
 def _script_monitor(workspace):
     import datetime, settings    
-    processes = workspace.get_active_processes()
+    processes = workspace.get_active_processes().select_related('pipeline', 'launched_by').prefetch_related('pipeline__triggers')
     processes_info = []
     for process in processes:
         try:
@@ -0,0 +1,88 @@
+"""
+Benchmark of the nested set maintenance of treeview nodes.
+
+Creates a test database and, for each tree size, imports a taxonomy of that
+size with Node.objects.add_nodes; then times single add_node, move_node and
+delete operations on it, counting their queries. With incremental updates
+the cost of an operation does not depend on the size of the tree.
+
+Typical usage:
+
+python benchmark.py -s 1000,10000,30000 -n 50
+"""
+from django.core.management import setup_environ
+from dam import settings
+setup_environ(settings)
+
+import sys
+import time
+from optparse import OptionParser
+
+from django.conf import settings as django_settings
+from django.db import connection, reset_queries
+from django.contrib.auth.models import User
+
+from dam.workspace.models import DAMWorkspace
+from dam.treeview.models import Node
+
+
+def make_taxonomy(size, fanout):
+    "Returns a taxonomy of size nodes, as accepted by add_nodes"
+    count = [0]
+    def _level(depth):
+        nodes = []
+        while len(nodes) < fanout and count[0] < size:
+            count[0] += 1
+            nodes.append(('node%d' % count[0], []))
+        if depth < 10:
+            for label, children in nodes:
+                children.extend(_level(depth + 1))
+        return nodes
+    ret = []
+    while count[0] < size:
+        ret.extend(_level(0))
+    return ret
+
+def measure(label, num, operation):
+    reset_queries()
+    start = time.time()
+    for n in xrange(num):
+        operation(n)
+    elapsed = time.time() - start
+    print >>sys.stderr, '    %-10s %8.2f ms/op %6.1f queries/op' % (label, elapsed * 1000 / num,
+                float(len(connection.queries)) / num)
+
+def run(ws, size, num, fanout):
+    tree_type = 'bench%d' % size
+    root = Node.objects.create(label = 'root', depth = 0, workspace = ws, editable = False, type = tree_type, cls = 'keyword')
+    start = time.time()
+    Node.objects.add_nodes(root, make_taxonomy(size, fanout), ws, 'keyword')
+    print >>sys.stderr, '%d nodes imported in %.2fs' % (size, time.time() - start)
+
+    middle = Node.objects.filter(type = tree_type, workspace = ws, depth = 2).order_by('lft')[fanout / 2]
+    first = Node.objects.filter(type = tree_type, workspace = ws, depth = 1).order_by('lft')[0]
+    added = []
+    measure('add_node', num, lambda n: added.append(Node.objects.add_node(Node.objects.get(pk = middle.pk), 'new%d' % n, ws, 'keyword')))
+    measure('move_node', num, lambda n: Node.objects.get(pk = added[n].pk).move_node(Node.objects.get(pk = first.pk), ws))
+    measure('delete', num, lambda n: Node.objects.get(pk = added[n].pk).delete())
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', dest='sizes', default='1000,10000,30000', help='comma separated tree sizes')
+    parser.add_option('-n', dest='num', type='int', default=50, help='operations timed for each size')
+    parser.add_option('-f', dest='fanout', type='int', default=10, help='children of each node of the taxonomy')
+    options, args = parser.parse_args()
+
+    django_settings.DEBUG = True       # queries are counted
+    old_name = django_settings.DATABASES['default']['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create(username = 'benchmark')
+        ws = DAMWorkspace.objects.create(name = 'benchmark', description = '', creator = user)
+        for size in [int(s) for s in options.sizes.split(',')]:
+            run(ws, size, options.num, options.fanout)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# encoding: utf-8
+import datetime
+import hashlib
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding field 'Node.path'
+        db.add_column('node', 'path', self.gf('django.db.models.fields.TextField')(default=''), keep_default=False)
+
+        # Adding field 'Node.path_hash'
+        db.add_column('node', 'path_hash', self.gf('django.db.models.fields.CharField')(default='', max_length=40, db_index=True), keep_default=False)
+
+        if not db.dry_run:
+            # paths of the existing nodes, from the labels of their ancestors
+            nodes = {}
+            for pk, parent, label, depth in orm['treeview.Node'].objects.values_list('pk', 'parent', 'label', 'depth'):
+                nodes[pk] = (parent, label, depth)
+            paths = {}
+            def _path(pk):
+                if pk not in paths:
+                    parent, label, depth = nodes[pk]
+                    if parent is None or depth == 0:
+                        paths[pk] = u''
+                    elif _path(parent):
+                        paths[pk] = paths[parent] + u'/' + label
+                    else:
+                        paths[pk] = label
+                return paths[pk]
+            for pk in nodes:
+                path = _path(pk)
+                if path:
+                    orm['treeview.Node'].objects.filter(pk = pk).update(path = path, path_hash = hashlib.sha1(path.encode('utf-8')).hexdigest())
+            orm['treeview.Node'].objects.filter(path = '').update(path_hash = hashlib.sha1('').hexdigest())
+
+
+    def backwards(self, orm):
+        
+        # Deleting field 'Node.path'
+        db.delete_column('node', 'path')
+
+        # Deleting field 'Node.path_hash'
+        db.delete_column('node', 'path_hash')
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'dam_metadata.xmpnamespace': {
+            'Meta': {'object_name': 'XMPNamespace'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'prefix': ('django.db.models.fields.CharField', [], {'max_length': '16', 'null': 'True'}),
+            'uri': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        },
+        'dam_metadata.xmpproperty': {
+            'Meta': {'object_name': 'XMPProperty'},
+            'caption': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '256'}),
+            'editable': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'field_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'internal': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_array': ('django.db.models.fields.CharField', [], {'default': "'not_array'", 'max_length': '15'}),
+            'is_choice': ('django.db.models.fields.CharField', [], {'default': "'not_choice'", 'max_length': '15'}),
+            'media_type': ('django.db.models.fields.related.ManyToManyField', [], {'default': "'image'", 'to': "orm['dam_repository.Type']", 'symmetrical': 'False'}),
+            'namespace': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['dam_metadata.XMPNamespace']"}),
+            'type': ('django.db.models.fields.CharField', [], {'default': "'text'", 'max_length': '128'})
+        },
+        'dam_repository.type': {
+            'Meta': {'object_name': 'Type'},
+            'ext': ('django.db.models.fields.CharField', [], {'max_length': '5'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '30'}),
+            'subname': ('django.db.models.fields.CharField', [], {'max_length': '30'})
+        },
+        'dam_workspace.workspace': {
+            'Meta': {'unique_together': "(('name', 'creator'),)", 'object_name': 'Workspace'},
+            'creation_date': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'creator': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '512'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_update': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'members': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'workspaces'", 'symmetrical': 'False', 'to': "orm['auth.User']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '128'})
+        },
+        'kb.object': {
+            'Meta': {'object_name': 'Object', 'managed': 'False'},
+            'id': ('django.db.models.fields.CharField', [], {'max_length': '128', 'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '128'})
+        },
+        'metadata.metadataproperty': {
+            'Meta': {'object_name': 'MetadataProperty', '_ormbases': ['dam_metadata.XMPProperty']},
+            'creation_date': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'file_name_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'file_size_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_searchable': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_variant': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'item_owner_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'keyword_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'latitude_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'longitude_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'resource_format': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'rights_target': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'uploaded_by': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'xmpproperty_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['dam_metadata.XMPProperty']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'metadata.metadatavalue': {
+            'Meta': {'object_name': 'MetadataValue'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'language': ('django.db.models.fields.CharField', [], {'max_length': '12', 'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'schema': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['metadata.MetadataProperty']", 'null': 'True', 'blank': 'True'}),
+            'value': ('django.db.models.fields.TextField', [], {}),
+            'xpath': ('django.db.models.fields.TextField', [], {})
+        },
+        'repository.item': {
+            'Meta': {'object_name': 'Item', 'db_table': "'item'"},
+            '_id': ('django.db.models.fields.CharField', [], {'max_length': '40', 'db_column': "'md_id'"}),
+            'creation_time': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'owned_items'", 'null': 'True', 'to': "orm['auth.User']"}),
+            'source_file_path': ('django.db.models.fields.TextField', [], {}),
+            'type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['dam_repository.Type']"}),
+            'update_time': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'uploader': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'uploaded_items'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'treeview.category': {
+            'Meta': {'object_name': 'Category'},
+            'cls': ('django.db.models.fields.CharField', [], {'default': "'keyword'", 'max_length': '20'}),
+            'editable': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_draggable': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_drop_target': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'position': ('django.db.models.fields.IntegerField', [], {'unique': 'True'})
+        },
+        'treeview.node': {
+            'Meta': {'object_name': 'Node', 'db_table': "'node'"},
+            'associate_ancestors': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'cls': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'creation_date': ('django.db.models.fields.DateField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'depth': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'editable': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_draggable': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_drop_target': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'items': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['repository.Item']", 'symmetrical': 'False'}),
+            'kb_object': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'catalog_nodes'", 'null': 'True', 'blank': 'True', 'to': "orm['kb.Object']"}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'lft': ('django.db.models.fields.PositiveIntegerField', [], {'default': '1'}),
+            'metadata_schema': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'to': "orm['metadata.MetadataProperty']", 'null': 'True', 'through': "orm['treeview.NodeMetadataAssociation']", 'blank': 'True'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['treeview.Node']"}),
+            'path': ('django.db.models.fields.TextField', [], {'default': "''"}),
+            'path_hash': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '40', 'db_index': 'True'}),
+            'representative_item': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'represented_nodes'", 'null': 'True', 'to': "orm['repository.Item']"}),
+            'rgt': ('django.db.models.fields.PositiveIntegerField', [], {'default': '1'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'workspace': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'tree_nodes'", 'to': "orm['workspace.DAMWorkspace']"})
+        },
+        'treeview.nodemetadataassociation': {
+            'Meta': {'object_name': 'NodeMetadataAssociation'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'metadata_schema': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['metadata.MetadataProperty']"}),
+            'node': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['treeview.Node']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'treeview.smartfolder': {
+            'Meta': {'object_name': 'SmartFolder'},
+            'and_condition': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'nodes': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['treeview.Node']", 'through': "orm['treeview.SmartFolderNodeAssociation']", 'symmetrical': 'False'}),
+            'workspace': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['workspace.DAMWorkspace']"})
+        },
+        'treeview.smartfoldernodeassociation': {
+            'Meta': {'object_name': 'SmartFolderNodeAssociation'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'negated': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'node': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['treeview.Node']"}),
+            'smart_folder': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['treeview.SmartFolder']"})
+        },
+        'workspace.damworkspace': {
+            'Meta': {'object_name': 'DAMWorkspace', '_ormbases': ['dam_workspace.Workspace']},
+            'items': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'workspaces'", 'symmetrical': 'False', 'through': "orm['workspace.WorkspaceItem']", 'to': "orm['repository.Item']"}),
+            'workspace_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['dam_workspace.Workspace']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'workspace.workspaceitem': {
+            'Meta': {'unique_together': "(('item', 'workspace'),)", 'object_name': 'WorkspaceItem'},
+            'deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'item': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['repository.Item']"}),
+            'last_update': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'workspace': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['workspace.DAMWorkspace']"})
+        }
+    }
+
+    complete_apps = ['treeview']
@@ -17,13 +17,14 @@
 #########################################################################
 
 from django.db import models
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.utils import simplejson
 from django.contrib.auth.models import User
 
 from dam.repository.models import Item
-from dam.core.dam_tree.models import AbstractNode
+from dam.core.dam_tree.models import AbstractNode, path_hash
 from dam.kb.models import Object as KBObject
 
 import logging
@@ -63,7 +64,7 @@ class NodeManager(models.Manager):
     #    else:
     #        cls = node.cls
             
-        new_node = self.create(workspace= workspace, label = label,  type = node.type, kb_object = kb_object, representative_item = representative_item)
+        new_node = Node(workspace= workspace, label = label,  type = node.type, kb_object = kb_object, representative_item = representative_item)
         if cls:
             new_node.cls = cls
         
@@ -77,26 +78,90 @@ class NodeManager(models.Manager):
         
     #    Node.objects.get_root(workspace).rebuild_tree(1)
         return new_node
+
+    def add_nodes(self, node, nodes, workspace, cls = 'collection'):
+        """
+        Adds under node a whole branch, e.g. when importing a taxonomy.
+        nodes is a list of (label, children), where children is a list of
+        the same kind. Returns the number of nodes added
+        """
+        node.check_ws(workspace)
+        labels = [label for label, children in nodes]
+        if len(set(labels)) < len(labels) or node.children.filter(label__in = labels).count():
+            raise SiblingsWithSameLabel
+        return node.add_branch(nodes, workspace = workspace, type = node.type, cls = cls or '')
     
     def get_from_path(self,  path, workspace, type = 'collection',   separator='/'):
-        def _to_path(nodes):
-            return separator.join([n.label for n in nodes])
-            
-        labels = path.split(separator)
-        if labels:
-            logger.debug('labels %s '%labels)
-            nodes = Node.objects.filter(label = labels.pop(),  type = type, workspace = workspace)
-            logger.debug(nodes)
-            for node in nodes:
-                logger.debug('node.get_ancestors() %s'%node.get_ancestors())
-                node_path = _to_path(node.get_ancestors().exclude(depth = 0)) 
-                logger.debug('node_path %s'%node_path)
-                if node_path == path:
-                    logger.debug('node.pk %s'%node.pk)
-                    return node           
+        return self.get_from_paths([path], workspace, type, separator).get(path)
+
+    def get_from_paths(self, paths, workspace, type = 'collection', separator='/'):
+        """
+        Finds with a single query the nodes of workspace identified by the
+        given paths; returns a dictionary path: node, without the paths
+        that were not found
+        """
+        wanted = dict([('/'.join(p.split(separator)), p) for p in paths])
+        if not wanted:
+            return {}
+        nodes = Node.objects.filter(type = type, workspace = workspace, path_hash__in = [path_hash(p) for p in wanted]).exclude(depth = 0)
+        return dict([(wanted[n.path], n) for n in nodes if n.path in wanted])
         
-        return None
+    def get_bounds(self, node_ids):
+        """
+        Returns a dictionary pk: (workspace_id, type, lft, rgt) of the given
+        nodes, loaded with a single query
+        """
+        if not node_ids:
+            return {}
+        return dict([(n[0], n[1:]) for n in Node.objects.filter(pk__in = node_ids).values_list('pk', 'workspace', 'type', 'lft', 'rgt')])
+
+    def branch_items(self, bounds):
+        """
+        Returns a subquery on the ids of the items associated to the nodes
+        of a branch, given the bounds of its root (see get_bounds)
+        """
+        workspace_id, type, lft, rgt = bounds
+        return Node.items.through.objects.filter(node__workspace = workspace_id, node__type = type,
+                                                 node__lft__gte = lft, node__lft__lte = rgt).values('item')
+
+    def compile_complex_query(self, complex_query, bounds = None):
+        """
+        Compiles a complex query (see SmartFolder.get_complex_query) into a
+        Q object on items, made of semi-joins on the node associations, so that
+        it is evaluated in a single round trip.
+        With the 'and' condition the whole branch of a node is matched (through
+        its lft/rgt range), with 'or' only the node itself.
+        bounds are those of the nodes referred (see get_bounds): if not given,
+        they are loaded with one query
+        """
+        node_ids = [n['id'] for n in complex_query['nodes']]
+        if bounds is None:
+            bounds = self.get_bounds(node_ids)
+        through = Node.items.through.objects
         
+        q = None
+        for n in complex_query['nodes']:
+            node_id = int(n['id'])
+            if complex_query['condition'] == 'and' and not n['negated']:
+                if node_id in bounds:
+                    node_q = Q(pk__in = self.branch_items(bounds[node_id]))
+                else:
+                    node_q = Q(pk__in = [])
+            else:
+                node_q = Q(pk__in = through.filter(node = node_id).values('item'))
+            if n['negated']:
+                node_q = ~node_q
+            
+            if q is None:
+                q = node_q
+            elif complex_query['condition'] == 'and':
+                q = q & node_q
+            else:
+                q = q | node_q
+        if q is None:
+            return Q()
+        return q
+
     def copy_tree(self, root, new_root, ):
         new_owner = new_root.content_object
         ctype = ContentType.objects.get_for_model(new_owner)
@@ -256,7 +321,7 @@ class Node(AbstractNode):
     #    node.metadata_schema.add(*MetadataProperty.objects.filter(pk__in = metadata_schemas))
 
     def save_metadata(self, items=None):
-        from dam.metadata.models import MetadataValue
+        from dam.metadata.models import MetadataValue, MetadataToken
 
         ctype = ContentType.objects.get_for_model(Item)
 
@@ -270,9 +335,10 @@ class Node(AbstractNode):
                 keyword = node_association.value
                 
                 m = MetadataValue.objects.get_or_create(schema=s, value=keyword, object_id= item.pk, content_type = ctype)
+        MetadataToken.objects.index_items([item.pk for item in items])
 
     def remove_metadata(self, items):
-        from dam.metadata.models import MetadataValue
+        from dam.metadata.models import MetadataValue, MetadataToken
         
         ctype = ContentType.objects.get_for_model(Item)
 
@@ -281,6 +347,7 @@ class Node(AbstractNode):
             for s in schema:
                 n_a = NodeMetadataAssociation.objects.get(node = self,  metadata_schema = s)
                 MetadataValue.objects.filter(schema=s, value=n_a.value, object_id= item.pk, content_type = ctype).delete()
+        MetadataToken.objects.index_items([item.pk for item in items])
 
     def rename_node(self, label, workspace):
     #    if not node.parent:
@@ -329,6 +396,8 @@ class Node(AbstractNode):
         
     #    if node_source.depth <= 2:
     #        raise NotEditableNode
+        if self.lft <= node_dest.lft and node_dest.rgt <= self.rgt:
+            raise NotMovableNode
         self.parent = node_dest
         self.depth = node_dest.depth+1
         self.save()
@@ -368,32 +437,8 @@ class Node(AbstractNode):
         self.representative_item = item
         self.save()
 
-    def delete(self,  *args,  **kwargs):
-        super(Node, self).delete(*args,  **kwargs)
-        root = Node.objects.filter(depth= 0,  workspace = self.workspace,  type = self.type)
-        root[0].rebuild_tree(1)
-
-    def save(self,*args,  **kwargs):
-        rebuild_tree = False
-        if self.id:
-            db_node = Node.objects.get(pk = self.pk)
-            if db_node.parent != self.parent:
-                rebuild_tree = True
-        else:
-#            just creating the node
-            rebuild_tree = True
-            
-        models.Model.save(self, *args, **kwargs)
-        
-        if rebuild_tree:
-            try:
-                root = Node.objects.filter(depth= 0,  workspace = self.workspace,  type = self.type)
-                logger.debug('root %s'%root)
-                root[0].rebuild_tree(1)
-                
-            except Exception,  ex:
-                logger.exception(ex)
-                raise ex
+    def _tree(self):
+        return Node.objects.filter(type = self.type, workspace = self.workspace_id)
                 
     class Meta:        
         db_table = 'node'        
@@ -416,23 +461,30 @@ class SmartFolderNodeAssociation(models.Model):
     node = models.ForeignKey('Node')
     negated = models.BooleanField(default = False)
     
+class SmartFolderManager(models.Manager):
+
+    def get_complex_queries(self, smart_folders):
+        """
+        Returns a dictionary smart folder: complex query (see
+        SmartFolder.get_complex_query), with a single query for all the
+        node associations
+        """
+        ret = dict([(sm, {'nodes': [], 'condition': sm.and_condition and 'and' or 'or'}) for sm in smart_folders])
+        by_pk = dict([(sm.pk, ret[sm]) for sm in ret])
+        associations = SmartFolderNodeAssociation.objects.filter(smart_folder__in = by_pk.keys())
+        for smart_folder_id, node_id, negated in associations.values_list('smart_folder', 'node', 'negated').order_by('pk'):
+            by_pk[smart_folder_id]['nodes'].append({'id': node_id,  'negated':negated})
+        return ret
+
 class SmartFolder(models.Model):
     label = models.CharField(max_length= 200)
     and_condition = models.BooleanField(default = True)
     workspace = models.ForeignKey('workspace.DAMWorkspace')
     nodes = models.ManyToManyField('Node',  through = 'SmartFolderNodeAssociation')
+    objects = SmartFolderManager()
 
     def get_complex_query(self):
-        if self.and_condition:
-            condition = 'and'
-        else:
-            condition = 'or'
-            
-        cq = {'nodes': [],  'condition':condition}
-        for sm_ass in self.smartfoldernodeassociation_set.all():
-            cq['nodes'].append({'id': sm_ass.node.pk,  'negated':sm_ass.negated})
-            
-        return cq
+        return SmartFolder.objects.get_complex_queries([self])[self]
          
             
     
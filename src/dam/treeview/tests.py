@@ -0,0 +1,129 @@
+"""
+Tests of the nested set maintenance of the treeview nodes:
+
+python manage.py test treeview
+"""
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from dam.workspace.models import DAMWorkspace
+from dam.treeview.models import Node, NotMovableNode
+
+
+class NestedSetTest(TestCase):
+    """
+    root
+      a
+        a1
+          a11
+        a2
+      b
+        b1
+      c
+    """
+    def setUp(self):
+        user = User.objects.create(username = 'nestedset')
+        self.ws = DAMWorkspace.objects.create(name = 'nestedset', description = '', creator = user)
+        self.root = self.new_root('test')
+        Node.objects.add_nodes(self.root, [('a', [('a1', [('a11', [])]), ('a2', [])]),
+                                           ('b', [('b1', [])]),
+                                           ('c', [])], self.ws, 'keyword')
+        # a tree sharing the table, that must never be touched
+        self.other = self.new_root('other')
+        Node.objects.add_nodes(self.other, [('x', [('y', [])])], self.ws, 'keyword')
+        self.other_bounds = self.bounds('other')
+
+    def new_root(self, type):
+        return Node.objects.create(label = 'root', depth = 0, workspace = self.ws, editable = False, type = type, cls = 'keyword')
+
+    def node(self, path):
+        return Node.objects.get_from_path(path, self.ws, 'test')
+
+    def bounds(self, type):
+        return sorted(Node.objects.filter(workspace = self.ws, type = type).values_list('pk', 'lft', 'rgt', 'depth', 'path'))
+
+    def check_tree(self):
+        """
+        Checks lft, rgt, depth and path of all the nodes against those computed
+        visiting the tree from the parent links, children in the order of lft
+        """
+        nodes = dict([(n.pk, n) for n in Node.objects.filter(workspace = self.ws, type = 'test')])
+        children = {}
+        for n in sorted(nodes.values(), key = lambda n: n.lft):
+            children.setdefault(n.parent_id, []).append(n)
+        def _visit(node, left, depth, path):
+            self.assertEqual((node.lft, node.depth, node.path), (left, depth, path), node.label)
+            right = left + 1
+            for c in children.get(node.pk, []):
+                right = _visit(c, right, depth + 1, path and path + '/' + c.label or c.label) + 1
+            self.assertEqual(node.rgt, right, node.label)
+            return right
+        self.assertEqual(_visit(nodes[self.root.pk], self.root.lft, 0, ''), self.root.lft + 2 * len(nodes) - 1)
+        self.assertEqual(self.bounds('other'), self.other_bounds)
+
+    def children(self, path):
+        parent = path and self.node(path) or self.root
+        return list(Node.objects.filter(parent = parent).order_by('lft').values_list('label', flat = True))
+
+    def test_add(self):
+        self.check_tree()
+        Node.objects.add_node(self.node('a/a1'), 'a12', self.ws, 'keyword')
+        self.check_tree()
+        self.assertEqual(self.children('a/a1'), ['a11', 'a12'])
+
+    def test_move_right(self):
+        self.node('a/a1').move_node(self.node('b'), self.ws)
+        self.check_tree()
+        self.assertEqual(self.children('a'), ['a2'])
+        self.assertEqual(self.children('b'), ['b1', 'a1'])
+        self.assertEqual(self.node('b/a1/a11').depth, 3)
+
+    def test_move_left(self):
+        self.node('b').move_node(self.node('a/a1/a11'), self.ws)
+        self.check_tree()
+        self.assertEqual(self.children('a/a1/a11'), ['b'])
+        self.assertEqual(self.node('a/a1/a11/b/b1').depth, 5)
+
+    def test_move_up(self):
+        self.node('a/a1/a11').move_node(self.root, self.ws)
+        self.check_tree()
+        self.assertEqual(self.children('a/a1'), [])
+        self.assertEqual(self.node('a11').depth, 1)
+
+    def test_move_stale(self):
+        "The bounds of a node loaded before the tree changed are not trusted"
+        c = self.node('c')
+        self.node('a').move_node(self.node('b/b1'), self.ws)
+        c.move_node(self.node('b'), self.ws)
+        self.check_tree()
+        self.assertEqual(self.children('b'), ['b1', 'c'])
+
+    def test_move_under_itself(self):
+        a = self.node('a')
+        self.assertRaises(NotMovableNode, a.move_node, self.node('a/a1/a11'), self.ws)
+        a.parent = self.node('a/a2')
+        self.assertRaises(ValueError, a.save)
+        self.check_tree()
+
+    def test_delete(self):
+        self.node('a/a1').delete()
+        self.check_tree()
+        self.assertEqual(self.children('a'), ['a2'])
+        self.assertEqual(self.node('a/a1/a11'), None)
+        self.node('c').delete()
+        self.check_tree()
+        self.assertEqual(self.children(''), ['a', 'b'])
+
+
+class FixturePathTest(TestCase):
+    "The nodes of the default workspace are loaded raw, with the paths written in the fixture"
+    fixtures = ['treeview/fixtures/initial_data.json']
+
+    def test_paths(self):
+        ws = DAMWorkspace.objects.get(pk = 1)
+        self.assertEqual(Node.objects.get_from_path('Uploaded', ws, 'inbox').label, 'Uploaded')
+        people = Node.objects.get_from_path('People', ws, 'keyword')
+        self.assertEqual(people.label, 'People')
+        bob = Node.objects.add_node(people, 'Bob', ws, 'keyword')
+        self.assertEqual(bob.path, 'People/Bob')
+        self.assertEqual(Node.objects.get_from_path('People/Bob', ws, 'keyword'), bob)
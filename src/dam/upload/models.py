@@ -54,5 +54,35 @@ class UploadURL(models.Model):
         super(UploadURL, self).save(*args, **kwargs)
 
 
+class ContentIndexManager(models.Manager):
 
+    def get_duplicates(self, md5_list):
+        """
+        Returns the index entries of the components whose content has one of the given md5
+        (entries indexed without md5 are never duplicates)
+        """
+        return self.filter(md5__in = [x for x in md5_list if x]).select_related('component')
+
+class ContentIndex(models.Model):
+    """
+    Size, modification time and md5 of the file a component was imported from (see 
+    upload.views.DirImporter). Used to skip unchanged files on re-import and to detect
+    duplicated contents.
+    """
+
+    component = models.OneToOneField('repository.Component', related_name = 'content_index')
+    source_file_path = models.TextField()
+    source_size = models.BigIntegerField()
+    source_mtime = models.IntegerField()
+    md5 = models.CharField(max_length = 32, db_index = True, blank = True)   # of both the source and the stored file, '' if not computed
+    objects = ContentIndexManager()
+
+    def is_unchanged(self, stat):
+        "True if the source file did not change since it was indexed, given its os.stat"
+        return self.source_size == stat.st_size and self.source_mtime == int(stat.st_mtime)
 
+    def set_source(self, source_file_path, stat, md5):
+        self.source_file_path = source_file_path
+        self.source_size = stat.st_size
+        self.source_mtime = int(stat.st_mtime)
+        self.md5 = md5
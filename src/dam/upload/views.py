@@ -42,7 +42,7 @@ from dam.treeview.models import Node
 #from dam.batch_processor.models import MachineState, Machine, Action
 from dam.workspace.models import DAMWorkspace as Workspace, WorkspaceItem
 from dam.core.dam_workspace.decorators import permission_required
-from dam.upload.models import UploadURL
+from dam.upload.models import UploadURL, ContentIndex
 from dam.upload.uploadhandler import StorageHandler
 from dam.eventmanager.models import EventRegistration
 from dam.preferences.views import get_metadata_default_language
@@ -58,6 +58,8 @@ import mimetypes
 import os.path, traceback
 import time
 import tempfile
+import hashlib
+from multiprocessing.pool import ThreadPool
 from django.core.files.uploadedfile import TemporaryUploadedFile
 from  django.core.files.uploadhandler import TemporaryFileUploadHandler
 
@@ -287,25 +289,27 @@ def _run_pipelines(items, trigger, user, workspace, params = {}):
        Returns the list of process_id launched;
     """
     logger.debug('############### run pipelines')
-    assigned_items = set()
+    pipes = []
+    for pipe in Pipeline.objects.filter(triggers__name=trigger, workspace = workspace):
+        logger.debug('pipe name: %s' % pipe.name)
+        media_types = set(pipe.media_type.values_list('pk', flat=True))
+        # types named as the first word of the pipeline name
+        myt = pipe.name.split(' ')[0]
+        name_types = Type.objects.filter(name=myt).values_list('pk', flat=True)
+        pipes.append((pipe, not media_types, media_types.union(name_types)))
+
+    targets = dict([(pipe, []) for pipe, accept_all, accepted in pipes])
+    for item in items:
+        for pipe, accept_all, accepted in pipes:
+            if accept_all or item.type_id in accepted:
+                targets[pipe].append((item.pk, params))
+
     ret = []
     process_pipe = {}
-    for item in items:
-        for pipe in Pipeline.objects.filter(triggers__name=trigger, workspace = workspace):
-            logger.debug('item type: %s' % item.type)
-            logger.debug('pipe name: %s' % pipe.name)
-            myt = pipe.name.split(' ')[0]
-            mytypes = Type.objects.filter(name=myt)        
-            type_list = [t.name + '/' + t.subname for t in mytypes]
-            logger.debug('--> type_list: %s' % type_list)
-            #if pipe.is_compatible(item.type) or (str(item.type) in supported_types.keys()):
-            if pipe.is_compatible(item.type) or (str(item.type) in type_list):
-                if not process_pipe.has_key(pipe):
-                    process_pipe[pipe] = process = Process.objects.create(pipeline=pipe, workspace=workspace, launched_by=user)
-
-                process_pipe[pipe].add_params(item.pk, params)
-                #assigned_items.add(item)
-                #logger.debug('item %s added to %s' % (item, pipe.name))
+    for pipe, pipe_targets in targets.items():
+        if pipe_targets:
+            process_pipe[pipe] = process = Process.objects.create(pipeline=pipe, workspace=workspace, launched_by=user)
+            process.add_targets(pipe_targets)
     
     for process in process_pipe.values():
         ret.append(process)
@@ -337,84 +341,259 @@ def _run_pipelines(items, trigger, user, workspace, params = {}):
         #logger.debug("##### The following items have no compatible  action: " )
     return ret
 
-def _create_items(dir_name, variant_name, user, workspace, make_copy=True, recursive = True, force_generation = False, link = False):
+COPY_BUFSIZE = 1024*1024
+
+def _copy_file(original_filename, final_path, link, make_copy):
+    logger.debug('original_filename %s'%original_filename)
+    logger.debug('final_path %s'%final_path)
+    if link:
+        logger.debug('link')
+        #os.symlink(original_filename, final_path)    
+        if os.path.exists(final_path):
+            os.remove(final_path)            
+        os.link(original_filename, final_path)                
+        
+    elif make_copy:
+        src = open(original_filename, 'rb')
+        try:
+            dst = open(final_path, 'wb')
+            try:
+                shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+    else:
+        shutil.move(original_filename, final_path)
+
+def _copy_file_hash(original_filename, final_path):
+    "copy original_filename to final_path, returns its md5"
+    m = hashlib.md5()
+    src = open(original_filename, 'rb')
+    try:
+        dst = open(final_path, 'wb')
+        try:
+            buf = src.read(COPY_BUFSIZE)
+            while buf:
+                m.update(buf)
+                dst.write(buf)
+                buf = src.read(COPY_BUFSIZE)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return m.hexdigest()
+
+class DirImporter:
     """
-      
-      
+    Import engine used by import_dir.
+
+    Directory entries are read lazily and processed in chunks of transaction_size
+    files: the items and components of a chunk are created in a single transaction,
+    then a pool of <workers> threads copies (or links) the files into the storage.
+    The new items whose file could not be copied are deleted.
+    Size, mtime and md5 of every imported file are recorded in ContentIndex; the md5
+    is computed while copying, linked or moved files are not read at all and are
+    indexed without it. When updating existing items (force_generation) only the
+    files whose size or mtime changed are hashed, in the same pool.
+
+    <progress>, if given, is called after each chunk as progress(files_read, items_imported)
     """
-    logger.debug('########## _create_items')
-    
-    def copy_file(original_filename, final_path, link, make_copy):
-        logger.debug('original_filename %s'%original_filename)
-        logger.debug('final_path %s'%final_path)
-        if link:
-            logger.debug('link')
-            #os.symlink(original_filename, final_path)    
-            if os.path.exists(final_path):
-                os.remove(final_path)            
-            os.link(original_filename, final_path)                
-            
-        elif make_copy:
-            shutil.copyfile(original_filename, final_path)
-        else:
-            shutil.move(original_filename, final_path)
-        
-    
-    variant = Variant.objects.get(name = variant_name)
-    for entry in os.walk(dir_name):
-        root_dir, sub_dirs, files = entry
-        files = [os.path.join(root_dir, x) for x in files]
-    
-        for original_filename in files:        
-            
-            res_id = new_id()
+    def __init__(self, dir_name, variant_name, user, workspace, make_copy=True, recursive=True, 
+                 force_generation=False, link=False, workers=4, transaction_size=100, progress=None):
+        self.dir_name = dir_name
+        self.variant = Variant.objects.get(name = variant_name)
+        self.user = user
+        self.workspace = workspace
+        self.make_copy = make_copy
+        self.recursive = recursive
+        self.force_generation = force_generation
+        self.link = link
+        self.workers = workers
+        self.transaction_size = transaction_size
+        self.progress = progress
+        self.types = {}                    # extension -> Type
+        self.files_read = 0
+        self.items_imported = 0
+
+    def items(self):
+        "Generator of the items created or updated"
+        pool = ThreadPool(self.workers)
+        try:
+            chunk = []
+            for original_filename in self._files():
+                chunk.append(original_filename)
+                if len(chunk) >= self.transaction_size:
+                    for item in self._import_chunk(pool, chunk):
+                        yield item
+                    chunk = []
+            if chunk:
+                for item in self._import_chunk(pool, chunk):
+                    yield item
+        finally:
+            pool.close()
+            pool.join()
+
+    def _files(self):
+        for root_dir, sub_dirs, files in os.walk(self.dir_name):
+            for x in files:
+                yield os.path.join(root_dir, x)
+            if not self.recursive:
+                break
+
+    def _get_type(self, filename):
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in self.types:
+            self.types[ext] = Type.objects.get_or_create_by_filename(filename)
+        return self.types[ext]
+
+    def _import_chunk(self, pool, filenames):
+        typed = []
+        for original_filename in filenames:
             try:
-                media_type = Type.objects.get_or_create_by_filename(original_filename)        
+                typed.append((original_filename, self._get_type(original_filename)))
             except MimeError, ex:
                 logger.error(ex)
+        self.files_read += len(filenames)
+
+        existing = {}
+        if typed:
+            for item in Item.objects.filter(source_file_path__in = [x[0] for x in typed], workspaces = self.workspace):
+                existing[(item.source_file_path, item.type_id)] = item
+
+        copies = []                        # (item, component, source, destination, index entry)
+        updates = []
+        with transaction.commit_on_success():
+            for original_filename, media_type in typed:
+                item = existing.get((original_filename, media_type.pk))
+                if item is None:
+                    res_id = new_id()
+                    item, created = _create_item(self.user, self.workspace, res_id, media_type, original_filename)
+                    final_filename = get_storage_file_name(res_id, self.workspace.pk, self.variant.name, media_type.ext)
+                    upload_filename = os.path.basename(original_filename)
+                    tmp = upload_filename.split('_')
+                    if len(tmp) > 1:
+                        upload_filename = '_'.join(tmp[1:])
+                    comp = _create_variant(upload_filename, final_filename, media_type, item, self.workspace, self.variant)
+                    copies.append((item, comp, original_filename, os.path.join(settings.MEDIADART_STORAGE, final_filename), None))
+                elif self.force_generation:
+                    updates.append((item, original_filename))
+        if updates:
+            copies.extend(self._get_modified(pool, updates))
+
+        results = pool.map(self._copy, copies)
+        imported = []
+        with transaction.commit_on_success():
+            new_entries = []
+            for (item, comp, original_filename, final_path, entry), (stat, md5sum) in zip(copies, results):
+                if md5sum is None:
+                    if entry is None:      # created by this chunk: do not leave it without its file
+                        self._discard(item, final_path)
+                    continue
+                imported.append(item)
+                if entry is None:
+                    entry = ContentIndex(component = comp)
+                    entry.set_source(original_filename, stat, md5sum)
+                    new_entries.append(entry)
+                else:
+                    entry.set_source(original_filename, stat, md5sum)
+                    entry.save()
+            ContentIndex.objects.bulk_create(new_entries)
+        self._log_duplicates(new_entries)
+
+        self.items_imported += len(imported)
+        logger.info('import of %s: %d files read, %d items imported' % (self.dir_name, self.files_read, self.items_imported))
+        if self.progress:
+            self.progress(self.files_read, self.items_imported)
+        return imported
+
+    def _get_modified(self, pool, updates):
+        """Returns the copy jobs for the files of existing items that were modified.
+
+           Files whose size and mtime match the content index are skipped without
+           reading them; the others are hashed and compared with the indexed hash
+           (or, if not indexed yet, with the hash of the stored file). When linking or
+           moving, or for files indexed without md5, nothing is read: the files whose
+           size or mtime changed are imported again.
+        """
+        components = {}
+        for comp in Component.objects.filter(item__in = [x[0] for x in updates], variant = self.variant, workspace = self.workspace):
+            components[comp.item_id] = comp
+        index = {}
+        for entry in ContentIndex.objects.filter(component__in = components.values()):
+            index[entry.component_id] = entry
+
+        ret = []
+        to_hash = []                       # (item, component, source, destination, index entry, stat)
+        for item, original_filename in updates:
+            comp = components.get(item.pk)
+            if comp is None:
+                comp = self.variant.get_component(self.workspace, item)
+            entry = index.get(comp.pk)
+            stat = os.stat(original_filename)
+            if entry is not None and entry.is_unchanged(stat):
                 continue
-                
-            final_filename = get_storage_file_name(res_id, workspace.pk, variant.name, media_type.ext)
-            final_path = os.path.join(settings.MEDIADART_STORAGE, final_filename)
-            upload_filename = os.path.basename(original_filename)
-            
-            tmp = upload_filename.split('_')
-            item, created = _create_item(user, workspace, res_id, media_type, original_filename)
-            logger.debug('created %s'%created)
-            logger.debug('+++++++++++++ force_generation %s'%force_generation)
-            if created:
-                logger.debug('file created')
-                if len(tmp) > 1:
-                    upload_filename = '_'.join(tmp[1:])
-                _create_variant(upload_filename, final_filename, media_type, item, workspace, variant)
-                
-                
-                logger.debug('yielding item %s'%item)
-                copy_file(original_filename, final_path, link, make_copy)
-                yield item
-                
-            elif force_generation:
-                logger.debug('force_generation')
-                component = variant.get_component(workspace, item)
-                dam_hash = md5(component.get_file_path())
-                dir_hash = md5(original_filename)
-                #if force_generation or dir_hash != dam_hash:
-                logger.debug('component.get_file_path() %s'%component.get_file_path())
-                logger.debug('original_filename %s'%original_filename)
-                
-                logger.debug('dir_hash != dam_hash %s'%(dir_hash != dam_hash))
-                if dir_hash != dam_hash:
-                    
-                    copy_file(original_filename, component.get_file_path(), link, make_copy)
-                    yield item
-        if not recursive:
-            break
-                
-                
-            
-            #yield item
-            
-    
+            if not (self.make_copy and not self.link) or (entry is not None and not entry.md5):
+                ret.append((item, comp, original_filename, comp.get_file_path(), entry or ContentIndex(component = comp)))
+                continue
+            to_hash.append((item, comp, original_filename, comp.get_file_path(), entry, stat))
+
+        paths = [x[2] for x in to_hash] + [x[3] for x in to_hash if x[4] is None]
+        hashes = dict(zip(paths, pool.map(md5, paths)))
+        for item, comp, original_filename, final_path, entry, stat in to_hash:
+            if entry is None:
+                stored_hash = hashes[final_path]
+                entry = ContentIndex(component = comp)
+            else:
+                stored_hash = entry.md5
+            if hashes[original_filename] != stored_hash:
+                ret.append((item, comp, original_filename, final_path, entry))
+            else:                          # only size or mtime changed
+                entry.set_source(original_filename, stat, stored_hash)
+                entry.save()
+        return ret
+
+    def _discard(self, item, final_path):
+        "Deletes a new item whose file could not be imported, so that the next import retries it"
+        logger.info('removing item %s, created for %s' % (item.pk, final_path))
+        item.delete()
+        if os.path.exists(final_path):
+            os.remove(final_path)
+
+    def _log_duplicates(self, entries):
+        if not entries:
+            return
+        new = dict([(x.md5, x.source_file_path) for x in entries if x.md5])
+        for entry in ContentIndex.objects.get_duplicates(new.keys()).exclude(component__in = [x.component_id for x in entries]):
+            logger.info('%s has the same content of component %s (%s)' % (new[entry.md5], entry.component.pk, entry.source_file_path))
+
+    def _copy(self, job):
+        """run in the pool, returns (os.stat, md5) of the source file, or (None, None) 
+           if the copy failed. The md5 is '' if the file was linked or moved"""
+        item, comp, original_filename, final_path, entry = job
+        try:
+            stat = os.stat(original_filename)
+            if self.make_copy and not self.link:
+                md5sum = _copy_file_hash(original_filename, final_path)
+            else:
+                _copy_file(original_filename, final_path, self.link, self.make_copy)
+                md5sum = ''
+        except Exception, ex:
+            logger.error('cannot import %s in %s: %s' % (original_filename, final_path, ex))
+            return None, None
+        return stat, md5sum
+
+
+def _create_items(dir_name, variant_name, user, workspace, make_copy=True, recursive = True, force_generation = False, link = False, 
+                  workers = 4, transaction_size = 100, progress = None):
+    """
+      Generator of the items created (or updated, if force_generation) importing the files in dir_name.
+      See DirImporter.
+    """
+    logger.debug('########## _create_items')
+    importer = DirImporter(dir_name, variant_name, user, workspace, make_copy, recursive, force_generation, link, 
+                           workers, transaction_size, progress)
+    return importer.items()
 
 def _remove_orphan_items(dir_path):
     items_deleted = 0
@@ -424,7 +603,8 @@ def _remove_orphan_items(dir_path):
             items_deleted += 1
     return items_deleted
 
-def import_dir(dir_name, user, workspace, variant_name = 'original', trigger = 'upload', make_copy = False, recursive = True, force_generation = False, link = False, remove_orphans = False):
+def import_dir(dir_name, user, workspace, variant_name = 'original', trigger = 'upload', make_copy = False, recursive = True, force_generation = False, link = False, remove_orphans = False, 
+               workers = 4, transaction_size = 100, progress = None):
     logger.debug('########### INSIDE import_dir: %s' % dir_name)
     #files = [os.path.join(dir_name, x) for x in os.listdir(dir_name)]
 
@@ -432,11 +612,16 @@ def import_dir(dir_name, user, workspace, variant_name = 'original', trigger = '
     if remove_orphans:
         items_deleted = _remove_orphan_items(dir_name)
         
-    items = _create_items(dir_name, variant_name, user, workspace, make_copy, recursive, force_generation, link)   
+    items = _create_items(dir_name, variant_name, user, workspace, make_copy, recursive, force_generation, link, 
+                          workers, transaction_size, progress)
 
     #items = Item.objects.filter(source_file_path__startswith=dir_name)
+    processes = []
     if trigger:
         processes = _run_pipelines(items, trigger,  user, workspace)
+    else:
+        for item in items:             # run the import anyway
+            pass
         
     return (items_deleted ,processes)
     #logger.debug('Launched %s' % ' '.join(ret))
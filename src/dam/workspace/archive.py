@@ -0,0 +1,229 @@
+#########################################################################
+#
+# NotreDAM, Copyright (C) 2009, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it
+# Web: www.notre-dam.org
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#########################################################################
+
+"""
+Archives of renditions, used by workspace.views.download_renditions.
+
+Small zip archives are streamed directly in the response (see stream_zip).
+The others are built by a background thread in ARCHIVE_DIR, a directory of
+the storage: the job writes <name>.part and renames it to <name> when done,
+or writes <name>.error, so that any web process can tell its status (see
+get_status). A job whose <name>.part has not been written for ARCHIVE_STALL
+seconds is reported failed: its thread died with the web process that ran
+it. Archives are removed ARCHIVE_EXPIRY seconds after they were last written.
+"""
+
+import os
+import re
+import time
+import struct
+import zlib
+import zipfile
+import tarfile
+import threading
+from uuid import uuid4
+
+from dam.settings import MEDIADART_STORAGE, STORAGE_SERVER_URL
+from dam.repository.models import Component
+
+import logging
+logger = logging.getLogger('dam')
+
+ARCHIVE_DIR = os.path.join(MEDIADART_STORAGE, 'archives')
+ARCHIVE_URL = STORAGE_SERVER_URL + 'archives/'
+ARCHIVE_EXPIRY = 24 * 3600          # seconds a finished archive is kept
+ARCHIVE_STALL = 300                 # seconds without writes after which a job is dead
+STREAM_MAX_SIZE = 50 * 1024 * 1024  # larger selections are archived in background
+STREAM_MAX_FILES = 100
+BUFSIZE = 1024 * 1024
+
+# extensions of media that do not gain anything from deflating
+COMPRESSED_EXTENSIONS = set(['.jpg', '.jpeg', '.png', '.gif', '.mp3', '.m4a', '.aac', '.ogg', '.oga',
+                             '.mp4', '.m4v', '.mov', '.avi', '.flv', '.ogv', '.webm', '.mkv', '.wmv',
+                             '.zip', '.gz', '.tgz', '.bz2'])
+
+SUFFIXES = {'zip': '.zip', 'tar.gz': '.tar.gz'}
+
+_name_re = re.compile(r'^archive-[0-9a-f]{32}\.(zip|tar\.gz)$')
+
+
+def get_entries(items, renditions):
+    """
+    Returns the list of (path, name in the archive, size) of the given
+    renditions of the given items, resolving all components in two queries
+    """
+    originals = dict(Component.objects.filter(item__pk__in=items, variant__name='original').values_list('item', 'file_name'))
+    entries = []
+    components = Component.objects.filter(item__pk__in=items, variant__pk__in=renditions).values_list('item', 'uri', 'variant__name')
+    for item_id, uri, variant_name in components.order_by('item', 'variant'):
+        if not uri:
+            continue
+        path = os.path.join(MEDIADART_STORAGE, uri)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        file_name, ext = os.path.splitext(originals.get(item_id) or '')
+        ext = os.path.splitext(uri)[1] or ext
+        entries.append((path, '%s_%s%s' % (file_name, variant_name, ext), size))
+    return entries
+
+def can_stream(entries, compression_type):
+    return compression_type == 'zip' and len(entries) <= STREAM_MAX_FILES and \
+           sum([size for path, name, size in entries]) <= STREAM_MAX_SIZE
+
+def _compress_type(name):
+    if os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def _dos_date_time(path):
+    t = time.localtime(os.path.getmtime(path))
+    return (t[0] - 1980) << 9 | t[1] << 5 | t[2], t[3] << 11 | t[4] << 5 | t[5] // 2
+
+def stream_zip(entries):
+    """
+    Generates a zip archive of entries (see get_entries) without seeking:
+    sizes and crc of each file follow its data, in a data descriptor
+    """
+    offset = 0
+    directory = []
+    for path, name, size in entries:
+        compress_type = _compress_type(name)
+        date, dostime = _dos_date_time(path)
+        flags = 0x08                       # sizes and crc follow the data
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+            flags |= 0x800                 # utf-8 name
+        header = struct.pack(zipfile.structFileHeader, zipfile.stringFileHeader, 20, 0, flags,
+                             compress_type, dostime, date, 0, 0, 0, len(name), 0) + name
+        yield header
+        crc = compress_size = file_size = 0
+        if compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        f = open(path, 'rb')
+        try:
+            buf = f.read(BUFSIZE)
+            while buf:
+                file_size += len(buf)
+                crc = zlib.crc32(buf, crc)
+                if compress_type == zipfile.ZIP_DEFLATED:
+                    buf = compressor.compress(buf)
+                compress_size += len(buf)
+                if buf:
+                    yield buf
+                buf = f.read(BUFSIZE)
+        finally:
+            f.close()
+        if compress_type == zipfile.ZIP_DEFLATED:
+            buf = compressor.flush()
+            compress_size += len(buf)
+            yield buf
+        crc = crc & 0xffffffff
+        yield struct.pack('<4s3L', 'PK\x07\x08', crc, compress_size, file_size)
+        directory.append(struct.pack(zipfile.structCentralDir, zipfile.stringCentralDir, 20, 3, 20, 0, flags,
+                                     compress_type, dostime, date, crc, compress_size, file_size,
+                                     len(name), 0, 0, 0, 0, 0644 << 16, offset) + name)
+        offset += len(header) + compress_size + 16
+    directory = ''.join(directory)
+    yield directory
+    yield struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0, len(entries), len(entries),
+                      len(directory), offset, 0)
+
+def write_archive(path, entries, compression_type):
+    "Writes to path the archive of entries (see get_entries)"
+    if compression_type == 'zip':
+        archive = zipfile.ZipFile(path, 'w', allowZip64=True)
+        try:
+            for file_path, name, size in entries:
+                archive.write(file_path, name, _compress_type(name))
+        finally:
+            archive.close()
+    else:
+        archive = tarfile.open(path, 'w|gz', bufsize=BUFSIZE)
+        try:
+            for file_path, name, size in entries:
+                archive.add(file_path, name)
+        finally:
+            archive.close()
+
+def _build(name, entries, compression_type):
+    path = os.path.join(ARCHIVE_DIR, name)
+    try:
+        write_archive(path + '.part', entries, compression_type)
+        os.rename(path + '.part', path)
+    except Exception, ex:
+        logger.exception(ex)
+        f = open(path + '.error', 'w')
+        f.write(str(ex))
+        f.close()
+        if os.path.exists(path + '.part'):
+            os.unlink(path + '.part')
+
+def start_job(entries, compression_type):
+    """
+    Starts building in background the archive of entries (see get_entries)
+    and returns its name, to be passed to get_status
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        os.makedirs(ARCHIVE_DIR)
+    expire_archives()
+    name = 'archive-%s%s' % (uuid4().hex, SUFFIXES[compression_type])
+    open(os.path.join(ARCHIVE_DIR, name + '.part'), 'w').close()
+    t = threading.Thread(target=_build, args=(name, entries, compression_type))
+    t.setDaemon(True)
+    t.start()
+    return name
+
+def get_status(name):
+    """
+    Returns a dictionary with the status of the job building archive name:
+    running (with the bytes written so far), ready (with the url of the
+    archive), failed (with the error) or unknown (never started or expired).
+    The writer updates <name>.part continuously: if it has not been modified
+    for ARCHIVE_STALL seconds, the job died and it is reported failed
+    """
+    if not _name_re.match(name):
+        return {'status': 'unknown'}
+    path = os.path.join(ARCHIVE_DIR, name)
+    if os.path.exists(path):
+        return {'status': 'ready', 'url': ARCHIVE_URL + name}
+    try:
+        st = os.stat(path + '.part')
+    except OSError:
+        pass
+    else:
+        if st.st_mtime < time.time() - ARCHIVE_STALL:
+            return {'status': 'failed', 'error': 'the archive job was interrupted'}
+        return {'status': 'running', 'size': st.st_size}
+    if os.path.exists(path + '.error'):
+        return {'status': 'failed', 'error': open(path + '.error').read()}
+    return {'status': 'unknown'}
+
+def expire_archives(expiry=ARCHIVE_EXPIRY):
+    "Removes the archives (and the files of dead jobs) older than expiry seconds"
+    if not os.path.isdir(ARCHIVE_DIR):
+        return
+    limit = time.time() - expiry
+    for f in os.listdir(ARCHIVE_DIR):
+        path = os.path.join(ARCHIVE_DIR, f)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,101 @@
+"""
+Tests of the rendition archives:
+
+python manage.py test workspace
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from cStringIO import StringIO
+
+from django.test import TestCase
+
+from dam.workspace import archive
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.contents = {}
+        self.entries = []
+        for name, data in [('text_fullscreen.txt', 'NotreDAM ' * 100000),       # deflated, several buffers
+                           ('photo_preview.jpg', os.urandom(3000)),             # stored
+                           ('empty_thumbnail.txt', ''),
+                           (u'citt\xe0_original.txt', 'utf-8 name')]:
+            path = os.path.join(self.dir, 'file%d' % len(self.entries))
+            f = open(path, 'wb')
+            f.write(data)
+            f.close()
+            self.entries.append((path, name, len(data)))
+            self.contents[name] = data
+        self.archive_dir = archive.ARCHIVE_DIR
+        archive.ARCHIVE_DIR = os.path.join(self.dir, 'archives')
+
+    def tearDown(self):
+        archive.ARCHIVE_DIR = self.archive_dir
+        shutil.rmtree(self.dir)
+
+    def check_zip(self, f):
+        z = zipfile.ZipFile(f)
+        self.assertEqual(z.testzip(), None)
+        infos = z.infolist()
+        self.assertEqual([i.filename for i in infos], [name for path, name, size in self.entries])
+        for info in infos:
+            self.assertEqual(z.read(info), self.contents[info.filename])
+            self.assertEqual(info.compress_type, archive._compress_type(info.filename))
+        z.close()
+
+    def test_stream_zip(self):
+        self.check_zip(StringIO(''.join(archive.stream_zip(self.entries))))
+
+    def test_stream_zip_empty(self):
+        z = zipfile.ZipFile(StringIO(''.join(archive.stream_zip([]))))
+        self.assertEqual(z.namelist(), [])
+
+    def test_write_archive(self):
+        path = os.path.join(self.dir, 'out.zip')
+        archive.write_archive(path, self.entries, 'zip')
+        self.check_zip(path)
+
+        entries = [e for e in self.entries if isinstance(e[1], str)]
+        path = os.path.join(self.dir, 'out.tar.gz')
+        archive.write_archive(path, entries, 'tar.gz')
+        t = tarfile.open(path)
+        self.assertEqual([m.name for m in t.getmembers()], [name for p, name, size in entries])
+        for m in t.getmembers():
+            self.assertEqual(t.extractfile(m).read(), self.contents[m.name])
+        t.close()
+
+    def test_can_stream(self):
+        self.assertTrue(archive.can_stream(self.entries, 'zip'))
+        self.assertFalse(archive.can_stream(self.entries, 'tar.gz'))
+        self.assertFalse(archive.can_stream([('x', 'x', archive.STREAM_MAX_SIZE + 1)], 'zip'))
+
+    def test_status(self):
+        os.makedirs(archive.ARCHIVE_DIR)
+        name = 'archive-%s.zip' % ('0' * 32)
+        self.assertEqual(archive.get_status(name), {'status': 'unknown'})
+        self.assertEqual(archive.get_status('../' + name), {'status': 'unknown'})
+        archive._build(name, self.entries, 'zip')
+        status = archive.get_status(name)
+        self.assertEqual(status['status'], 'ready')
+        self.check_zip(os.path.join(archive.ARCHIVE_DIR, name))
+
+        name = 'archive-%s.zip' % ('1' * 32)
+        archive._build(name, [(os.path.join(self.dir, 'missing'), 'missing.txt', 0)], 'zip')
+        self.assertEqual(archive.get_status(name)['status'], 'failed')
+        self.assertFalse(os.path.exists(os.path.join(archive.ARCHIVE_DIR, name + '.part')))
+
+    def test_status_interrupted(self):
+        "A job whose file is not written any more died with its process"
+        os.makedirs(archive.ARCHIVE_DIR)
+        name = 'archive-%s.zip' % ('2' * 32)
+        part = os.path.join(archive.ARCHIVE_DIR, name + '.part')
+        open(part, 'w').write('PK')
+        self.assertEqual(archive.get_status(name), {'status': 'running', 'size': 2})
+        stalled = time.time() - archive.ARCHIVE_STALL - 1
+        os.utime(part, (stalled, stalled))
+        self.assertEqual(archive.get_status(name)['status'], 'failed')
@@ -51,6 +51,8 @@ urlpatterns = patterns('',
     (r'^get_available_users/', 'dam.workspace.views.get_available_users'),
     (r'^save_members/', 'dam.workspace.views.save_members'), 
     (r'^download_renditions/', 'dam.workspace.views.download_renditions'),    
+    (r'^download_archive/', 'dam.workspace.views.download_archive'),
+    (r'^archive_status/(?P<name>[^/]+)/$', 'dam.workspace.views.archive_status'),
     (r'^i18n/', include('django.conf.urls.i18n')),
     (r'^jsi18n/$', 'django.views.i18n.javascript_catalog', js_info_dict),
 )
@@ -40,9 +40,11 @@ from dam.core.dam_repository.models import Type
 from dam.settings import GOOGLE_KEY, DATABASES
 from dam.application.views import NOTAVAILABLE
 from dam.preferences.models import DAMComponentSetting, DAMComponent
-from dam.metadata.models import MetadataProperty
+from dam.metadata.models import MetadataProperty, MetadataToken, tokenize, get_schema_cache
 from dam.preferences.views import get_metadata_default_language, get_ws_homepage_prefs
 from dam.mprocessor.models import Pipeline, Process, ProcessTarget
+from dam.mprocessor import progress
+from dam.workspace import archive
 from dam.eventmanager.models import Event, EventRegistration
 from dam.appearance.models import Theme
 from dam.upload.views import _run_pipelines
@@ -55,10 +57,13 @@ from mx.DateTime.Parser import DateTimeFromString
 
 import operator
 import re
+import urllib
 
 import logging
 logger = logging.getLogger('dam')
 
+PROGRESS_WAIT = 20      # seconds get_status waits for progress notifications
+
 
 @login_required 
 @permission_required('admin', False)
@@ -253,37 +258,12 @@ def get_workspaces(request):
         raise ex
 
 
-def _search_complex_query(complex_query,  items):
-    
-    if complex_query['condition'] == 'and':
-        for node_id in complex_query['nodes']:
-            node = Node.objects.get(pk = node_id['id'])
-            if node_id['negated']:
-                items = items.exclude(node = node)
-                
-            else:
-                items = items.filter(node__in = node.get_branch())
-            
-    else:
-        
-        q = None
-        for node_id in complex_query['nodes']:
-            node = Node.objects.get(pk = node_id['id'])
-            
-            if node_id['negated']:
-                if q == None:
-                    q = ~Q(node = node)
-                else:
-                    q = q.__or__(~Q(node = node))
-            else:
-                if q == None:
-                    q = Q(node = node)
-                else:
-                    q = q.__or__(Q(node = node))
-            
-        items = items.filter(q)                
-
-    return items
+def _search_complex_query(complex_query,  items, bounds = None):
+    """
+    Filters items by a complex query (see Node.objects.compile_complex_query);
+    bounds of the nodes referred can be passed when already loaded
+    """
+    return items.filter(Node.objects.compile_complex_query(complex_query, bounds))
 
 def filter_by_date(date_type, query_dict, items, workspace = None):
         """
@@ -383,13 +363,16 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
         if show_associated_items:
             return items.filter(node = node)
         else:
-            return items.filter(node__in = node.get_branch())
+            return items.filter(pk__in = Node.objects.branch_items((node.workspace_id, node.type, node.lft, node.rgt)))
         
-    def search_smart_folder(smart_folder_node, items):
-                
-        complex_query = smart_folder_node.get_complex_query()
-        items = _search_complex_query(complex_query,  items)
-        return items
+    def search_smart_folders(smart_folders, items):
+        """
+        Returns a query for each smart folder; the nodes of all of them are
+        loaded at once
+        """
+        complex_queries = SmartFolder.objects.get_complex_queries(smart_folders)
+        bounds = Node.objects.get_bounds([n['id'] for cq in complex_queries.values() for n in cq['nodes']])
+        return [_search_complex_query(complex_queries[sm], items, bounds) for sm in smart_folders]
         
     if media_type:
         items = items.filter(type__name__in = media_type).distinct()
@@ -441,18 +424,17 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
     else:
         logger.debug('nodes_query %s'%nodes_query)
         if nodes_query:            
+            nodes = Node.objects.in_bulk(nodes_query)
             for node_id  in nodes_query:
-                node = Node.objects.filter(pk = node_id)                
-                if node.count() > 0:
-                    node = node[0] 
+                node = nodes.get(int(node_id))
+                if node is not None:
                     queries.append(search_node(node, not show_associated_items))
                 else:
                     queries.append(Item.objects.none())
                     
         if smart_folders_query:
-            for smart_folder_id in smart_folders_query:                
-                smart_folder_node = SmartFolder.objects.get(pk = smart_folder_id)
-                queries.append(search_smart_folder(smart_folder_node, items))
+            smart_folders = SmartFolder.objects.in_bulk(smart_folders_query)
+            queries.extend(search_smart_folders([smart_folders[int(pk)] for pk in smart_folders_query], items))
 #Text query        
         if query:
             processes =  re.findall('\s*process:(\w+):(\w+)\s*', query,  re.U)
@@ -483,9 +465,9 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
             simple_query = re.sub('(\w+:\(([\d.-]*),([\d.-]*)\),\(([\d.-]*),([\d.-]*)\))', '', simple_query)
 
             multi_words = re.findall('"(.+?)"', simple_query,  re.U)
-            single_word_query = re.compile('"(.+)"',  re.U).sub( '', simple_query)
+            single_word_query = re.compile('"(.+?)"',  re.U).sub( '', simple_query)
             
-            words = re.findall( '\s*(.+)\s*', single_word_query ,  re.U)
+            words = tokenize(single_word_query)
       
             logger.debug('words %s'%words )
             logger.debug('multi_words %s'%multi_words)
@@ -501,7 +483,7 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
                 property_namespace,   property_field_name = key.split(':')
                 
                 try:
-                    property = MetadataProperty.objects.get(namespace__prefix = property_namespace,  field_name = property_field_name)
+                    property = get_schema_cache().get_property(property_namespace, property_field_name)
                     logger.debug('items %s'%items)
                     logger.debug('items.filter(metadata__value = value, metadata__schema = property) %s'%items.filter(metadata__value = value, metadata__schema = property))
                     queries.append(items.filter(metadata__value = value, metadata__schema = property))
@@ -524,20 +506,27 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
                 queries.append(q)
                 
             logger.debug('inbox %s'%inbox)
+            nodes = Node.objects.get_from_paths(inbox, workspace, 'inbox')
             for inbox_el in inbox:
                 logger.debug('path %s'%inbox_el)
-                node = Node.objects.get_from_path(inbox_el, workspace,   'inbox')
-                logger.debug('node found in inbox %s'%node.pk)
-                queries.append(items.filter(node = node))
+                node = nodes.get(inbox_el)
+                logger.debug('node found in inbox %s'%node)
+                if node is None:
+                    queries.append(items.none())
+                else:
+                    queries.append(items.filter(node = node))
                 
             logger.debug('keywords %s'%keywords)
+            nodes = Node.objects.get_from_paths([k for k in keywords if k], workspace, 'keyword')
             for keyword in keywords:
                 if keyword: 
                     logger.debug('keyword: %s'%keyword)
-                    node = Node.objects.get_from_path(keyword, workspace,  'keyword')
+                    node = nodes.get(keyword)
                     logger.debug('node found %s'%node)
-                    
-                    queries.append(search_node(node, not show_associated_items))
+                    if node is None:
+                        queries.append(items.none())
+                    else:
+                        queries.append(search_node(node, not show_associated_items))
                     
                 else:
                     logger.debug('without keywords')
@@ -547,18 +536,22 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
                 
             
             logger.debug('collections %s'%collections)
+            nodes = Node.objects.get_from_paths(collections, workspace, 'collection')
             for coll  in collections:
                 
                 logger.debug('path %s'%coll)
-                node = Node.objects.get_from_path(coll, workspace,  'collection')
+                node = nodes.get(coll)
                 logger.debug('node found %s'%node)
-                queries.append(items.filter(node = node))
+                if node is None:
+                    queries.append(items.none())
+                else:
+                    queries.append(items.filter(node = node))
                 
             logger.debug('smart_folder %s'%smart_folder )
             if smart_folder:               
                 
                 smart_folder_node = SmartFolder.objects.get(workspace = workspace,  label = smart_folder[0])
-                queries.append(search_smart_folder(smart_folder_node, items))
+                queries.extend(search_smart_folders([smart_folder_node], items))
 
             logger.debug('geo %s'%geo)
             for coords in geo:
@@ -573,32 +566,14 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
             
             logger.debug('words %s'%words)
             for word in words:
-                logger.debug('word %s'%word)
-                if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
-                    q = Q(metadata__value__iregex = u'(?:^|(?:[\w\s]*\s))(%s)(?:$|(?:\s+\w*))'%word.strip())                
-                    queries.append(items.filter(q))
-                    logger.debug('items.filter(q) %s'%items.filter(q))
-                elif DATABASES['default']['ENGINE'] == 'django.db.backends.mysql':
-                    q = Q(metadata__value__iregex = '[[:<:]]%s[[:>:]]'%word.strip())
-                    queries.append(items.filter(q))
+                queries.append(items.filter(pk__in = MetadataToken.objects.search_word(word)))
                 
             logger.debug('multi_words %s'%multi_words)
-            for words in multi_words:
-                tmp = re.findall('\s*(.+)\s*', words,  re.U)
+            for phrase in multi_words:
+                tmp = tokenize(phrase)
                 logger.debug('multi words %s'%tmp)
-                if DATABASES['default']['ENGINE'] == 'sqlite3':
-                    words_joined = '\s+'.join(tmp)
-                    words_joined = words_joined.strip() 
-#                    q = Q(metadata__value__iregex = '(?:^|(?:[\w\s]*\s))(%s)(?:$|(?:\s+\w*))'%words_joined)
-                    q = Q(metadata__value__iregex = '%s'%words_joined)
-                    
-
-                    queries.append(items.filter(q))
-                
-                elif DATABASES['default']['ENGINE'] == 'mysql':
-                    words_joined = '[[:blank:]]+'.join(tmp)
-                    q = Q(metadata__value__iregex = '[[:<:]]%s[[:>:]]'%words_joined)
-                    queries.append(items.filter(q))
+                if tmp:
+                    queries.append(items.filter(pk__in = MetadataToken.objects.search_phrase(tmp)))
 
         if queries:
             if len(queries) == 1:
@@ -621,7 +596,7 @@ def _search(query_dict,  items, media_type = None, start =0, limit=30,  workspac
             property_namespace, property_field_name = ws_ordering_criteria.split('_')
                 
             try:
-                property = MetadataProperty.objects.get(namespace__prefix__iexact = property_namespace,  field_name__iexact = property_field_name)
+                property = get_schema_cache().get_property(property_namespace, property_field_name)
             except MetadataProperty.DoesNotExist:
                 property = None
         
@@ -722,8 +697,9 @@ def load_items(request, view_type=None, unlimited=False):
         fullscreen_caption = fullscreen_caption_setting.get_user_setting(user, workspace)
         default_language = get_metadata_default_language(user, workspace)    
         check_deleted = request.POST.has_key('show_deleted')
-        for item in items:
-            tmp = item.get_info(workspace, thumb_caption, default_language, check_deleted = check_deleted, fullscreen_caption = fullscreen_caption)
+        items = list(items)
+        infos = Item.objects.get_info_many(items, workspace, thumb_caption, default_language, check_deleted = check_deleted, fullscreen_caption = fullscreen_caption)
+        for item, tmp in zip(items, infos):
             if item.pk in basket_items:
                 tmp['item_in_basket'] = 1
             else:
@@ -859,15 +835,11 @@ def upload_status(request):
 #        completed_targets = ProcessTarget.objects.filter(process__workspace = workspace, target_id__in=items_in_progress, actions_todo=0).values_list('target_id', flat = true)
 #        info = {}
 
-        process_in_progress = Process.objects.filter(end_date__isnull = True)
-        if process_in_progress:
-            pending_items = ProcessTarget.objects.filter(process__in = process_in_progress, actions_todo__gt = 0)
-        else:
-            pending_items = ProcessTarget.objects.none()
+        process_in_progress, pending_items = Process.objects.in_progress_stats()
         
         resp['status_bar'] = {
-            'process_in_progress':  process_in_progress.count(),
-            'pending_items': pending_items.count()
+            'process_in_progress':  process_in_progress,
+            'pending_items': pending_items
         }
 ####
         if request.POST.get('update_script_monitor'):
@@ -881,23 +853,8 @@ def upload_status(request):
         fullscreen_caption = fullscreen_caption_setting.get_user_setting(user, workspace)
         default_language = get_metadata_default_language(user, workspace)    
         check_deleted = request.POST.has_key('show_deleted')
-        for item_id in items_in_progress:
-            try:
-
-        
-                item = Item.objects.get(pk = int(item_id)) 
-                #tmp = item.get_info(workspace, user)
-                tmp = item.get_info(workspace, thumb_caption, default_language, check_deleted = check_deleted, fullscreen_caption = fullscreen_caption)
-#                if item_id not in completed_targets:
-#                    tmp['status'] = 'in_progress'
-#                else:
-#                    tmp['status'] = 'completed'
-                
-                resp['items'].append(tmp)
-                
-            except Item.DoesNotExist:
-                logger.debug('process target not found for item %s'%item_id)
-                continue
+        items = Item.objects.filter(pk__in = [int(item_id) for item_id in items_in_progress])
+        resp['items'].extend(Item.objects.get_info_many(items, workspace, thumb_caption, default_language, check_deleted = check_deleted, fullscreen_caption = fullscreen_caption))
 
         logger.info('resp: %s' % resp) 
 
@@ -952,7 +909,9 @@ def stop_pending_processes(request):
 def get_status(request):
     """
     Returns information for the given items, including name, size, url of thumbnail and preview
-    Called every 10 seconds by the GUI for refreshing information on pending items
+    Called by the GUI for refreshing information on pending items.
+    If since (the value returned by the previous call) is given, waits for
+    progress notifications of the mprocessor and returns only what changed
     """
     try:
         workspace = request.session.get('workspace')
@@ -966,46 +925,44 @@ def get_status(request):
         #completed_targets = ProcessTarget.objects.filter(process__workspace = workspace, target_id__in=items_in_progress, actions_todo=0).values_list('target_id', flat = True)
 #        info = {}
 
-        process_in_progress = Process.objects.filter(end_date__isnull = True)
-        if process_in_progress:
-            pending_items = ProcessTarget.objects.filter(process__in = process_in_progress, actions_todo__gt = 0)
-        else:
-            pending_items = ProcessTarget.objects.none()
-        
-        resp['status_bar'] = {
-            'process_in_progress':  process_in_progress.count(),
-            'pending_items': pending_items.count()
-        }
+        channel = progress.get_channel()
+        seq = channel.seq
+        messages = changed = None       # changed is None when everything must be refreshed
+        since = request.POST.get('since')
+        if since and channel.live:
+            since = int(since)
+            seq, messages = channel.wait(workspace.pk, since, PROGRESS_WAIT)
+            if since <= seq:
+                changed = set()
+                for message in messages:
+                    changed.update(message['items'])
+                items_in_progress = [pk for pk in items_in_progress if pk in changed]
+        resp['since'] = seq
+        resp['live'] = channel.live
+
+        if changed is None or messages:
+            process_in_progress, pending_items = Process.objects.in_progress_stats()
+            
+            resp['status_bar'] = {
+                'process_in_progress':  process_in_progress,
+                'pending_items': pending_items
+            }
 ####
-        if request.POST.get('update_script_monitor'):
-            from dam.scripts.views import _script_monitor
-            processes_info = _script_monitor(workspace)
-            resp['scripts'] = processes_info 
-
-        thumb_caption_setting = DAMComponentSetting.objects.get(name='thumbnail_caption')
-        thumb_caption = thumb_caption_setting.get_user_setting(user, workspace)
-        fullscreen_caption_setting = DAMComponentSetting.objects.get(name='fullscreen_caption')
-        fullscreen_caption = fullscreen_caption_setting.get_user_setting(user, workspace)
-        default_language = get_metadata_default_language(user, workspace)    
-        check_deleted = request.POST.has_key('show_deleted')
+            if request.POST.get('update_script_monitor'):
+                from dam.scripts.views import _script_monitor
+                processes_info = _script_monitor(workspace)
+                resp['scripts'] = processes_info 
+
+        if items_in_progress:
+            thumb_caption_setting = DAMComponentSetting.objects.get(name='thumbnail_caption')
+            thumb_caption = thumb_caption_setting.get_user_setting(user, workspace)
+            fullscreen_caption_setting = DAMComponentSetting.objects.get(name='fullscreen_caption')
+            fullscreen_caption = fullscreen_caption_setting.get_user_setting(user, workspace)
+            default_language = get_metadata_default_language(user, workspace)    
+            check_deleted = request.POST.has_key('show_deleted')
             
-        for item_id in items_in_progress:
-            try:
-
-        
-                item = Item.objects.get(pk = int(item_id)) 
-                #tmp = item.get_info(workspace, user)
-                tmp = item.get_info(workspace, thumb_caption, default_language, check_deleted = check_deleted, fullscreen_caption = fullscreen_caption)
-#                if item_id not in completed_targets:
-#                    tmp['status'] = 'in_progress'
-#                else:
-#                    tmp['status'] = 'completed'
-                
-                resp['items'].append(tmp)
-                
-            except Item.DoesNotExist:
-                logger.debug('process target not found for item %s'%item_id)
-                continue
+            items = Item.objects.filter(pk__in = [int(item_id) for item_id in items_in_progress])
+            resp['items'].extend(Item.objects.get_info_many(items, workspace, thumb_caption, default_language, check_deleted = check_deleted, fullscreen_caption = fullscreen_caption))
 
 
         logger.info('resp: %s' % resp)       
@@ -1186,45 +1143,45 @@ def switch_ws(request):
     
 @login_required
 def download_renditions(request):
-    import  os, settings, tempfile
+    """
+    Archives the given renditions of the given items.
+    Small zip archives are streamed by download_archive, whose url is returned;
+    the others are built in background, and the url of the job status is
+    returned (see archive_status)
+    """
     items = request.POST.getlist('items')
     renditions = request.POST.getlist('renditions')
     
     compression_type = request.POST.get('compression_type', 'zip')    
+    if compression_type not in archive.SUFFIXES:
+        compression_type = 'zip'
     
-    if renditions and items:
-        suffix = '.' + compression_type
-        tmp = tempfile.mkstemp(prefix='archive-', suffix= suffix, dir= settings.MEDIADART_STORAGE)[1]
-        
-        if compression_type == 'zip':            
-            import zipfile
-            archive = zipfile.ZipFile(tmp,  'w')
-            
-        else:
-            from tarfile import TarFileCompat as ArchiveFile
-            import tarfile
-            archive = tarfile.TarFileCompat(tmp, 'w', compression = tarfile.TAR_GZIPPED)
-                
-        for item in items:    
-            
-            for rendition in renditions:
-                try:
-                    c = Component.objects.get(item__pk = item,  variant__pk = rendition)
-                    file = os.path.join(settings.MEDIADART_STORAGE, c.uri)
-                    my_file_name = ''
-                    try:
-                        file_name = os.path.splitext(c.item.get_file_name())[0]                       
-                        ext = os.path.splitext(c.item.get_file_name())[1]                       
-                        my_file_name =  file_name + '_' +  c.variant.name +  ext 
-                    except:
-                        my_file_name = c.item.get_file_name() + '_' +  c.variant.name
-                    #file_name = c.uri 
+    if not (renditions and items):
+        return HttpResponse(simplejson.dumps({'success': False}))
 
-                    
-                    archive.write(file, my_file_name)
+    entries = archive.get_entries(items, renditions)
+    if archive.can_stream(entries, compression_type):
+        query = urllib.urlencode([('items', i) for i in items] + [('renditions', r) for r in renditions])
+        return HttpResponse(simplejson.dumps({'success': True,  'url': '/download_archive/?' + query}))
 
-                except Component.DoesNotExist:
-                    continue
-        archive.close()
-    
-    return HttpResponse(simplejson.dumps({'success': True,  'url':'/storage/' + os.path.basename(tmp) }))
+    name = archive.start_job(entries, compression_type)
+    return HttpResponse(simplejson.dumps({'success': True,  'status_url': '/archive_status/%s/' % name}))
+
+@login_required
+def download_archive(request):
+    """
+    Streams a zip archive of the given renditions of the given items
+    """
+    entries = archive.get_entries(request.GET.getlist('items'), request.GET.getlist('renditions'))
+    response = HttpResponse(archive.stream_zip(entries), mimetype='application/zip')
+    response['Content-Disposition'] = 'attachment; filename=renditions.zip'
+    return response
+
+@login_required
+def archive_status(request, name):
+    """
+    Returns the status of the job building the archive name, and its url when ready
+    """
+    status = archive.get_status(name)
+    status['success'] = status['status'] != 'unknown'
+    return HttpResponse(simplejson.dumps(status))
@@ -16,78 +16,22 @@
 #
 #########################################################################
 
-import sys
-import os
-import re
-
-from dam.metadata.models import MetadataProperty, MetadataValue
-from dam.core.dam_metadata.models import XMPStructure
+from dam.metadata.models import MetadataChange
+import logging
+logger = logging.getLogger('dam')
 
 def reset_modified_flag(comp):
 
     """
     Reset flags modified in Component and in its metadata
     """
-    comp_metadata = comp.metadata.filter(modified = True)
-    for m in comp_metadata:
-        m.modified = False
-        m.save()
-    comp.modified_metadata = False
-    comp.save()
+    MetadataChange.objects.reset(comp)
 
 def synchronize_metadata(component):
 
-    i = component.item
-    c = component
-
-    structures = [s.name for s in XMPStructure.objects.all()]
-    changes = {}
-    changes['item'] = {}
-    my_metadata = i.metadata.filter(modified = True)
-    for im in my_metadata:
-        if im.schema.namespace.uri not in changes['item']:
-            changes['item'][im.schema.namespace.uri] = {'prefix': im.schema.namespace.prefix, 'fields': {}}
-        if im.schema.field_name not in changes['item'][im.schema.namespace.uri]['fields']:
-            if im.schema.type == 'lang':
-                changes['item'][im.schema.namespace.uri]['fields'][im.schema.field_name] = {'type':im.schema.type,'is_array':im.schema.is_array,'value':[im.value],'qualifier':[im.language], 'xpath':[]}
-            elif im.schema.type in structures:
-                changes['item'][im.schema.namespace.uri]['fields'][im.schema.field_name] = {'type':im.schema.type,'is_array':im.schema.is_array,'value':[im.value],'qualifier':[],'xpath':[im.xpath]}
-            else:
-                changes['item'][im.schema.namespace.uri]['fields'][im.schema.field_name] = {'type':im.schema.type,'is_array':im.schema.is_array,'value':[im.value],'qualifier':[],'xpath':[]}
-        else:
-            changes['item'][im.schema.namespace.uri]['fields'][im.schema.field_name]['value'].append(im.value)
-            if im.schema.type == 'lang':
-                changes['item'][im.schema.namespace.uri]['fields'][im.schema.field_name]['qualifier'].append(im.language)
-            elif im.schema.type in structures:
-                changes['item'][im.schema.namespace.uri]['fields'][im.schema.field_name]['xpath'].append(im.xpath)
-
-    print "CHANGED IN ITEM: ", changes['item']
-
-    changes[c.variant.name] = {}
-    for k,v in changes['item'].iteritems():
-        changes[c.variant.name][k] = v
-    
-    my_metadata = c.metadata.filter(modified = True)
-    for m in my_metadata:
-        print '    CHANGED IN ',c.variant.name, ': ',m.schema, m.schema.caption, m.schema.namespace, m.schema.field_name,m.schema.is_array,m.schema.is_choice, m.value	, m.schema.type, m.xpath, m.language, m.modified
-    
-        if m.schema.namespace.uri not in changes[c.variant.name]:
-            changes[c.variant.name][m.schema.namespace.uri] = {'prefix': m.schema.namespace.prefix, 'fields': {}}
-            print 'new namespace ', m.schema.namespace
-        if m.schema.field_name not in changes[c.variant.name][m.schema.namespace.uri]['fields']:
-            if m.schema.type == 'lang':
-                changes[c.variant.name][m.schema.namespace.uri]['fields'][m.schema.field_name] = {'type':m.schema.type,'is_array':m.schema.is_array,'value':[m.value],'qualifier':[m.language], 'xpath':[]}
-            elif m.schema.type in structures:
-                changes[c.variant.name][m.schema.namespace.uri]['fields'][m.schema.field_name] = {'type':m.schema.type,'is_array':m.schema.is_array,'value':[m.value],'qualifier':[],'xpath':[m.xpath]}
-            else:
-                changes[c.variant.name][m.schema.namespace.uri]['fields'][m.schema.field_name] = {'type':m.schema.type,'is_array':m.schema.is_array,'value':[m.value],'qualifier':[], 'xpath':[]}
-        else:
-            changes[c.variant.name][m.schema.namespace.uri]['fields'][m.schema.field_name]['value'].append(m.value)
-            if m.schema.type == 'lang':
-                changes[c.variant.name][m.schema.namespace.uri]['fields'][m.schema.field_name]['qualifier'].append(m.language)
-            elif m.schema.type in structures:
-                changes[c.variant.name][m.schema.namespace.uri]['fields'][m.schema.field_name]['xpath'].append(m.xpath)
-
-    print "     changes[",c.variant.name,"]:", changes[c.variant.name]
-    
-    return changes[c.variant.name]
+    """
+    Returns the modified metadata of component and of its item
+    """
+    changes = MetadataChange.objects.get_changes(component)
+    logger.debug('changes[%s]: %s' % (component.variant.name, changes))
+    return changes
@@ -25,6 +25,8 @@ package_list = [
 'dam/eventmanager',
 'dam/geo_features',
 'dam/metadata',
+'dam/metadata/management',
+'dam/metadata/management/commands',
 'dam/mprocessor',
 'dam/preferences',
 'dam/repository',